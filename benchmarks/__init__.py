@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# λOS benchmark suite: run with `ldmos.py --bench`
+"""Benchmark runner with a stored baseline and regression gating
+
+Cases (see cases.py) are timed with an auto-ranged loop: the loop count
+grows until one run takes MIN_RUN seconds, then REPEAT runs are timed.
+Raw times depend on the machine and on whatever else it is doing, so
+each run is paired with a run of a fixed pure-Python calibration loop
+right before it, and the case's cost is the median of the time ratios
+of the pairs. The baseline stores these normalized costs; a case
+regresses when its cost exceeds the baseline's by more than the
+threshold.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import statistics
+
+from . import cases
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Percent slower than the baseline that counts as a regression
+DEFAULT_THRESHOLD = 25.0
+
+MIN_RUN = 0.05
+REPEAT = 7
+
+def calibration():
+    """The fixed workload results are normalized by"""
+    total = 0
+    for i in range(20000):
+        total += i * i % 7
+    return total
+
+def autorange(func, min_run=MIN_RUN):
+    """Calls of func() that take at least min_run seconds"""
+    loops = 1
+    while True:
+        elapsed = timed(func, loops)
+        if elapsed >= min_run or loops >= 1 << 20:
+            return loops
+        loops *= 2 if elapsed * 10 >= min_run else 10
+
+def timed(func, loops):
+    clock = time.perf_counter
+    start = clock()
+    for _ in range(loops):
+        func()
+    return clock() - start
+
+def measure(func, repeat=REPEAT):
+    """(best seconds per call of func, median cost in calibration runs)"""
+    loops, unit_loops = autorange(func), autorange(calibration)
+    ratios = []
+    best = float('inf')
+    for _ in range(repeat):
+        unit = timed(calibration, unit_loops) / unit_loops
+        seconds = timed(func, loops) / loops
+        best = min(best, seconds)
+        ratios.append(seconds / unit)
+    return best, statistics.median(ratios)
+
+def load_baseline(path):
+    """Normalized cost by case name, or {} if there is no baseline yet"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f).get('results', {})
+    except FileNotFoundError:
+        return {}
+
+def save_baseline(path, results, unit):
+    data = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'calibration_seconds': round(unit, 6),
+        'results': {name: float(f"{cost:.4g}") for name, cost in sorted(results.items())},
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+
+def run(ldmos, pattern=None, baseline_path=BASELINE_FILE, threshold=DEFAULT_THRESHOLD, update=False,
+        out=sys.stdout):
+    """Run the suite against the baseline; returns the process exit status
+    
+    ldmos is the running λOS module (benchmarks don't import it, so a
+    script run doesn't load it twice). Only cases whose name contains
+    `pattern` run. With update the results become the new baseline
+    (merged into it when a pattern is given) and nothing fails.
+    """
+    baseline = load_baseline(baseline_path)
+    selected = [case for case in cases.collect(ldmos) if not pattern or pattern in case.name]
+    if not selected:
+        print(f"No benchmarks match {pattern!r}", file=out)
+        return 2
+    
+    # Shells made by the cases write their history and state here
+    workdir = tempfile.mkdtemp(prefix='ldmos-bench-')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        unit = measure(calibration)[0]
+        print(f"λOS benchmarks: {len(selected)} cases, calibration {unit * 1e3:.3f} ms, "
+              f"threshold {threshold:g}%", file=out)
+        print(f"  {'case':34} {'time':>12} {'cost':>10} {'baseline':>10} {'change':>8}", file=out)
+        results = {}
+        regressions = []
+        for case in selected:
+            seconds, cost = case.run(measure)
+            results[case.name] = cost
+            expected = baseline.get(case.name)
+            if expected is None:
+                change, status = "", "new"
+            else:
+                percent = (cost / expected - 1) * 100
+                change = f"{percent:+.1f}%"
+                status = "REGRESSED" if percent > threshold else ""
+                if status:
+                    regressions.append(case.name)
+            print(f"  {case.name:34} {format_seconds(seconds):>12} {cost:10.3f} "
+                  f"{'' if expected is None else format(expected, '.3f'):>10} {change:>8} {status}",
+                  file=out, flush=True)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    if update:
+        if pattern:
+            results = {**baseline, **results}
+        save_baseline(baseline_path, results, unit)
+        print(f"Baseline written to {baseline_path}", file=out)
+        return 0
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {threshold:g}%: {', '.join(regressions)}", file=out)
+        return 1
+    print("No regressions", file=out)
+    return 0
+
+def format_seconds(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('µs', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3f} {unit}"
+    return f"{seconds / 1e-9:.1f} ns"
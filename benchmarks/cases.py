@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""The benchmark cases, one per subsystem and size
+
+A Case pairs a name with a setup function that returns the callable to
+time; setup runs once per case, outside the timing. Names are
+"<subsystem>/<variant>" so a substring picks a group (--bench-filter
+render).
+"""
+import os
+import sys
+import subprocess
+
+class Case:
+    __slots__ = ('name', 'setup')
+    
+    def __init__(self, name, setup):
+        self.name = name
+        self.setup = setup
+    
+    def run(self, measure):
+        """measure() of what setup() returns: (seconds per call, normalized cost)"""
+        return measure(self.setup())
+
+def _shell(ldmos, backend='256'):
+    """A batch shell with a fixed backend and no clock in the HUD"""
+    shell = ldmos.EnhancedλOS()
+    shell.interactive = False
+    shell.headless = True
+    shell.settings['show_time'] = False
+    shell.set_color_backend(backend)
+    return shell
+
+def render_cases(ldmos):
+    """One eye frame per mode and theme; frames advance so layers redraw"""
+    def case(mode, theme):
+        def setup():
+            shell = _shell(ldmos)
+            shell.settings['theme'] = theme
+            frames = iter(range(1 << 30))
+            shell.render_eye_frame(0, 1 << 30, mode)
+            return lambda: shell.render_eye_frame(next(frames), 1 << 30, mode)
+        return Case(f"render/{mode}/{theme}", setup)
+    return [case(mode, theme) for mode in ('single', 'triple', 'quantum') for theme in ldmos.BUILTIN_THEMES]
+
+def gradient_cases(ldmos):
+    text = "λOS gradient benchmark " * 40
+    def case(backend):
+        def setup():
+            c = ldmos.get_color_backend(backend).c
+            return lambda: [c(key, text) for key in ldmos.GRADIENTS_256]
+        return Case(f"gradient/{backend}", setup)
+    return [case(backend) for backend in ('truecolor', '256', '16')]
+
+def lambda_cases(ldmos):
+    """Expressions that reference many variables, all substituted before evaluation"""
+    def case(count):
+        def setup():
+            shell = _shell(ldmos)
+            names = [f"var_{chr(97 + i // 26)}{chr(97 + i % 26)}" for i in range(count)]
+            for i, name in enumerate(names):
+                shell.lambda_evaluator([f"{name} = {i + 1}"])
+            expression = " + ".join(names)
+            return lambda: shell.lambda_evaluator([expression])
+        return Case(f"lambda/variables-{count}", setup)
+    return [case(count) for count in (5, 50, 200)]
+
+def church_cases(ldmos):
+    def case(n):
+        def setup():
+            shell = _shell(ldmos)
+            return lambda: shell.church_converter([n])
+        return Case(f"church/{n}", setup)
+    return [case(n) for n in (10, 100, 500)]
+
+def math_cases(ldmos):
+    def case(name, method, args):
+        def setup():
+            shell = _shell(ldmos)
+            handler = getattr(shell, method)
+            return lambda: handler(list(args))
+        return Case(name, setup)
+    cases = [case(f"prime/{n}", 'prime_checker', [n]) for n in (97, 1000003, 2147483647)]
+    cases += [case(f"factorial/{n}", 'factorial_calculator', [n]) for n in (5, 10)]
+    cases += [case(f"fibonacci/{n}", 'fibonacci_generator', [n]) for n in (10, 20)]
+    
+    def stream(count):
+        def setup():
+            shell = _shell(ldmos)
+            return lambda: sum(1 for _ in shell.fibonacci_generator(['seq', count]))
+        return Case(f"fibonacci/seq-{count}", setup)
+    return cases + [stream(1000)]
+
+def state_cases(ldmos, history=100000, variables=1000):
+    """save/load with a full history and many variables"""
+    def loaded_shell():
+        shell = _shell(ldmos)
+        shell.history = ldmos.HistoryStore(None, history)
+        shell.history.extend(f"prime {i}" for i in range(history))
+        shell.variables.update({f"v{i}": str(i) for i in range(variables)})
+        return shell
+    
+    def save():
+        shell = loaded_shell()
+        return lambda: shell.save_state(['bench_state.json'])
+    
+    def load():
+        shell = loaded_shell()
+        shell.save_state(['bench_state.json'])
+        return lambda: shell.load_state(['bench_state.json'])
+    return [Case(f"state/save-{history}", save), Case(f"state/load-{history}", load)]
+
+def dispatch_cases(ldmos):
+    """process_command end to end, for a cheap command and a plain expression"""
+    def case(line):
+        def setup():
+            shell = _shell(ldmos)
+            return lambda: shell.process_command(line)
+        return Case(f"dispatch/{line.replace(' ', '-')}", setup)
+    return [case(line) for line in ('prime 97', 'church 3', '2+2', 'help quick')]
+
+def startup_cases(ldmos):
+    """A fresh interpreter running one command"""
+    argv = [sys.executable, os.path.abspath(ldmos.__file__), '-c', 'prime 97']
+    env = dict(os.environ, NO_COLOR='1')
+    
+    def setup():
+        return lambda: subprocess.run(argv, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL, env=env, check=False)
+    return [Case("startup/cold", setup)]
+
+def collect(ldmos):
+    """Every case, in report order"""
+    return (render_cases(ldmos) + gradient_cases(ldmos) + lambda_cases(ldmos) + church_cases(ldmos)
+            + math_cases(ldmos) + state_cases(ldmos) + dispatch_cases(ldmos) + startup_cases(ldmos))
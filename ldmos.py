@@ -1,425 +1,3486 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 # λOS Enhanced - Colored Shell with Advanced Features
-import os
 import time
+_IMPORT_STARTED = time.perf_counter()  # for --startup-bench
+import os
+import sys
 import math
 import random
 import json
+import re
+import struct
+import mmap
+import bisect
+from array import array
 from datetime import datetime
 from typing import Dict, List, Any, Optional
 import threading
+import itertools
+import collections
+import operator
+import functools
+import contextlib
+import zlib
+
+# Default settings (also used by `settings reset`)
+DEFAULT_SETTINGS = {
+    'theme': 'ocean',
+    'animation_speed': 0.1,
+    'prompt_style': 'λ>',
+    'autosave': True,
+    'sound_effects': False,
+    'color_mode': 'gradient',
+    'auto_complete': True,
+    'show_time': True,
+    'quantum_mode': False,
+    'dolphin_count': 3,
+    'eye_type': 'single',
+    'particle_effects': 'system',
+    'particle_count': 400,
+    'trail_length': 3,
+    'frame_budget_ms': 0,
+    'history_capacity': 1000000,
+    'color_backend': 'auto',
+}
+
+# Kept in state_dir(), not the working directory
+STATE_FILE = 'λos_state.json'
+HISTORY_FILE = 'λos_history.bin'
+
+# How often a shell checks whether other sessions changed the state file
+STATE_POLL_SECONDS = 0.2
+
+# Server sessions keep their history in memory
+SESSION_HISTORY_CAPACITY = 10000
+
+# How long the server waits for a client's hello before going without
+HELLO_SECONDS = 0.5
+
+# Expression budgets (see ExpressionCost): estimates above the REJECT limits
+# are refused, above the INLINE limits they run in a worker with these limits
+EVAL_REJECT_BITS = 1 << 24
+EVAL_REJECT_LENGTH = 10 ** 8
+EVAL_REJECT_WORK = 10 ** 10
+EVAL_INLINE_BITS = 1 << 12
+EVAL_INLINE_LENGTH = 10 ** 5
+EVAL_INLINE_WORK = 10 ** 6
+EVAL_CPU_SECONDS = 2
+EVAL_MEMORY_BYTES = 256 << 20
+EVAL_RESULT_CHARS = 10000
+
+# The names expressions are evaluated with (no builtins)
+MATH_NAMES = {'math': math, 'sin': math.sin, 'cos': math.cos,
+              'tan': math.tan, 'pi': math.pi, 'e': math.e}
+
+# Larger numbers overflow the stack in church_to_int
+MAX_CHURCH_NUMERAL = 500
+
+# Cursor home + clear screen, used between animation frames
+CLEAR_SCREEN = '\033[H\033[2J'
+
+# Eye animation canvas, inside the border
+EYE_WIDTH = 80
+EYE_HEIGHT = 24
+
+# Built-in themes. Colors are ANSI names or '#rrggbb'; border and hud may
+# also be GRADIENT_* keys. User themes in themes/*.json override any of
+# these keys on top of the theme they "extend" (ocean by default).
+BUILTIN_THEMES = {
+    'ocean': {
+        'accent': 'BR_CYAN', 'border': 'BR_CYAN', 'hud': 'BR_WHITE',
+        'wave': ['BLUE', 'CYAN', 'BR_CYAN'],
+        'particles': ['BR_BLUE', 'BLUE', 'CYAN', 'BR_CYAN'],
+        'orbit': ['BR_CYAN', 'BR_BLUE', 'CYAN'],
+        'eye': {'kx': 0.2, 'ky': 0.15, 'kt': 1.5,
+                'colors': ['BR_BLUE', 'BLUE', 'CYAN', 'BR_CYAN', 'BLUE', 'BR_BLUE']},
+    },
+    'fire': {
+        'accent': 'BR_RED', 'border': 'BR_RED', 'hud': 'BR_WHITE',
+        'wave': ['RED', 'YELLOW', 'BR_YELLOW'],
+        'particles': ['BR_RED', 'RED', 'YELLOW', 'BR_YELLOW'],
+        'orbit': ['BR_RED', 'BR_YELLOW', 'RED'],
+        'eye': {'kx': 0.3, 'ky': 0.2, 'kt': 2,
+                'colors': ['BR_RED', 'RED', 'YELLOW', 'BR_YELLOW', 'RED', 'BR_RED']},
+    },
+    'forest': {
+        'accent': 'BR_GREEN', 'border': 'BR_GREEN', 'hud': 'BR_WHITE',
+        'wave': ['MAGENTA', 'CYAN', 'BR_CYAN'],
+        'particles': ['BR_GREEN', 'GREEN', 'BR_YELLOW', 'YELLOW'],
+        'orbit': ['BR_GREEN', 'GREEN', 'BR_YELLOW'],
+        'eye': {'kx': 0.25, 'ky': 0.18, 'kt': 1.8,
+                'colors': ['BR_GREEN', 'GREEN', 'BR_YELLOW', 'YELLOW', 'GREEN', 'BR_GREEN']},
+    },
+    'rainbow': {
+        'accent': 'BR_MAGENTA', 'border': 'GRADIENT_RAINBOW', 'hud': 'GRADIENT_RAINBOW',
+        'wave': ['MAGENTA', 'CYAN', 'BR_CYAN'],
+        'particles': ['BR_MAGENTA', 'MAGENTA', 'BR_CYAN', 'CYAN'],
+        'orbit': ['BR_MAGENTA', 'BR_CYAN', 'BR_BLUE'],
+        'eye': {'kx': 0.2, 'ky': 0.1, 'kt': 3,
+                'colors': ['BR_MAGENTA', 'MAGENTA', 'BR_CYAN', 'CYAN', 'BR_BLUE', 'BLUE']},
+    },
+}
+
+# User themes: *.json files with the keys above
+THEME_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'themes')
+
+# Glyphs of the legacy particle effect
+PARTICLE_GLYPHS = ('∙', '∘', '⋅', '○', '●', '⋆', '✦', '✧', '❂', '❉')
+
+# Wave background glyphs, weakest to strongest
+WAVE_GLYPHS = ('·', '∙', '∘', '⊙', '◉')
+
+# Quick commands 0-9
+QUICK_COMMANDS = {
+    '0': 'help',
+    '1': 'eye 30',
+    '2': 'eye 20',
+    '3': 'demo',
+    '4': 'settings show',
+    '5': 'settings theme ocean',
+    '6': 'settings theme fire',
+    '7': 'church 7',
+    '8': 'clear',
+    '9': 'quantum',
+}
+
+# The guided tour run by `demo`: (command, description)
+DEMO_SEQUENCE = [
+    ("eye 10", "Quick eye animation"),
+    ("λ x=10", "Define variable x = 10"),
+    ("λ x/2", "Calculate x/2"),
+    ("church 3", "Show Church numeral 3"),
+    ("prime 17", "Check if 17 is prime"),
+    ("fibonacci 8", "First 8 Fibonacci numbers"),
+    ("factorial 5", "Calculate 5!"),
+    ("settings theme fire", "Change to fire theme"),
+    ("quantum", "Toggle quantum mode"),
+    ("settings show", "Show current settings"),
+]
+
+# Pipeline separator: a '|' with whitespace on both sides (so `λ 5|3` is untouched)
+_PIPE = re.compile(r'\s+\|\s+')
+
+def iter_chunks(result):
+    """Output chunks of a command result: a string, None or an iterable of strings"""
+    if result is None:
+        return iter(())
+    if isinstance(result, str):
+        return iter((result,))
+    return iter(result)
+
+def iter_lines(chunks):
+    """Split a stream of chunks into lines (without newlines), lazily"""
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        if "\n" in pending:
+            *lines, pending = pending.split("\n")
+            yield from lines
+    if pending:
+        yield pending
+
+# ANSI escape codes by name
+ANSI_COLORS = {
+    'RST': '\033[0m',
+    'BOLD': '\033[1m',
+    'DIM': '\033[2m',
+    'ITALIC': '\033[3m',
+    'UNDERLINE': '\033[4m',
+    'BLINK': '\033[5m',
+    'REVERSE': '\033[7m',
+
+    # Standard colors
+    'BLACK': '\033[30m',
+    'RED': '\033[31m',
+    'GREEN': '\033[32m',
+    'YELLOW': '\033[33m',
+    'BLUE': '\033[34m',
+    'MAGENTA': '\033[35m',
+    'CYAN': '\033[36m',
+    'WHITE': '\033[37m',
+
+    # Bright colors
+    'BR_BLACK': '\033[90m',
+    'BR_RED': '\033[91m',
+    'BR_GREEN': '\033[92m',
+    'BR_YELLOW': '\033[93m',
+    'BR_BLUE': '\033[94m',
+    'BR_MAGENTA': '\033[95m',
+    'BR_CYAN': '\033[96m',
+    'BR_WHITE': '\033[97m',
+
+    # Backgrounds
+    'BG_BLACK': '\033[40m',
+    'BG_RED': '\033[41m',
+    'BG_GREEN': '\033[42m',
+    'BG_YELLOW': '\033[43m',
+    'BG_BLUE': '\033[44m',
+    'BG_MAGENTA': '\033[45m',
+    'BG_CYAN': '\033[46m',
+    'BG_WHITE': '\033[47m',
+}
+
+# Gradient palettes as xterm-256 color numbers, cycled per character
+GRADIENTS_256 = {
+    'GRADIENT_RAINBOW': [196, 202, 208, 214, 220, 226, 190, 154, 118, 82, 46, 47, 48, 49, 51,
+                         45, 39, 33, 27, 21, 57, 93, 129, 165, 201, 200, 199, 198, 197],
+    'GRADIENT_FIRE': [232, 52, 88, 124, 160, 196, 202, 208, 214, 220, 226],
+    'GRADIENT_OCEAN': [17, 18, 19, 20, 21, 27, 33, 39, 45, 51, 87],
+    'GRADIENT_FOREST': [22, 28, 34, 40, 46, 47, 48, 49, 50, 51, 85],
+}
+
+# The same gradients for 16-color terminals
+GRADIENTS_16 = {
+    'GRADIENT_RAINBOW': ['BR_RED', 'BR_YELLOW', 'BR_GREEN', 'BR_CYAN', 'BR_BLUE', 'BR_MAGENTA'],
+    'GRADIENT_FIRE': ['RED', 'BR_RED', 'YELLOW', 'BR_YELLOW'],
+    'GRADIENT_OCEAN': ['BLUE', 'BR_BLUE', 'CYAN', 'BR_CYAN'],
+    'GRADIENT_FOREST': ['GREEN', 'BR_GREEN', 'CYAN', 'BR_CYAN'],
+}
+
+COLOR_BACKENDS = ['auto', 'truecolor', '256', '16', 'plain']
+
+PARTICLE_MODES = ['off', 'legacy', 'system']
+
+# Settings restricted to a fixed set of values
+SETTING_CHOICES = {
+    'color_backend': COLOR_BACKENDS,
+    'particle_effects': PARTICLE_MODES,
+}
+
+# Values older state files may hold, and what they mean now
+LEGACY_SETTING_VALUES = {
+    'particle_effects': {True: 'system', False: 'off'},
+}
+
+def upgrade_settings(settings):
+    """Replace legacy setting values in place"""
+    for key, mapping in LEGACY_SETTING_VALUES.items():
+        value = settings.get(key)
+        if isinstance(value, bool) and value in mapping:
+            settings[key] = mapping[value]
+    return settings
+
+class SettingsStore(dict):
+    """The shell's settings: a dict that tells subscribers what changed
+    
+    Every write (item assignment, update, |=, replace) goes through
+    update(), which upgrades legacy values, stores the new ones and calls
+    each subscriber whose keys include a changed one, once, with the set
+    of changed keys. Values derived from settings are cached and dropped
+    by a subscriber instead of being recomputed on every use.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._subscribers = []
+        self.update(*args, **kwargs)
+    
+    def subscribe(self, keys, callback):
+        """Call callback(changed keys) after any of `keys` changes (None: any key)"""
+        self._subscribers.append((None if keys is None else frozenset(keys), callback))
+    
+    def __setitem__(self, key, value):
+        self.update({key: value})
+    
+    def __ior__(self, other):
+        self.update(other)
+        return self
+    
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.update({key: default})
+        return self[key]
+    
+    def update(self, *args, **kwargs):
+        values = upgrade_settings(dict(*args, **kwargs))
+        changed = {key for key, value in values.items() if not self._holds(key, value)}
+        super().update(values)
+        self._notify(changed)
+    
+    def replace(self, values):
+        """Make the settings exactly `values` (settings reset)"""
+        values = upgrade_settings(dict(values))
+        changed = {key for key in self if key not in values}
+        changed.update(key for key, value in values.items() if not self._holds(key, value))
+        super().clear()
+        super().update(values)
+        self._notify(changed)
+    
+    def _holds(self, key, value):
+        # True == 1, but a bool setting that became an int has changed
+        current = self.get(key, self)
+        return type(current) is type(value) and current == value
+    
+    def _notify(self, changed):
+        if changed:
+            for keys, callback in self._subscribers:
+                if keys is None or not keys.isdisjoint(changed):
+                    callback(changed)
+
+# The 16 basic color names in xterm palette order
+ANSI_COLOR_ORDER = ['BLACK', 'RED', 'GREEN', 'YELLOW', 'BLUE', 'MAGENTA', 'CYAN', 'WHITE',
+                    'BR_BLACK', 'BR_RED', 'BR_GREEN', 'BR_YELLOW', 'BR_BLUE', 'BR_MAGENTA', 'BR_CYAN', 'BR_WHITE']
+
+def parse_color(spec):
+    """RGB of a basic color name or '#rrggbb'"""
+    if isinstance(spec, str):
+        if re.fullmatch(r'#[0-9a-fA-F]{6}', spec):
+            return tuple(int(spec[i:i + 2], 16) for i in (1, 3, 5))
+        if spec in ANSI_COLOR_ORDER:
+            return xterm_rgb(ANSI_COLOR_ORDER.index(spec))
+    raise ValueError(f"unknown color {spec!r}")
+
+def nearest_xterm(rgb, indexes):
+    """The xterm palette index among `indexes` closest to rgb"""
+    return min(indexes, key=lambda index: sum((a - b) ** 2 for a, b in zip(xterm_rgb(index), rgb)))
+
+def xterm_rgb(index):
+    """RGB of an xterm-256 palette color"""
+    if index < 16:
+        base = [(0, 0, 0), (128, 0, 0), (0, 128, 0), (128, 128, 0), (0, 0, 128), (128, 0, 128),
+                (0, 128, 128), (192, 192, 192), (128, 128, 128), (255, 0, 0), (0, 255, 0),
+                (255, 255, 0), (0, 0, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255)]
+        return base[index]
+    if index >= 232:
+        level = 8 + (index - 232) * 10
+        return (level, level, level)
+    index -= 16
+    steps = [0, 95, 135, 175, 215, 255]
+    return (steps[index // 36], steps[index // 6 % 6], steps[index % 6])
+
+def detect_color_backend(stream=None):
+    """Pick a backend from the terminal: NO_COLOR, isatty, COLORTERM, TERM"""
+    stream = stream or sys.stdout
+    if os.environ.get('NO_COLOR'):
+        return 'plain'
+    if not (hasattr(stream, 'isatty') and stream.isatty()):
+        return 'plain'
+    if os.environ.get('COLORTERM', '').lower() in ('truecolor', '24bit'):
+        return 'truecolor'
+    term = os.environ.get('TERM', '')
+    if term == 'dumb':
+        return 'plain'
+    if '256' in term:
+        return '256'
+    return '16'
+
+class Ansi256Backend:
+    """Named ANSI colors, gradients cycled through the xterm-256 palette
+    
+    Backends turn color names into output: c(key, text) returns the escape
+    for `key` followed by text, or a gradient-colored text for the
+    GRADIENT_* keys. Instances are shared (see get_color_backend).
+    """
+    name = '256'
+    smooth = False
+    
+    def __init__(self):
+        self.codes = ANSI_COLORS
+        self.reset = ANSI_COLORS['RST']
+        self.gradients = {key: [f'\033[38;5;{n}m' for n in palette]
+                          for key, palette in GRADIENTS_256.items()}
+    
+    def c(self, color_key, text=""):
+        code = self.codes.get(color_key)
+        if code is not None:
+            return code + text
+        palette = self.gradients.get(color_key)
+        if palette is not None:
+            return self.gradient(palette, text)
+        return self.reset + text
+    
+    def gradient(self, palette, text):
+        size = len(palette)
+        return "".join([palette[i % size] + char for i, char in enumerate(text)]) + self.reset
+    
+    def rgb_code(self, rgb):
+        """Escape for an arbitrary color (the nearest one this backend has)"""
+        return f'\033[38;5;{nearest_xterm(rgb, range(16, 256))}m'
+
+class Ansi16Backend(Ansi256Backend):
+    """Basic 16 colors only; gradients fall back to a few named colors"""
+    name = '16'
+    
+    def __init__(self):
+        super().__init__()
+        self.gradients = {key: [ANSI_COLORS[name] for name in palette]
+                          for key, palette in GRADIENTS_16.items()}
+    
+    def rgb_code(self, rgb):
+        return ANSI_COLORS[ANSI_COLOR_ORDER[nearest_xterm(rgb, range(16))]]
+
+class TruecolorBackend(Ansi256Backend):
+    """24-bit color: gradients are interpolated smoothly across the text"""
+    name = 'truecolor'
+    # Themes interpolate their palettes in RGB on this backend
+    smooth = True
+    
+    def __init__(self):
+        super().__init__()
+        self.stops = {key: [xterm_rgb(n) for n in palette] for key, palette in GRADIENTS_256.items()}
+        self._ramps = {}
+    
+    def c(self, color_key, text=""):
+        code = self.codes.get(color_key)
+        if code is not None:
+            return code + text
+        if color_key in self.stops:
+            ramp = self.ramp(color_key, len(text))
+            return "".join([ramp[i] + char for i, char in enumerate(text)]) + self.reset
+        return self.reset + text
+    
+    def ramp(self, color_key, length):
+        """`length` escapes spanning the whole gradient (cached)"""
+        ramp = self._ramps.get((color_key, length))
+        if ramp is None:
+            stops = self.stops[color_key]
+            ramp = []
+            for i in range(length):
+                position = i * (len(stops) - 1) / max(length - 1, 1)
+                low = min(int(position), len(stops) - 2)
+                mix = position - low
+                r, g, b = (round(a + (z - a) * mix) for a, z in zip(stops[low], stops[low + 1]))
+                ramp.append(f'\033[38;2;{r};{g};{b}m')
+            self._ramps[(color_key, length)] = ramp
+        return ramp
+    
+    def rgb_code(self, rgb):
+        return '\033[38;2;{};{};{}m'.format(*rgb)
+
+class PlainBackend:
+    """No escapes at all: color lookups return the text untouched"""
+    name = 'plain'
+    reset = ""
+    smooth = False
+    
+    def c(self, color_key, text=""):
+        return text
+    
+    def rgb_code(self, rgb):
+        return ""
+
+_COLOR_BACKEND_TYPES = {
+    'truecolor': TruecolorBackend,
+    '256': Ansi256Backend,
+    '16': Ansi16Backend,
+    'plain': PlainBackend,
+}
+_color_backends = {}
+
+def get_color_backend(name, stream=None):
+    """The shared backend instance for a name ('auto' detects one)"""
+    if name not in _COLOR_BACKEND_TYPES:
+        name = detect_color_backend(stream)
+    backend = _color_backends.get(name)
+    if backend is None:
+        backend = _color_backends[name] = _COLOR_BACKEND_TYPES[name]()
+    return backend
+
+def resolve_color(backend, spec, text=""):
+    """backend.c() that also takes '#rrggbb' colors"""
+    if spec.startswith('#'):
+        return backend.rgb_code(parse_color(spec)) + text
+    return backend.c(spec, text)
+
+def validate_theme(definition):
+    """Check a merged theme definition, raising ValueError on the first problem"""
+    def color(key, value, gradients=False):
+        if gradients and value in GRADIENTS_256:
+            return
+        try:
+            parse_color(value)
+        except ValueError:
+            raise ValueError(f"{key}: unknown color {value!r}") from None
+    
+    for key in ('accent', 'border', 'hud'):
+        color(key, definition.get(key), gradients=key != 'accent')
+    for key in ('wave', 'particles', 'orbit'):
+        palette = definition.get(key)
+        if not isinstance(palette, list) or not palette:
+            raise ValueError(f"{key}: expected a non-empty list of colors")
+        for value in palette:
+            color(key, value)
+    eye = definition.get('eye')
+    if not isinstance(eye, dict):
+        raise ValueError("eye: expected an object")
+    for key in ('kx', 'ky', 'kt'):
+        if isinstance(eye.get(key), bool) or not isinstance(eye.get(key), (int, float)):
+            raise ValueError(f"eye.{key}: expected a number")
+    if not isinstance(eye.get('colors'), list) or not eye['colors']:
+        raise ValueError("eye.colors: expected a non-empty list of colors")
+    for value in eye['colors']:
+        color('eye.colors', value)
+
+def load_themes(directories, builtins=BUILTIN_THEMES):
+    """(themes by name, errors) from the built-ins and *.json in the directories
+    
+    A theme file holds any of the built-in keys, applied on top of the
+    theme named by "extends" (ocean by default; files are read in name
+    order, so a theme can extend one loaded before it). Files that fail
+    to parse or validate are skipped and reported in errors.
+    """
+    themes = dict(builtins)
+    errors = []
+    for directory in directories:
+        try:
+            entries = sorted(os.listdir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            name, extension = os.path.splitext(entry)
+            if extension.lower() != '.json':
+                continue
+            try:
+                with open(os.path.join(directory, entry), encoding='utf-8') as f:
+                    data = json.load(f)
+                if not isinstance(data, dict):
+                    raise ValueError("expected a JSON object")
+                base = themes.get(data.pop('extends', 'ocean'))
+                if base is None:
+                    raise ValueError("extends an unknown theme")
+                definition = {**base, **data}
+                if isinstance(data.get('eye'), dict):
+                    definition['eye'] = {**base['eye'], **data['eye']}
+                validate_theme(definition)
+            except (OSError, ValueError) as e:
+                errors.append(f"{entry}: {e}")
+                continue
+            themes[name.lower()] = definition
+    return themes, errors
+
+class Theme:
+    """A theme compiled for one color backend
+    
+    Every color is resolved to its escape once, and the cell tables the
+    eye animation draws from are built up front, so coloring a cell is a
+    single indexed lookup. On smooth (truecolor) backends the eye palette
+    is interpolated in RGB instead of stepping between its colors.
+    """
+    
+    def __init__(self, name, definition, backend):
+        self.name = name
+        self.backend = backend
+        reset = self.reset = backend.c('RST')
+        code = functools.partial(resolve_color, backend)
+        self.accent = code(definition['accent'])
+        self.border = code(definition['border'])
+        self.hud_color = definition['hud']
+        self.orbit = [code(spec) for spec in definition['orbit']]
+        
+        # Waves: cells[int((value + 1) * 50)][glyph], the palette split
+        # evenly over the normalized phase
+        wave = [code(spec) for spec in definition['wave']]
+        thresholds = [int(i * 100 / len(wave)) for i in range(1, len(wave))]
+        rows = [[color + char + reset for char in WAVE_GLYPHS] for color in wave]
+        self.wave_cells = [rows[bisect.bisect_right(thresholds, percent)] for percent in range(101)]
+        
+        # Particles: [color][glyph] for the legacy effect, and one cell per
+        # density level that moves along the palette with the glyphs
+        particles = [code(spec) for spec in definition['particles']]
+        self.particle_cells = [[color + char + reset for char in PARTICLE_GLYPHS] for color in particles]
+        glyphs = ParticleSystem.GLYPHS
+        self.density_cells = [particles[level * len(particles) // len(glyphs)] + glyph + reset
+                              for level, glyph in enumerate(glyphs)]
+        
+        eye = definition['eye']
+        self.eye_k = (eye['kx'], eye['ky'], eye['kt'])
+        self.eye_lut = self._phase_lut(eye['colors'])
+    
+    def _phase_lut(self, colors):
+        """The eye color escape for each quantized phase of sin()"""
+        backend = self.backend
+        count = len(colors)
+        positions = [(math.sin(2 * math.pi * step / PHASE_STEPS) + 1) / 2 * (count - 1)
+                     for step in range(PHASE_STEPS)]
+        if not backend.smooth or count == 1:
+            codes = [resolve_color(backend, spec) for spec in colors]
+            return [codes[int(position)] for position in positions]
+        
+        stops = [parse_color(spec) for spec in colors]
+        escapes = {}
+        lut = []
+        for position in positions:
+            low = min(int(position), count - 2)
+            mix = position - low
+            rgb = tuple(round(a + (z - a) * mix) for a, z in zip(stops[low], stops[low + 1]))
+            escape = escapes.get(rgb)
+            if escape is None:
+                escape = escapes[rgb] = backend.rgb_code(rgb)
+            lut.append(escape)
+        return lut
+    
+    def hud(self, text):
+        """text in the HUD color (gradients span the text)"""
+        return resolve_color(self.backend, self.hud_color, text)
+
+def locked_file(file):
+    """Context manager holding an exclusive advisory flock() on an open file
+    
+    A no-op for in-memory stores (file None) and where there's no fcntl
+    (Windows), where sessions share files without locking.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+    if file is None or fcntl is None:
+        return contextlib.nullcontext()
+    return _flock(fcntl, file.fileno())
+
+@contextlib.contextmanager
+def _flock(fcntl, fd):
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+def _grams(text):
+    """Set of 1- to 4-character substrings of text"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    grams.update(text[i:i + 3] for i in range(len(text) - 2))
+    grams.update(text[i:i + 4] for i in range(len(text) - 3))
+    return grams
+
+class HistoryFilter:
+    """Per-segment gram bitmaps that let a history search skip segments
+    
+    The ring's slots are split into segments of SEGMENT_RECORDS; each has
+    a FILTER_BYTES bitmap with one bit set (crc32) for every 1-4 character
+    substring of its live entries' lowercased text. A search only scans
+    the segments whose bitmap has all of the needle's bits, so a miss costs
+    a few bit tests per segment. False positives only cost a scan.
+    
+    The bitmaps live next to the ring file (in memory for in-memory
+    stores), so they survive restarts and are shared between sessions;
+    the header records how far into the history they are up to date.
+    When an append starts reusing a segment the bitmap is rebuilt from
+    the entries still live in it, so overwritten entries don't saturate it.
+    """
+    MAGIC = b'LDMI'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIQQ')  # magic, version, capacity, seq indexed up to
+    HEADER_SIZE = 64
+    SEGMENT_RECORDS = 256
+    FILTER_BYTES = 8192
+    
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.segments = -(-capacity // self.SEGMENT_RECORDS)
+        size = self.HEADER_SIZE + self.segments * self.FILTER_BYTES
+        self._file = None
+        if path is None:
+            # Grown a segment at a time as the history fills
+            self._buf = bytearray(self.HEADER_SIZE)
+            self._write_header(0)
+            return
+        
+        self._file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b')
+        header = self._file.read(self.HEADER.size)
+        valid = False
+        if len(header) == self.HEADER.size:
+            magic, version, stored_capacity, indexed = self.HEADER.unpack(header)
+            valid = magic == self.MAGIC and version == self.VERSION and stored_capacity == capacity
+        if not valid:
+            self._file.truncate(0)
+        # Sparse: pages of segments never written take no space
+        self._file.truncate(size)
+        self._buf = mmap.mmap(self._file.fileno(), size)
+        if not valid:
+            self._write_header(0)
+    
+    def _write_header(self, indexed):
+        self.HEADER.pack_into(self._buf, 0, self.MAGIC, self.VERSION, self.capacity, indexed)
+    
+    @property
+    def indexed(self):
+        """Entries below this sequence number are in the bitmaps"""
+        return self.HEADER.unpack_from(self._buf, 0)[3]
+    
+    @classmethod
+    def probes(cls, grams):
+        """(byte offset in a bitmap, bit mask) for each gram"""
+        bits = cls.FILTER_BYTES * 8 - 1
+        probes = set()
+        for gram in grams:
+            bit = zlib.crc32(gram.encode('utf-8')) & bits
+            probes.add((bit >> 3, 1 << (bit & 7)))
+        return probes
+    
+    def may_contain(self, segment, probes):
+        """Whether the segment can hold an entry with all the probed grams"""
+        base = self.HEADER_SIZE + segment * self.FILTER_BYTES
+        if base >= len(self._buf):
+            return False
+        buf = self._buf
+        for offset, mask in probes:
+            if not buf[base + offset] & mask:
+                return False
+        return True
+    
+    def add(self, ring, seq):
+        """Index entry seq of ring; entries must be added in order"""
+        slot = seq % ring.capacity
+        segment, start = divmod(slot, self.SEGMENT_RECORDS)
+        base = self.HEADER_SIZE + segment * self.FILTER_BYTES
+        if base >= len(self._buf):
+            self._buf.extend(bytes(base + self.FILTER_BYTES - len(self._buf)))
+        buf = self._buf
+        if start == 0:
+            # Reusing the segment: keep only the entries still live in it
+            buf[base:base + self.FILTER_BYTES] = bytes(self.FILTER_BYTES)
+            end = min(slot + self.SEGMENT_RECORDS, ring.capacity)
+            for other in range(slot + 1, end):
+                entry = ring.entry(seq - slot + other - ring.capacity)
+                if entry is not None:
+                    for offset, mask in self.probes(_grams(entry[3].lower())):
+                        buf[base + offset] |= mask
+        for offset, mask in self.probes(_grams(ring.entry(seq)[3].lower())):
+            buf[base + offset] |= mask
+        self._write_header(seq + 1)
+    
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            self._buf.flush()
+            self._buf.close()
+            self._file.close()
+
+class HistoryStore:
+    """Command history kept in a memory-mapped ring buffer file.
+    
+    Records have a fixed size, so entry number `seq` lives in slot
+    `seq % capacity`; the file grows in chunks until it reaches capacity and
+    then wraps, overwriting the oldest entries. Each record holds the
+    timestamp, exit status and (UTF-8, truncated) command text.
+    
+    Searches go through a HistoryFilter: gram bitmaps per segment of the
+    ring, kept in a file next to it and updated by append(), so a search
+    scans only the segments that can match, newest first. Its size is
+    fixed by the capacity. A filter that's behind (a new or older file)
+    catches up on the first search.
+    
+    Opening a file made with a different capacity resizes the ring to the
+    requested one, keeping the newest entries.
+    
+    Several shells can share the file: append() holds an exclusive lock on
+    it and first catches up with the header, so entries from every session
+    interleave instead of overwriting each other. sync() picks up entries
+    other sessions appended since.
+    
+    With path=None the ring lives in an ordinary bytearray instead.
+    """
+    MAGIC = b'LDMH'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIQQI')  # magic, version, capacity, next seq, record size
+    HEADER_SIZE = 64
+    RECORD = struct.Struct('<QdhH')  # seq, timestamp, exit status, text length
+    RECORD_SIZE = 256
+    TEXT_SIZE = RECORD_SIZE - RECORD.size
+    GROW_RECORDS = 4096
+    
+    def __init__(self, path=None, capacity=1000000):
+        self.path = path
+        self.capacity = max(1, int(capacity))
+        self.next_seq = 0
+        self._file = None
+        self._buf = None
+        self._slots = 0
+        
+        if path is None:
+            self._buf = bytearray(self.HEADER_SIZE)
+            self._write_header()
+            self.filter = HistoryFilter(None, self.capacity)
+        else:
+            self._open_file()
+    
+    def _open_file(self):
+        """Open (or create) the ring buffer file and map it"""
+        # Not 'w+b': another session may be creating the same file
+        self._file = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b')
+        with self._locked():
+            self._open_ring()
+            self.filter = HistoryFilter(os.path.splitext(self.path)[0] + '.idx', self.capacity)
+    
+    def _open_ring(self):
+        """Read (or start) the ring; the caller holds the lock"""
+        size = os.fstat(self._file.fileno()).st_size
+        if size >= self.HEADER_SIZE:
+            self._file.seek(0)
+            magic, version, capacity, next_seq, record_size = self.HEADER.unpack(
+                self._file.read(self.HEADER.size))
+            if magic == self.MAGIC and version == self.VERSION and record_size == self.RECORD_SIZE:
+                wanted, self.capacity = self.capacity, capacity
+                self.next_seq = next_seq
+                self._map((size - self.HEADER_SIZE) // self.RECORD_SIZE)
+                if capacity != wanted:
+                    self._resize(wanted)
+                return
+        
+        # New or unrecognised file: start an empty ring
+        self._file.truncate(0)
+        self._map(0)
+        self._write_header()
+    
+    def _resize(self, capacity):
+        """Rewrite the ring with a new capacity, keeping the newest entries
+        
+        Entries are renumbered from 0, since the slot of an entry depends
+        on its number and the capacity.
+        """
+        kept = [self.entry(seq) for seq in range(max(self.oldest, self.next_seq - capacity), self.next_seq)]
+        self.capacity, self.next_seq = capacity, 0
+        self._file.truncate(0)
+        self._map(0)
+        for _, timestamp, status, text in kept:
+            self._write(text.encode('utf-8'), status, timestamp)
+        self._write_header()
+    
+    def _locked(self):
+        """Exclusive lock on the file for the duration of a with block"""
+        return locked_file(self._file)
+    
+    def _map(self, slots):
+        """(Re)map the file so that it holds `slots` records"""
+        if self._buf is not None:
+            self._buf.close()
+        size = self.HEADER_SIZE + slots * self.RECORD_SIZE
+        self._file.truncate(size)
+        self._buf = mmap.mmap(self._file.fileno(), size)
+        self._slots = slots
+    
+    def _grow(self, slot):
+        """Make room for `slot`, growing in chunks up to the capacity"""
+        if self._file is None:
+            # In memory: start small and double, so idle sessions stay cheap
+            slots = min(self.capacity, max(slot + 1, self._slots * 2, 64))
+            self._buf.extend(bytes((slots - self._slots) * self.RECORD_SIZE))
+            self._slots = slots
+        else:
+            self._map(min(self.capacity, (slot // self.GROW_RECORDS + 1) * self.GROW_RECORDS))
+    
+    def _write_header(self):
+        self.HEADER.pack_into(self._buf, 0, self.MAGIC, self.VERSION, self.capacity,
+                              self.next_seq, self.RECORD_SIZE)
+    
+    def close(self):
+        """Flush and unmap the history file"""
+        if self._file is not None and not self._file.closed:
+            self._buf.flush()
+            self._buf.close()
+            self._file.close()
+        self.filter.close()
+    
+    @property
+    def oldest(self):
+        """Sequence number of the oldest live entry"""
+        return max(0, self.next_seq - self.capacity)
+    
+    def __len__(self):
+        return self.next_seq - self.oldest
+    
+    def sync(self):
+        """Catch up with entries other sessions appended to the file"""
+        if self._file is None:
+            return
+        next_seq = self.HEADER.unpack_from(self._buf, 0)[3]
+        if next_seq == self.next_seq:
+            return
+        # Their appends may have grown the file past our mapping
+        slots = (os.fstat(self._file.fileno()).st_size - self.HEADER_SIZE) // self.RECORD_SIZE
+        if slots > self._slots:
+            self._map(slots)
+        self.next_seq = next_seq
+    
+    def _write(self, data, status, timestamp):
+        """Store the next entry; the caller holds the lock"""
+        seq = self.next_seq
+        slot = seq % self.capacity
+        if slot >= self._slots:
+            self._grow(slot)
+        
+        offset = self.HEADER_SIZE + slot * self.RECORD_SIZE
+        self.RECORD.pack_into(self._buf, offset, seq,
+                              time.time() if timestamp is None else timestamp, status, len(data))
+        start = offset + self.RECORD.size
+        self._buf[start:start + len(data)] = data
+        self.next_seq = seq + 1
+        return seq
+    
+    def append(self, text, status=0, timestamp=None):
+        """Append a command and return its sequence number"""
+        # Truncate without leaving half a character behind
+        data = text.encode('utf-8')[:self.TEXT_SIZE].decode('utf-8', 'ignore').encode('utf-8')
+        
+        with self._locked():
+            self.sync()
+            seq = self._write(data, status, timestamp)
+            self._write_header()
+            # A filter that's behind is caught up by the next search instead
+            if self.filter.indexed == seq:
+                self.filter.add(self, seq)
+        return seq
+    
+    def extend(self, texts):
+        """Append several commands"""
+        for text in texts:
+            self.append(text)
+    
+    def set_status(self, seq, status):
+        """Record the exit status of an entry"""
+        if self.oldest <= seq < self.next_seq:
+            offset = self.HEADER_SIZE + (seq % self.capacity) * self.RECORD_SIZE
+            struct.pack_into('<h', self._buf, offset + 16, status)
+    
+    def entry(self, seq):
+        """(seq, timestamp, status, text) for a live entry, else None"""
+        if not self.oldest <= seq < self.next_seq:
+            return None
+        offset = self.HEADER_SIZE + (seq % self.capacity) * self.RECORD_SIZE
+        stored_seq, timestamp, status, length = self.RECORD.unpack_from(self._buf, offset)
+        start = offset + self.RECORD.size
+        text = bytes(self._buf[start:start + length]).decode('utf-8', 'replace')
+        return (stored_seq, timestamp, status, text)
+    
+    def recent(self, count):
+        """The last `count` entries, oldest first"""
+        start = max(self.oldest, self.next_seq - count)
+        return [self.entry(seq) for seq in range(start, self.next_seq)]
+    
+    def __getitem__(self, key):
+        """Command text by position, like the list this replaces"""
+        seqs = range(self.oldest, self.next_seq)
+        if isinstance(key, slice):
+            return [self.entry(seq)[3] for seq in seqs[key]]
+        return self.entry(seqs[key])[3]
+    
+    def __iter__(self):
+        for seq in range(self.oldest, self.next_seq):
+            yield self.entry(seq)[3]
+    
+    def _catch_up_filter(self):
+        """Add the entries the filter is missing (all of them for a new filter)"""
+        if self.filter.indexed == self.next_seq:
+            return
+        with self._locked():
+            self.sync()
+            start = self.filter.indexed
+            if not self.oldest <= start <= self.next_seq:
+                # Behind by more than the ring holds, or from another ring
+                start = self.oldest
+            for seq in range(start, self.next_seq):
+                self.filter.add(self, seq)
+    
+    def search(self, text, limit=20, before=None):
+        """Entries containing text (case-insensitive), newest first
+        
+        Only entries older than `before` are considered when it is given.
+        """
+        needle = text.lower()
+        if not needle:
+            return []
+        self._catch_up_filter()
+        end = self.next_seq if before is None else min(before, self.next_seq)
+        probes = HistoryFilter.probes(_grams(needle) if len(needle) < 4 else
+                                      {needle[i:i + 4] for i in range(len(needle) - 3)})
+        
+        # Newest first, a segment (or the part of one in range) at a time
+        results = []
+        seq, oldest, segment_records = end - 1, self.oldest, HistoryFilter.SEGMENT_RECORDS
+        while seq >= oldest:
+            slot = seq % self.capacity
+            low = max(oldest, seq - slot % segment_records)
+            if self.filter.may_contain(slot // segment_records, probes):
+                for candidate in range(seq, low - 1, -1):
+                    entry = self.entry(candidate)
+                    if needle in entry[3].lower():
+                        results.append(entry)
+                        if len(results) >= limit:
+                            return results
+            seq = low - 1
+        return results
+    
+    def rsearch(self, text, skip=0, before=None):
+        """Reverse incremental search: the (skip+1)-th newest match, or None"""
+        matches = self.search(text, skip + 1, before)
+        return matches[skip] if len(matches) > skip else None
+
+# Most writers a key's vector clock remembers; older ones are forgotten
+CLOCK_WRITERS = 16
+
+class SharedState:
+    """One shell's view of a state file that other shells save to as well
+    
+    The file holds settings, variables and memory and, for every key, a
+    vector clock ({writer: n}, n numbering the key's writes) with the wall
+    time of its last write. Syncing compares the shell's dicts with the
+    values as of the last sync to find its own changes, stamps them, and
+    merges the file key by key: the side whose clock dominates wins, and
+    of two concurrent writes the later one (last writer wins). A change is
+    stamped when the session next syncs, whichever way the dict was
+    modified.
+    
+    changed() is one stat() of the file, cheap enough to run before every
+    command; the file is only read when it reports a change. Saves hold a
+    lock on a .lock file next to it and replace the file atomically.
+    """
+    SECTIONS = ('settings', 'variables', 'memory')
+    
+    # Marks a key another session deleted in pull()/push() results
+    DELETED = object()
+    
+    def __init__(self, path):
+        self.path = path
+        self.writer = f"{os.getpid()}-{os.urandom(4).hex()}"
+        self.synced = {section: {} for section in self.SECTIONS}
+        self.clocks = {section: {} for section in self.SECTIONS}
+        self.seen = None
+    
+    def _stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+    
+    def changed(self):
+        """Whether the file changed since this session last read or wrote it"""
+        return self._stamp() != self.seen
+    
+    @contextlib.contextmanager
+    def _lock(self):
+        with open(self.path + '.lock', 'a') as lock, locked_file(lock):
+            yield
+    
+    def _read(self):
+        """The file's state (None if there's none), noting the version read"""
+        self.seen = self._stamp()
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def load(self):
+        """Read the file at startup and take it as synced: its state or None"""
+        state = self._read()
+        if state is not None:
+            for section in self.SECTIONS:
+                self.synced[section] = dict(state.get(section, {}))
+                self.clocks[section] = dict(state.get('clocks', {}).get(section, {}))
+        return state
+    
+    def pull(self, local):
+        """Merge what other sessions saved: {section: {key: value or DELETED}}
+        
+        `local` maps each section to the shell's dict; the result holds
+        the changes to make to them.
+        """
+        if not self.changed():
+            return {}
+        with self._lock():
+            state = self._read()
+        return self._merge(local, state) if state is not None else {}
+    
+    def push(self, local, extra):
+        """Merge and save local changes, with `extra` (e.g. history) added to the file
+        
+        Returns the changes other sessions made, as pull() does.
+        """
+        with self._lock():
+            state = self._read() if self.changed() else None
+            if state is not None:
+                updates = self._merge(local, state)
+            else:
+                updates = {}
+                self._record(local)
+            
+            state = {section: self.synced[section] for section in self.SECTIONS}
+            state['clocks'] = self.clocks
+            state.update(extra)
+            temporary = f"{self.path}.{self.writer}.tmp"
+            with open(temporary, 'w') as f:
+                json.dump(state, f, indent=2)
+            os.replace(temporary, self.path)
+            self.seen = self._stamp()
+        return updates
+    
+    def _record(self, local):
+        """Stamp the keys local changed since the last sync"""
+        now = time.time()
+        for section in self.SECTIONS:
+            values, synced, clocks = local[section], self.synced[section], self.clocks[section]
+            edited = [key for key, value in values.items() if synced.get(key, self) != value]
+            edited += [key for key in synced if key not in values]
+            for key in edited:
+                clock = dict(clocks[key][1]) if key in clocks else {}
+                clock[self.writer] = max(clock.values(), default=0) + 1
+                clocks[key] = [now, _prune_clock(clock)]
+                if key in values:
+                    synced[key] = values[key]
+                else:
+                    del synced[key]
+    
+    def _merge(self, local, state):
+        """Fold the file's state into ours; returns the changes local needs"""
+        self._record(local)
+        updates = {}
+        theirs_clocks = state.get('clocks', {})
+        for section in self.SECTIONS:
+            synced, clocks = self.synced[section], self.clocks[section]
+            values, theirs = state.get(section, {}), theirs_clocks.get(section, {})
+            changes = {}
+            for key in set(values) | set(theirs) | set(synced) | set(clocks):
+                ours_stamp = clocks.get(key, [0.0, {}])
+                theirs_stamp = theirs.get(key, [0.0, {}])
+                value = values.get(key, self.DELETED)
+                if _dominates(theirs_stamp[1], ours_stamp[1]):
+                    winner, stamp = 'theirs', theirs_stamp
+                elif _dominates(ours_stamp[1], theirs_stamp[1]):
+                    winner, stamp = 'ours', ours_stamp
+                else:
+                    # Concurrent writes: the later one wins, writer ids break ties
+                    later = max(ours_stamp, theirs_stamp, key=lambda s: (s[0], sorted(s[1].items())))
+                    winner = 'theirs' if later is theirs_stamp else 'ours'
+                    stamp = [later[0], _prune_clock(_merge_clocks(ours_stamp[1], theirs_stamp[1]))]
+                
+                if winner == 'theirs' and synced.get(key, self.DELETED) != value:
+                    changes[key] = value
+                    if value is self.DELETED:
+                        synced.pop(key, None)
+                    else:
+                        synced[key] = value
+                if stamp[1] or key in clocks:
+                    clocks[key] = stamp
+            if changes:
+                updates[section] = changes
+        return updates
+
+def _dominates(a, b):
+    """Whether vector clock a has seen every write b has"""
+    return all(a.get(writer, 0) >= n for writer, n in b.items())
+
+def _merge_clocks(a, b):
+    merged = dict(a)
+    for writer, n in b.items():
+        if n > merged.get(writer, 0):
+            merged[writer] = n
+    return merged
+
+def _prune_clock(clock):
+    """Keep the CLOCK_WRITERS most recent writers of a key"""
+    if len(clock) <= CLOCK_WRITERS:
+        return clock
+    return dict(sorted(clock.items(), key=lambda item: item[1])[-CLOCK_WRITERS:])
+
+# Argument converters for command schemas; none of them raise
+_INT_TOKEN = re.compile(r'[-+]?[0-9]+\Z')
+_NUM_TOKEN = re.compile(r'[-+]?(?:[0-9]+\.[0-9]*|\.[0-9]+|[0-9]+)(?:[eE][-+]?[0-9]+)?\Z')
+
+def _int_arg(token):
+    if _INT_TOKEN.match(token):
+        try:
+            return int(token)
+        except ValueError:
+            pass  # more digits than int() converts (sys.get_int_max_str_digits)
+    return token
+
+def _num_arg(token):
+    if _NUM_TOKEN.match(token) and not _INT_TOKEN.match(token):
+        return float(token)
+    return _int_arg(token)
+
+ARG_TYPES = {'int': _int_arg, 'num': _num_arg, 'str': str}
+
+class Command:
+    """A shell command with its aliases, argument schema and help
+    
+    schema is a tuple of (name, type, default) entries where type is a key
+    of ARG_TYPES, or 'raw' to receive the whole argument string as a single
+    argument. Tokens that don't fit their type, and tokens past the end of
+    the schema, are passed through as strings. Missing trailing arguments
+    are filled from the defaults up to the first None default.
+    
+    The handler is called as handler(shell, args), or as
+    handler(shell, args, lines) when reads_input is set; `lines` iterates
+    over the output of the previous pipeline stage. Handlers return a
+    string or an iterable of output chunks. Commands from plugins keep
+    their Plugin in `plugin` and their usage line in `usage`.
+    """
+    __slots__ = ('name', 'handler', 'aliases', 'schema', 'help', 'category',
+                 'reads_input', 'raw', 'converters', 'defaults', 'plugin', 'usage')
+    
+    def __init__(self, name, handler, aliases=(), schema=(), help="", category='system',
+                 reads_input=False, plugin=None, usage=None):
+        self.name = name
+        self.handler = handler
+        self.aliases = tuple(aliases)
+        self.schema = tuple(schema)
+        self.help = help
+        self.category = category
+        self.reads_input = reads_input
+        self.plugin = plugin
+        self.usage = usage or name
+        self.raw = bool(schema) and schema[0][1] == 'raw'
+        self.converters = () if self.raw else tuple(ARG_TYPES[kind] for _, kind, _ in self.schema)
+        self.defaults = tuple(default for _, _, default in self.schema)
+    
+    def parse(self, args_str):
+        """Convert the argument string according to the schema"""
+        if self.raw:
+            return [args_str] if args_str else []
+        
+        tokens = args_str.split()
+        args = [convert(token) for convert, token in zip(self.converters, tokens)]
+        args.extend(tokens[len(args):])
+        for default in self.defaults[len(args):]:
+            if default is None:
+                break
+            args.append(default)
+        return args
+
+class CommandRegistry:
+    """Commands by name and alias"""
+    
+    def __init__(self):
+        self.commands = {}
+        self._lookup = {}
+        # Set by EnhancedλOS._build_commands
+        self.plugins = []
+        self.plugin_errors = []
+    
+    def add(self, name, handler, **options):
+        """Create and register a Command"""
+        command = Command(name, handler, **options)
+        self.register(command)
+        return command
+    
+    def register(self, command):
+        self.commands[command.name] = command
+        for key in (command.name,) + command.aliases:
+            self._lookup[key] = command
+    
+    def get(self, name):
+        """The command registered under a name or alias, or None"""
+        return self._lookup.get(name)
+    
+    def __contains__(self, name):
+        return name in self._lookup
+    
+    def names(self):
+        """Every command name and alias"""
+        return self._lookup.keys()
+    
+    def register_plugin(self, plugin):
+        """Register a plugin's commands, skipping any whose name is taken
+        
+        Returns the names that were skipped.
+        """
+        clashes = []
+        for command in plugin.commands():
+            taken = [key for key in (command.name,) + command.aliases if key in self._lookup]
+            if taken:
+                clashes.extend(taken)
+            else:
+                self.register(command)
+        return clashes
+
+# Plugins: plugins/<name>/manifest.json next to this script
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plugins')
+
+class LazyHandler:
+    """A plugin command's handler until its first call imports the module"""
+    __slots__ = ('plugin', 'attribute', 'command')
+    
+    def __init__(self, plugin, attribute, command):
+        self.plugin = plugin
+        self.attribute = attribute
+        self.command = command
+    
+    def __call__(self, shell, *args):
+        handler = getattr(self.plugin.load(), self.attribute)
+        self.command.handler = handler
+        return handler(shell, *args)
+
+class Plugin:
+    """A command module known by its manifest, imported on first use
+    
+    manifest.json names the module file and declares its commands:
+    
+        {"module": "plot.py",
+         "commands": [{"name": "plot", "handler": "plot_command",
+                       "aliases": [], "schema": [["expression", "raw", null]],
+                       "help": "...", "usage": "plot <expr>", "category": "math"}]}
+    
+    Everything but "name" and "handler" is optional; the fields mean what
+    they mean for Command. Handlers are module-level functions called like
+    built-in ones, handler(shell, args). The module sees the running λOS
+    module as its global `ldmos`.
+    """
+    
+    def __init__(self, name, directory, manifest):
+        self.name = name
+        self.directory = directory
+        self.manifest = manifest
+        self.module = None
+    
+    def commands(self):
+        """Commands whose handlers load the module when first called"""
+        for entry in self.manifest['commands']:
+            command = Command(entry['name'], None, aliases=entry.get('aliases', ()),
+                              schema=tuple(tuple(field) for field in entry.get('schema', ())),
+                              help=entry.get('help', ""), category=entry.get('category', 'system'),
+                              reads_input=entry.get('reads_input', False), plugin=self,
+                              usage=entry.get('usage'))
+            command.handler = LazyHandler(self, entry['handler'], command)
+            yield command
+    
+    def load(self):
+        """The plugin's module, imported the first time"""
+        if self.module is None:
+            import importlib.util
+            name = f"ldmos_plugins.{self.name}"
+            path = os.path.join(self.directory, self.manifest.get('module', '__init__.py'))
+            spec = importlib.util.spec_from_file_location(name, path)
+            module = importlib.util.module_from_spec(spec)
+            module.ldmos = sys.modules[__name__]
+            sys.modules[name] = module
+            try:
+                spec.loader.exec_module(module)
+            except BaseException:
+                del sys.modules[name]
+                raise
+            self.module = module
+        return self.module
+
+def validate_manifest(manifest):
+    """Check a plugin manifest, raising ValueError on the first problem"""
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('commands'), list):
+        raise ValueError("expected an object with a \"commands\" list")
+    if not isinstance(manifest.get('module', ''), str):
+        raise ValueError("module: expected a file name")
+    for entry in manifest['commands']:
+        if not isinstance(entry, dict) or not all(isinstance(entry.get(key), str) for key in ('name', 'handler')):
+            raise ValueError("every command needs a \"name\" and a \"handler\"")
+        for field in entry.get('schema', ()):
+            if not (isinstance(field, list) and len(field) == 3 and (field[1] in ARG_TYPES or field[1] == 'raw')):
+                raise ValueError(f"{entry['name']}: bad schema entry {field!r}")
+
+def discover_plugins(directories):
+    """(plugins, errors) from <directory>/*/manifest.json; nothing is imported"""
+    plugins = []
+    errors = []
+    for directory in directories:
+        try:
+            entries = sorted(os.listdir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            path = os.path.join(directory, entry, 'manifest.json')
+            if not os.path.isfile(path):
+                continue
+            try:
+                with open(path, encoding='utf-8') as f:
+                    manifest = json.load(f)
+                validate_manifest(manifest)
+            except (OSError, ValueError) as e:
+                errors.append(f"{entry}: {e}")
+                continue
+            plugins.append(Plugin(entry, os.path.join(directory, entry), manifest))
+    return plugins, errors
+
+class PrefixTrie:
+    """Prefix tree of completion candidates
+    
+    Nodes are dicts keyed by character; the '' key marks the end of a word.
+    Lookups walk the prefix and then collect words depth-first, stopping at
+    `limit`, so their cost doesn't depend on how many words are stored.
+    """
+    __slots__ = ('root', 'size')
+    
+    def __init__(self, words=()):
+        self.root = {}
+        self.size = 0
+        for word in words:
+            self.add(word)
+    
+    def add(self, word):
+        node = self.root
+        for char in word:
+            child = node.get(char)
+            if child is None:
+                child = node[char] = {}
+            node = child
+        if '' not in node:
+            node[''] = True
+            self.size += 1
+    
+    def discard(self, word):
+        """Remove a word, pruning branches left empty"""
+        path = []
+        node = self.root
+        for char in word:
+            child = node.get(char)
+            if child is None:
+                return
+            path.append((node, char))
+            node = child
+        if node.pop('', None) is None:
+            return
+        self.size -= 1
+        for parent, char in reversed(path):
+            if parent[char]:
+                break
+            del parent[char]
+    
+    def __contains__(self, word):
+        node = self.root
+        for char in word:
+            node = node.get(char)
+            if node is None:
+                return False
+        return '' in node
+    
+    def __len__(self):
+        return self.size
+    
+    def complete(self, prefix, limit=64):
+        """Words starting with prefix, in sorted order, at most `limit`"""
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        
+        words = []
+        stack = [(node, prefix)]
+        while stack:
+            node, word = stack.pop()
+            if '' in node:
+                words.append(word)
+                if len(words) >= limit:
+                    break
+            # Push in reverse so the smallest character is visited first
+            for char in sorted((c for c in node if c), reverse=True):
+                stack.append((node[char], word + char))
+        return words
+
+class Completer:
+    """readline completion for the shell
+    
+    readline hands over the whole line (the completer delimiters are
+    cleared), and completions are whole lines too: the command name and
+    aliases for the first word, then settings keys, theme names, eye modes,
+    help topics or λ variables depending on the command, plus any history
+    entry that starts with the line. The variable and history tries are
+    updated as the shell defines variables and runs commands.
+    """
+    HISTORY_SEED = 20000
+    
+    SUBCOMMANDS = {
+        'settings': ['show', 'reset', 'set', 'theme'],
+        'history': ['search', 'rsearch'],
+        'help': ['quick', 'visual', 'math', 'system'],
+        'bench': ['dispatch', 'backends'],
+        'record': ['stop'],
+        'replay': ['demo', '--speed', '--memory'],
+        'stats': ['reset'],
+        'eye': ['render'],
+    }
+    
+    def __init__(self, shell):
+        self.shell = shell
+        self.commands = PrefixTrie(shell.commands.names())
+        self.setting_keys = PrefixTrie(shell.settings)
+        self.themes = PrefixTrie(shell.themes)
+        self.eye_modes = PrefixTrie(shell.sprites)
+        self.subcommands = {name: PrefixTrie(words) for name, words in self.SUBCOMMANDS.items()}
+        self.variables = PrefixTrie(shell.variables)
+        self.history = PrefixTrie(shell.history[-self.HISTORY_SEED:])
+        self._matches = []
+    
+    def add_variable(self, name):
+        self.variables.add(name)
+    
+    def add_history(self, line):
+        self.history.add(line)
+    
+    def candidates(self, line):
+        """Completions for the line typed so far"""
+        if not self.shell.settings['auto_complete']:
+            return []
+        
+        head, space, word = line.rpartition(' ')
+        tokens = head.split()
+        if not space:
+            matches = self.commands.complete(word)
+        else:
+            trie = self._argument_trie(tokens)
+            matches = [head + ' ' + match for match in trie.complete(word)] if trie else []
+        
+        # Whole previous commands that start with what was typed
+        seen = set(matches)
+        matches.extend(entry for entry in self.history.complete(line) if entry not in seen)
+        return matches
+    
+    def _argument_trie(self, tokens):
+        """Trie for the next argument of a partly typed command"""
+        command = self.shell.commands.get(tokens[0])
+        if command is None:
+            return None
+        name = command.name
+        position = len(tokens)
+        
+        if name == 'λ':
+            return self.variables
+        if name == 'settings' and position == 2 and tokens[1] == 'set':
+            return self.setting_keys
+        if name == 'settings' and position == 2 and tokens[1] == 'theme':
+            return self.themes
+        if name == 'eye' and position == 2:
+            return self.eye_modes
+        if position == 1:
+            return self.subcommands.get(name)
+        return None
+    
+    def complete(self, text, state):
+        """readline completer entry point"""
+        if state == 0:
+            self._matches = self.candidates(text)
+        return self._matches[state] if state < len(self._matches) else None
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+class SessionRecorder:
+    """Writes typed commands with their time offsets as JSON lines"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.started = time.perf_counter()
+        self._file = open(path, 'w', encoding='utf-8')
+        self._file.write(json.dumps({'type': 'session', 'started': datetime.now().isoformat()}) + "\n")
+    
+    def record(self, command):
+        offset = round(time.perf_counter() - self.started, 6)
+        self._file.write(json.dumps({'t': offset, 'cmd': command}, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.count += 1
+    
+    def close(self):
+        self._file.close()
+    
+    @staticmethod
+    def load(path):
+        """(offset, command) pairs from a recording"""
+        workload = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if 'cmd' in entry:
+                    workload.append((entry.get('t', 0.0), entry['cmd']))
+        return workload
+
+class ReplayResult:
+    """Latencies per command type from a replay"""
+    
+    def __init__(self):
+        self.latencies = {}
+        self.elapsed = 0.0
+        self.peak_memory = None  # only measured on request
+    
+    def add(self, command_type, seconds):
+        self.latencies.setdefault(command_type, []).append(seconds)
+    
+    @property
+    def count(self):
+        return sum(len(samples) for samples in self.latencies.values())
+    
+    def summary(self):
+        """{command type: {count, p50, p95, p99, max}} in milliseconds"""
+        summary = {}
+        for command_type, samples in self.latencies.items():
+            ordered = sorted(samples)
+            summary[command_type] = {
+                'count': len(ordered),
+                'p50': percentile(ordered, 0.50) * 1000,
+                'p95': percentile(ordered, 0.95) * 1000,
+                'p99': percentile(ordered, 0.99) * 1000,
+                'max': ordered[-1] * 1000,
+            }
+        return summary
+    
+    def report(self, shell, name):
+        rate = self.count / self.elapsed if self.elapsed > 0 else 0.0
+        memory = "" if self.peak_memory is None else f", peak memory {self.peak_memory / 1e6:.2f} MB"
+        text = shell.c('BR_CYAN', f"Replay of {name}: {self.count} commands in {self.elapsed:.3f}s"
+                                  f" ({rate:.1f} commands/sec){memory}\n")
+        if self.peak_memory is not None:
+            text += shell.c('DIM', "  (latencies include tracemalloc's overhead)\n")
+        text += shell.c('BR_WHITE', f"  {'command':12} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}\n")
+        for command_type, row in sorted(self.summary().items(), key=lambda item: -item[1]['p95']):
+            text += shell.c('BR_WHITE', f"  {command_type:12} {row['count']:6} {row['p50']:9.3f}"
+                                        f" {row['p95']:9.3f} {row['p99']:9.3f} {row['max']:9.3f}\n")
+        return text
+
+class LatencyHistogram:
+    """Latency counts in power-of-two microsecond buckets
+    
+    Bucket i holds samples under 2**i µs (and at least 2**(i-1)), so adding
+    a sample is a bit_length() and an increment and the table never grows.
+    Percentiles are reported as the upper bound of their bucket.
+    """
+    BUCKETS = 40
+    __slots__ = ('counts', 'count', 'total', 'max')
+    
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def add(self, seconds):
+        seconds = max(seconds, 0.0)
+        self.counts[min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+    
+    def percentile(self, fraction):
+        """Upper bound in seconds of the bucket holding the given rank"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+class ShellExit(SystemExit):
+    """Raised by `quit`; exits cleanly and carries the farewell message"""
+    
+    def __init__(self, farewell=""):
+        super().__init__(0)
+        self.farewell = farewell
+
+class _JsonLinesOutput:
+    """File-like adapter writing each chunk as a JSON-lines 'output' record"""
+    
+    def __init__(self, out):
+        self.out = out
+        self.cmd = None
+    
+    def write(self, text):
+        if text:
+            self.record({'type': 'output', 'cmd': self.cmd, 'text': text})
+    
+    def record(self, record):
+        self.out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.out.flush()
+    
+    def flush(self):
+        self.out.flush()
+
+# Estimated values: ('int', log2 of the magnitude), ('seq', length, nested items) or a
+# plain number; None when nothing is known
+_NUMBER = ('num', 0.0)
+
+# Widths and precisions in format specs, and the %-conversions that carry them
+_FORMAT_NUMBER = re.compile(r'[0-9]+')
+_PERCENT_SPEC = re.compile(r'%[^a-zA-Z%]*')
+
+# math functions whose result grows with their integer arguments
+_GROWING_MATH = {'factorial', 'comb', 'perm'}
+
+def _times(a, b):
+    """a * b where 0 * inf is 0, not nan"""
+    return a * b if a and b else 0.0
+
+def _multiply_work(bits):
+    """Rough digit operations to build a `bits`-bit integer by multiplication"""
+    return (bits / 30) ** 1.585 if bits > 30 else 1.0
+
+class ExpressionCost:
+    """Upper-bound estimate of what evaluating a Python expression costs
+    
+    Walks the AST tracking, for every subexpression, log2 of the largest
+    integer it can produce or the length of the sequence it can build and
+    the items in it counting nested ones (what its str() scales with),
+    and totals a rough operation count. Exponent towers, shifts, sequence
+    repetition, comprehensions and math.factorial/comb/perm are where eval
+    spends its time and memory; calls and operands the walk can't bound
+    are noted in `unbounded`.
+    
+    verdict is 'reject', 'limited' (run it under resource limits) or
+    'inline' (cheap enough to run in the shell). Names in `numbers` are
+    taken to be plain (float) numbers, like pi and e.
+    """
+    
+    def __init__(self, expr, numbers=()):
+        import ast
+        self.ast = ast
+        self.numbers = frozenset(numbers)
+        self.bits = 0.0
+        self.length = 0.0
+        self.size = 0.0
+        self.work = 0.0
+        self.unbounded = None
+        try:
+            self.visit(ast.parse(expr, mode='eval').body)
+        except (SyntaxError, ValueError, MemoryError):
+            pass  # eval fails just as quickly
+        except RecursionError:
+            self.unbounded = "is too deeply nested to estimate"
+    
+    @property
+    def verdict(self):
+        if (self.bits > EVAL_REJECT_BITS or self.length > EVAL_REJECT_LENGTH
+                or self.work > EVAL_REJECT_WORK):
+            return 'reject'
+        if (self.unbounded or self.bits > EVAL_INLINE_BITS or self.length > EVAL_INLINE_LENGTH
+                or self.size > EVAL_INLINE_LENGTH or self.work > EVAL_INLINE_WORK):
+            return 'limited'
+        return 'inline'
+    
+    def describe(self):
+        """Why the expression isn't cheap, e.g. 'builds a ~1.2e+09-bit integer'"""
+        if self.bits > EVAL_INLINE_BITS:
+            return f"builds a ~{self.bits:.3g}-bit integer"
+        if self.length > EVAL_INLINE_LENGTH:
+            return f"builds a sequence of ~{self.length:.3g} items"
+        if self.size > EVAL_INLINE_LENGTH:
+            return f"builds nested sequences of ~{self.size:.3g} items"
+        if self.work > EVAL_INLINE_WORK:
+            return f"takes ~{self.work:.3g} operations"
+        return self.unbounded or "is cheap"
+    
+    def visit(self, node):
+        method = getattr(self, 'visit_' + type(node).__name__, None)
+        if method is not None:
+            return method(node)
+        for child in self.ast.iter_child_nodes(node):
+            self.visit(child)
+        return None
+    
+    def _int(self, bits):
+        self.bits = max(self.bits, bits)
+        return ('int', bits)
+    
+    def _seq(self, length, size=0.0):
+        """A sequence of length items, size of them counting nested ones"""
+        size = max(size, length)
+        self.length = max(self.length, length)
+        self.size = max(self.size, size)
+        self.work += length
+        return ('seq', length, size)
+    
+    @staticmethod
+    def _size(value):
+        """Items a value adds to a sequence it is put in"""
+        return value[2] if value is not None and value[0] == 'seq' else 1
+    
+    def _unknown(self, reason):
+        if self.unbounded is None:
+            self.unbounded = reason
+        return None
+    
+    def _formatted(self, spec, length):
+        """A string of length characters padded out to the widths in spec"""
+        if '*' in spec:
+            return self._unknown("formats with a width that can't be estimated")
+        width = max((float(number) for number in _FORMAT_NUMBER.findall(spec)), default=0.0)
+        return self._seq(length + width)
+    
+    @staticmethod
+    def _count(value):
+        """Largest integer an ('int', bits) value can be"""
+        return 2.0 ** value[1] if value[1] < 1024 else math.inf
+    
+    def visit_Constant(self, node):
+        value = node.value
+        if isinstance(value, bool):
+            return _NUMBER
+        if isinstance(value, int):
+            return self._int(math.log2(abs(value)) if value else 0.0)
+        if isinstance(value, (str, bytes)):
+            return self._seq(len(value))
+        return _NUMBER
+    
+    def visit_Name(self, node):
+        return _NUMBER if node.id in ('pi', 'e') or node.id in self.numbers else None
+    
+    def visit_Attribute(self, node):
+        if isinstance(node.value, self.ast.Name) and node.value.id == 'math':
+            return _NUMBER
+        self.visit(node.value)
+        return None
+    
+    def visit_UnaryOp(self, node):
+        operand = self.visit(node.operand)
+        return _NUMBER if isinstance(node.op, self.ast.Not) else operand
+    
+    def visit_BinOp(self, node):
+        left, right = self.visit(node.left), self.visit(node.right)
+        op = type(node.op).__name__
+        if op == 'Mod' and left is not None and left[0] == 'seq':
+            # printf-style formatting: '%0400000000d' % 1 is 400 MB
+            if isinstance(node.left, self.ast.Constant) and isinstance(node.left.value, str):
+                spec = "".join(_PERCENT_SPEC.findall(node.left.value))
+                return self._formatted(spec, left[1] + self._size(right))
+            return self._unknown("formats with a string that can't be estimated")
+        if left is None or right is None:
+            if op in ('Pow', 'LShift', 'Mult'):
+                return self._unknown(f"has an operand of {op} that can't be estimated")
+            return None
+        
+        if left[0] == 'int' and right[0] == 'int':
+            if op == 'Pow':
+                bits = _times(left[1], self._count(right))
+                self.work += _multiply_work(bits)
+                return self._int(bits)
+            if op == 'LShift':
+                bits = left[1] + self._count(right)
+                self.work += bits / 30
+                return self._int(bits)
+            if op == 'Mult':
+                self.work += _times(left[1], right[1]) / 900
+                return self._int(left[1] + right[1])
+            if op == 'Div':
+                return _NUMBER
+            self.work += max(left[1], right[1]) / 30
+            return self._int(max(left[1], right[1]) + 1)
+        
+        if op == 'Mult' and {left[0], right[0]} == {'seq', 'int'}:
+            seq, count = (left, right) if left[0] == 'seq' else (right, left)
+            count = self._count(count)
+            return self._seq(_times(seq[1], count), _times(seq[2], count))
+        if left[0] == 'seq' and right[0] == 'seq':
+            return self._seq(left[1] + right[1], left[2] + right[2])
+        if 'seq' in (left[0], right[0]):
+            return None
+        return _NUMBER
+    
+    def visit_Call(self, node):
+        args = [self.visit(arg) for arg in node.args]
+        for keyword in node.keywords:
+            self.visit(keyword.value)
+        
+        func = node.func
+        if isinstance(func, self.ast.Attribute) and isinstance(func.value, self.ast.Name) \
+                and func.value.id == 'math':
+            name = func.attr
+        elif isinstance(func, self.ast.Name) and func.id in ('sin', 'cos', 'tan'):
+            name = func.id
+        else:
+            self.visit(func)
+            return self._unknown("calls something whose cost can't be estimated")
+        
+        if name in _GROWING_MATH:
+            if not args or args[0] is None or args[0][0] != 'int':
+                return self._unknown(f"calls {name}() with an argument that can't be estimated")
+            n = self._count(args[0])
+            bits = _times(n, math.log2(n + 1))
+            self.work += _multiply_work(bits)
+            return self._int(bits)
+        if name in ('gcd', 'lcm', 'isqrt', 'prod'):
+            if any(arg is None or arg[0] != 'int' for arg in args):
+                return self._unknown(f"calls {name}() with arguments that can't be estimated")
+            return self._int(sum(arg[1] for arg in args))
+        return _NUMBER
+    
+    def _comprehension(self, node, elements):
+        iterations = 1.0
+        for generator in node.generators:
+            iterable = self.visit(generator.iter)
+            for condition in generator.ifs:
+                self.visit(condition)
+            if iterable is None or iterable[0] != 'seq':
+                return self._unknown("loops over something whose size can't be estimated")
+            iterations = _times(iterations, iterable[1])
+        
+        before = self.work
+        size = sum(self._size(self.visit(element)) for element in elements)
+        self.work = before + _times(self.work - before + 1, iterations)
+        return self._seq(iterations, _times(size, iterations))
+    
+    def visit_ListComp(self, node):
+        return self._comprehension(node, [node.elt])
+    
+    visit_SetComp = visit_GeneratorExp = visit_ListComp
+    
+    def visit_DictComp(self, node):
+        return self._comprehension(node, [node.key, node.value])
+    
+    def visit_List(self, node):
+        length = size = 0.0
+        for element in node.elts:
+            if isinstance(element, self.ast.Starred):
+                value = self.visit(element.value)
+                if value is None or value[0] != 'seq':
+                    return self._unknown("unpacks something whose size can't be estimated")
+                length += value[1]
+                size += value[2]
+            else:
+                size += self._size(self.visit(element))
+                length += 1
+        return self._seq(length, size)
+    
+    visit_Tuple = visit_Set = visit_List
+    
+    def visit_Dict(self, node):
+        size = 0.0
+        for child in node.keys + node.values:
+            if child is not None:
+                size += self._size(self.visit(child))
+        return self._seq(len(node.keys), size)
+    
+    def visit_JoinedStr(self, node):
+        length = 0.0
+        for value in node.values:
+            length += self._size(self.visit(value))
+        return self._seq(length)
+    
+    def visit_FormattedValue(self, node):
+        length = self._size(self.visit(node.value))
+        if node.format_spec is None:
+            return self._seq(length)
+        parts = node.format_spec.values
+        if not all(isinstance(part, self.ast.Constant) for part in parts):
+            return self._unknown("formats with a width that can't be estimated")
+        return self._formatted("".join(part.value for part in parts), length)
+    
+    def visit_Subscript(self, node):
+        value = self.visit(node.value)
+        self.visit(node.slice)
+        return value if isinstance(node.slice, self.ast.Slice) else None
+    
+    def visit_Compare(self, node):
+        for child in [node.left] + node.comparators:
+            self.visit(child)
+        return _NUMBER
+    
+    def visit_IfExp(self, node):
+        self.visit(node.test)
+        body, orelse = self.visit(node.body), self.visit(node.orelse)
+        if body and orelse and body[0] == orelse[0]:
+            return max(body, orelse)
+        return None
+    
+    def visit_Lambda(self, node):
+        # The body only runs if the lambda is called, and calls are unbounded
+        return None
+
+_CONTAINER_BRACKETS = {list: ('[', ']'), tuple: ('(', ')'), set: ('{', '}'), dict: ('{', '}')}
+
+def _str_chunks(value, active=None):
+    """str(value) in pieces, so a caller can stop early: a short nested list
+    can print as gigabytes. Containers repeated within themselves print as
+    [...] like str() does."""
+    brackets = _CONTAINER_BRACKETS.get(type(value))
+    if brackets is None or not value:
+        yield str(value)
+        return
+    active = active or set()
+    if id(value) in active:
+        yield brackets[0] + "..." + brackets[1]
+        return
+    active.add(id(value))
+    yield brackets[0]
+    items = value.items() if type(value) is dict else value
+    for index, item in enumerate(items):
+        if index:
+            yield ", "
+        if type(value) is dict:
+            yield repr(item[0])
+            yield ": "
+            item = item[1]
+        if type(item) in _CONTAINER_BRACKETS:
+            yield from _str_chunks(item, active)
+        else:
+            yield repr(item)
+    if type(value) is tuple and len(value) == 1:
+        yield ","
+    yield brackets[1]
+    active.discard(id(value))
+
+def evaluate_expression(expr, names):
+    """eval() with no builtins: ('ok', text), ('error', type name, message)
+    or ('limit', what) if it ran out of memory"""
+    try:
+        value = eval(expr, {"__builtins__": {}}, names)
+        chunks, length = [], 0
+        for chunk in _str_chunks(value):
+            chunks.append(chunk)
+            length += len(chunk)
+            if length > EVAL_RESULT_CHARS:
+                break
+        text = "".join(chunks)
+    except MemoryError:
+        return ('limit', "memory budget")
+    except Exception as e:
+        return ('error', type(e).__name__, str(e))
+    if length > EVAL_RESULT_CHARS:
+        text = f"{text[:EVAL_RESULT_CHARS]}… (cut at {EVAL_RESULT_CHARS} characters)"
+    return ('ok', text)
+
+def can_limit_evaluation():
+    """Whether evaluate_limited() can run here (needs fork and resource)"""
+    try:
+        import resource
+    except ImportError:
+        return False
+    return hasattr(os, 'fork')
+
+def _address_space():
+    """Current virtual memory size in bytes (0 if /proc isn't available)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+def _set_limit(limit, value, lower_hard=False):
+    """setrlimit() to value, capped at the hard limit (which lower_hard lowers too)"""
+    import resource
+    hard = resource.getrlimit(limit)[1]
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(limit, (value, value if lower_hard else hard))
+
+# Set by a threaded process (the server) that mustn't fork; see EvaluationPool
+_evaluation_pool = None
+
+def evaluate_limited(expr, names, cpu_seconds=EVAL_CPU_SECONDS, memory_bytes=EVAL_MEMORY_BYTES):
+    """evaluate_expression() in a forked child under RLIMIT_CPU and RLIMIT_AS
+    
+    The child gets memory_bytes on top of what the shell already maps and
+    is killed if it hasn't answered a second after its CPU budget, so the
+    shell never waits much longer than cpu_seconds. If _evaluation_pool is
+    set, one of its workers evaluates instead, under the pool's own memory
+    limit.
+    """
+    if _evaluation_pool is not None:
+        return _evaluation_pool.evaluate(expr, names, cpu_seconds)
+    
+    import resource
+    import select
+    import signal
+    
+    address_space = _address_space() + memory_bytes
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            _set_limit(resource.RLIMIT_CPU, cpu_seconds)
+            _set_limit(resource.RLIMIT_AS, address_space, lower_hard=True)
+            data = memoryview(json.dumps(evaluate_expression(expr, names)).encode('utf-8'))
+            while data:
+                data = data[os.write(write_fd, data):]
+        finally:
+            os._exit(0)
+    
+    os.close(write_fd)
+    deadline = time.monotonic() + cpu_seconds + 1
+    chunks = []
+    timed_out = False
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([read_fd], [], [], remaining)[0]:
+                timed_out = True
+                break
+            chunk = os.read(read_fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        os.close(read_fd)
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        _, status = os.waitpid(pid, 0)
+    
+    if chunks and not timed_out:
+        try:
+            return tuple(json.loads(b''.join(chunks)))
+        except ValueError:
+            pass
+    if timed_out:
+        return ('limit', f"{cpu_seconds + 1}s time budget")
+    if os.WIFSIGNALED(status) and os.WTERMSIG(status) == signal.SIGXCPU:
+        return ('limit', f"{cpu_seconds}s CPU budget")
+    return ('limit', "memory budget")
+
+def _evaluation_worker(connection, memory_bytes):
+    """EvaluationPool worker: answers (expr, names, cpu_seconds) requests
+    until the pool closes its end of the pipe"""
+    import resource
+    
+    _set_limit(resource.RLIMIT_AS, _address_space() + memory_bytes, lower_hard=True)
+    while True:
+        try:
+            expr, names, cpu_seconds = connection.recv()
+        except EOFError:
+            return
+        # RLIMIT_CPU counts the worker's whole life, so each expression gets
+        # cpu_seconds on top of what the ones before it used
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        _set_limit(resource.RLIMIT_CPU, math.ceil(usage.ru_utime + usage.ru_stime) + cpu_seconds)
+        connection.send(evaluate_expression(expr, dict(MATH_NAMES, **names)))
+
+class EvaluationPool:
+    """Worker processes that run evaluate_limited() for a threaded process
+    
+    fork() copies only the calling thread, so a child forked while another
+    thread holds a lock (the allocator's, a file's) can hang on it for
+    good. The server evaluates in these workers instead: they come from a
+    forkserver (spawned where there is none), so there are no threads to
+    inherit, set their memory limit once and then take one expression at a
+    time. A worker that runs out of time or dies is replaced by a new one.
+    """
+    
+    def __init__(self, size, memory_bytes=EVAL_MEMORY_BYTES):
+        import multiprocessing
+        methods = multiprocessing.get_all_start_methods()
+        self.context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self.memory_bytes = memory_bytes
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._workers = set()
+    
+    def start(self, count):
+        """Start count idle workers ahead of the first expression"""
+        for _ in range(count):
+            self._idle.append(self._start_worker())
+    
+    def _start_worker(self):
+        connection, child = self.context.Pipe()
+        process = self.context.Process(target=_evaluation_worker, args=(child, self.memory_bytes),
+                                       name='λOS evaluator', daemon=True)
+        process.start()
+        child.close()
+        worker = (process, connection)
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+    
+    def _stop_worker(self, worker):
+        process, connection = worker
+        process.kill()
+        process.join()
+        connection.close()
+        with self._lock:
+            self._workers.discard(worker)
+    
+    def evaluate(self, expr, names, cpu_seconds=EVAL_CPU_SECONDS):
+        """Like evaluate_limited(); names beyond MATH_NAMES must pickle"""
+        import signal
+        
+        # Modules don't pickle, and the workers have MATH_NAMES already
+        names = {name: value for name, value in names.items()
+                 if name not in MATH_NAMES or MATH_NAMES[name] is not value}
+        with self._slots:
+            with self._lock:
+                worker = self._idle.pop() if self._idle else None
+            if worker is None:
+                worker = self._start_worker()
+            process, connection = worker
+            timed_out = False
+            try:
+                connection.send((expr, names, cpu_seconds))
+                if connection.poll(cpu_seconds + 1):
+                    outcome = connection.recv()
+                    with self._lock:
+                        self._idle.append(worker)
+                    return outcome
+                timed_out = True
+            except (EOFError, OSError):
+                pass  # the worker died: it went over a limit
+            self._stop_worker(worker)
+        
+        if timed_out:
+            return ('limit', f"{cpu_seconds + 1}s time budget")
+        if process.exitcode == -signal.SIGXCPU:
+            return ('limit', f"{cpu_seconds}s CPU budget")
+        return ('limit', "memory budget")
+    
+    def close(self):
+        with self._lock:
+            workers = list(self._workers)
+            self._idle.clear()
+        for worker in workers:
+            self._stop_worker(worker)
+
+# The eye art that ships with λOS; sprites/ can add more (see SpriteAtlas)
+BUILTIN_SPRITES = {
+    'single': [
+        "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⡀⡀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⡀⡀⠀⡀⠀⠂⡀⢀⢰⠀⢂⠀⠀⠀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⠀⠀⠀⢀⣀⣐⣬⣄⣷⡀⢸⡃⡘⡸⡄⢸⠀⠀⡇⠀⢠⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⣠⡴⠚⢉⢍⢂⣼⣴⣿⣿⣿⣷⣷⣷⣣⣏⣆⣼⠀⠀⠄⠀⠀⠀",
+        "⠀⠀⠀⢠⡞⠋⠀⡑⣮⣿⣿⣿⣿⣿⣿⣿⣿⣿⣿⣿⣿⣾⣷⣼⣆⣌⡠⢁⡤",
+        "⠀⠀⣰⠋⠀⣀⣺⣾⣿⣿⣿⣿⣿⡿⢿⣿⣿⣿⣿⣿⣿⣿⣿⣿⣿⣿⡿⠟⠁",
+        "⠀⡼⠁⢀⣿⣿⣿⡿⣿⡛⣿⣿⣿⡷⢸⣿⠀⠀⠀⠀⣹⣿⣿⣿⣟⠣⠀⠀⠀",
+        "⡰⠁⢀⣼⣿⠟⢿⡇⠹⣿⣿⣿⠟⠀⢠⡿⠀⠀⣠⣾⡿⣿⡥⠊⠁⠀⠀⠀⠀",
+        "⠁⢠⣾⠟⠁⠀⠈⠳⢿⣦⣠⣤⣦⣼⠟⠁⣠⣾⣿⣿⣟⠍⠒⠀⠠⠀⠀⠀⠀",
+        "⢠⡟⠁⢀⣀⣀⣀⣀⡀⠈⣉⣉⣡⣤⣶⣿⡿⡿⡿⡻⠥⠑⡀⠀⠀⠀⠀⠀⠀",
+        "⠏⡠⠚⠉⠋⢍⠋⢫⠋⠛⢹⢻⡟⠻⣟⢏⠌⢊⡌⠌⠄⠀⠀⠀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⠀⠀⠈⠀⠀⠘⠂⠘⠂⠿⠈⠀⠀⠀⠘⠀⠀⠀⠀⠀⠀⠀⠀⠀"
+    ],
+    'triple': [
+        "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⢀⣀⣀⣀⣀⣀⣀⣀⣀⣀⡀⠀⠀⠀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⣠⡤⠤⢤⣄⡀⠀⣠⠞⠉⠀⠀⠀⠀⠀⠀⠀⠈⠉⠳⣄⠀⠀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⢸⠁⠀⠀⠀⠀⠙⢷⡏⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠸⣇⠀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⢸⠀⠀⠀⠀⠀⠀⠈⣇⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⣿⠀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⠸⡄⠀⠀⠀⠀⠀⠀⣿⠀⠀⢀⣀⣀⣀⣀⣀⡀⠀⠀⠀⠀⣿⠀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⢻⡀⠀⠀⠀⠀⠀⣿⠀⠐⠛⠛⠛⠛⠛⠛⠛⠂⠀⠀⠀⣿⠀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⠈⣧⠀⠀⠀⠀⠀⣿⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⣿⠀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⠀⠘⣇⠀⠀⠀⠀⢻⡀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⢀⡟⠀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⠀⠀⠘⢦⡀⠀⠀⠀⠙⢦⣀⠀⠀⠀⠀⠀⠀⣀⡤⠖⠉⠀⠀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠉⠓⠦⣤⣀⡀⠈⠉⠉⠉⠉⠉⠉⠁⠀⣀⣀⡤⠤⠖⠒⠋⠉⠀",
+        "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠈⠉⠉⠉⠉⠉⠉⠉⠉⠉⠀⠀⠀⠀⠀⠀⠀⠀⠀"
+    ],
+    'quantum': [
+        "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⣀⣤⠶⠶⠶⢦⣄⡀⠀⠀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⠀⠀⠀⠀⢀⣠⠶⠛⠉⠀⠀⠀⠀⠀⠈⠻⣦⡀⠀⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⠀⠀⢀⡴⠛⠁⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠈⢷⡄⠀⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⠀⣠⠟⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⢻⡄⠀⠀⠀",
+        "⠀⠀⠀⠀⠀⣰⠏⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠈⣷⠀⠀⠀",
+        "⠀⠀⠀⠀⢠⡟⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⢹⡇⠀⠀",
+        "⠀⠀⠀⠀⣾⠁⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠘⣧⠀⠀",
+        "⠀⠀⠀⢸⡇⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⢻⡆⠀",
+        "⠀⠀⠀⣿⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠈⣿⠀",
+        "⠀⠀⠀⣿⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⣿⠀",
+        "⠀⠀⠀⠻⣦⡀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⢀⣴⠟⠀"
+    ]
+}
+
+# User sprites: *.txt art and *.pgm/*.ppm images converted to braille
+SPRITE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sprites')
+SPRITE_CACHE_VERSION = 1
+
+# Color phase is quantized to this many steps per cycle (a power of two)
+PHASE_STEPS = 4096
+
+def sprite_cache_dir():
+    """Where converted sprites are cached ($XDG_CACHE_HOME/ldmos/sprites)"""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ldmos', 'sprites')
+
+def state_dir():
+    """Where the state and history files live ($XDG_STATE_HOME/ldmos)"""
+    base = os.environ.get('XDG_STATE_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'state')
+    return os.path.join(base, 'ldmos')
+
+def state_path(name):
+    """A file in state_dir()"""
+    return os.path.join(state_dir(), name)
+
+def quantize_phase(radians):
+    """A phase in radians as a step in 0..PHASE_STEPS-1"""
+    return round(radians / (2 * math.pi) * PHASE_STEPS) & (PHASE_STEPS - 1)
+
+def read_pnm(data):
+    """(width, height, gray values 0-255) of a P2/P3/P5/P6 image"""
+    tokens = []
+    position = 0
+    # Header: magic, width, height, maxval, with # comments in between
+    while len(tokens) < 4:
+        match = re.compile(rb'\s*(?:#[^\n]*\n\s*)*(\S+)').match(data, position)
+        if not match:
+            raise ValueError("truncated PNM header")
+        tokens.append(match.group(1))
+        position = match.end()
+    magic, width, height, maxval = tokens[0], int(tokens[1]), int(tokens[2]), int(tokens[3])
+    if magic not in (b'P2', b'P3', b'P5', b'P6'):
+        raise ValueError(f"unsupported image type {magic.decode(errors='replace')}")
+    channels = 3 if magic in (b'P3', b'P6') else 1
+    count = width * height * channels
+    
+    if magic in (b'P2', b'P3'):
+        samples = list(map(int, data[position:].split()[:count]))
+    else:
+        raster = data[position + 1:]
+        if maxval < 256:
+            samples = raster[:count]
+        else:
+            samples = array('H', raster[:count * 2])
+            if sys.byteorder == 'little':
+                samples.byteswap()
+    if len(samples) < count:
+        raise ValueError("truncated PNM raster")
+    
+    if channels == 3:
+        # Rec. 601 luma
+        samples = list(map(lambda r, g, b: (299 * r + 587 * g + 114 * b) // 1000,
+                           samples[0::3], samples[1::3], samples[2::3]))
+    if maxval != 255:
+        samples = [value * 255 // maxval for value in samples]
+    return width, height, bytes(samples)
+
+# 4x4 Bayer matrix scaled to 0-255 thresholds
+_BAYER = [[(v * 16 + 8) for v in row] for row in ((0, 8, 2, 10), (12, 4, 14, 6), (3, 11, 1, 9), (15, 7, 13, 5))]
+
+# Braille dot bits by (column, row) within a 2x4 cell
+_BRAILLE_BITS = ((0x01, 0x02, 0x04, 0x40), (0x08, 0x10, 0x20, 0x80))
+
+def image_to_braille(width, height, gray, max_width=EYE_WIDTH, max_height=EYE_HEIGHT):
+    """Braille lines for a grayscale image, dark pixels as dots
+    
+    The image is scaled to fit max_width x max_height cells (2x4 pixels
+    each), stretched to the full gray range and ordered-dithered, one
+    pixel row at a time.
+    """
+    scale = min(1.0, max_width * 2 / width, max_height * 4 / height)
+    columns, rows = max(2, int(width * scale)), max(4, int(height * scale))
+    columns += columns % 2
+    rows += -rows % 4
+    xs = [min(width - 1, int(x / scale)) for x in range(columns)]
+    
+    low, high = min(gray), max(gray)
+    span = max(1, high - low)
+    levels = bytes((min(255, max(0, (value - low) * 255 // span)) for value in range(256)))
+    
+    cells = [[0] * (columns // 2) for _ in range(rows // 4)]
+    for y in range(rows):
+        source = min(height - 1, int(y / scale)) * width
+        row = gray[source:source + width].translate(levels)
+        samples = bytes(row[x] for x in xs)
+        thresholds = itertools.cycle(_BAYER[y % 4])
+        # A dot wherever the pixel is darker than its dither threshold
+        dots = bytes(map(operator.lt, samples, thresholds))
+        left, right = _BRAILLE_BITS[0][y % 4], _BRAILLE_BITS[1][y % 4]
+        cell_row = cells[y // 4]
+        cell_row[:] = map(operator.add, cell_row,
+                          map(operator.add, map(operator.mul, dots[0::2], itertools.repeat(left)),
+                              map(operator.mul, dots[1::2], itertools.repeat(right))))
+    return ["".join(map(chr, map(operator.add, row, itertools.repeat(0x2800)))) for row in cells]
+
+class Sprite:
+    """Art plus what drawing it needs
+    
+    mask lists the opaque cells as (row, [columns]); cells outside it let
+    the layers below show through. phases(kx, ky) is the quantized spatial
+    color phase x*kx + y*ky of each masked cell, in mask order.
+    """
+    
+    def __init__(self, name, lines, transparent=' ', mask=None, phases=None, source=None):
+        self.name = name
+        self.lines = lines
+        self.height = len(lines)
+        self.width = max(map(len, lines), default=0)
+        self.source = source
+        if mask is None:
+            mask = [(y, [x for x, char in enumerate(line) if char != transparent])
+                    for y, line in enumerate(lines)]
+        self.mask = [(y, xs) for y, xs in mask if xs]
+        self._phases = phases or {}
+    
+    def phases(self, kx, ky):
+        key = f"{kx},{ky}"
+        table = self._phases.get(key)
+        if table is None:
+            table = self._phases[key] = [[quantize_phase(x * kx + y * ky) for x in xs] for y, xs in self.mask]
+        return table
+    
+    def to_cache(self):
+        # Phase tables for the built-in palettes are stored with the sprite
+        for theme in BUILTIN_THEMES.values():
+            self.phases(theme['eye']['kx'], theme['eye']['ky'])
+        return {'version': SPRITE_CACHE_VERSION, 'lines': self.lines, 'mask': self.mask,
+                'phases': self._phases}
+
+class SpriteAtlas:
+    """Sprites by name: built-in art first, then files from the directories
+    
+    Files are listed up front and loaded on first use. Images are
+    converted to braille once; the result is cached under cache_dir by
+    the SHA-1 of the file, so later runs load it straight from JSON.
+    """
+    EXTENSIONS = ('.txt', '.pgm', '.ppm', '.pnm')
+    
+    def __init__(self, builtins, directories=(), cache_dir=None):
+        self.cache_dir = cache_dir
+        self._sprites = {name: Sprite(name, lines) for name, lines in builtins.items()}
+        self._files = {}
+        for directory in directories:
+            try:
+                entries = sorted(os.listdir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                name, extension = os.path.splitext(entry)
+                if extension.lower() in self.EXTENSIONS and name.lower() not in self._sprites:
+                    self._files.setdefault(name.lower(), os.path.join(directory, entry))
+    
+    def __contains__(self, name):
+        return name in self._sprites or name in self._files
+    
+    def __iter__(self):
+        return iter(list(self._sprites) + [name for name in self._files if name not in self._sprites])
+    
+    def __getitem__(self, name):
+        sprite = self._sprites.get(name)
+        if sprite is None:
+            sprite = self._sprites[name] = self.load(name, self._files[name])
+        return sprite
+    
+    def load(self, name, path):
+        """Read a sprite file, converting images through the cache"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        if path.lower().endswith('.txt'):
+            return Sprite(name, data.decode('utf-8').rstrip('\n').split('\n'), source=path)
+        
+        import hashlib
+        digest = hashlib.sha1(data).hexdigest()
+        cache_file = os.path.join(self.cache_dir, f"{digest}.json") if self.cache_dir else None
+        if cache_file:
+            try:
+                with open(cache_file, encoding='utf-8') as f:
+                    cached = json.load(f)
+                if cached.get('version') == SPRITE_CACHE_VERSION:
+                    return Sprite(name, cached['lines'], mask=cached['mask'], phases=cached['phases'],
+                                  source=path)
+            except (OSError, ValueError, KeyError):
+                pass
+        
+        sprite = Sprite(name, image_to_braille(*read_pnm(data)), transparent='⠀', source=path)
+        if cache_file:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                temporary = f"{cache_file}.{os.getpid()}.tmp"
+                with open(temporary, 'w', encoding='utf-8') as f:
+                    json.dump(sprite.to_cache(), f, ensure_ascii=False)
+                os.replace(temporary, cache_file)
+            except OSError:
+                pass
+        return sprite
+
+def wave_geometry(width, height):
+    """The time-independent part of the wave field: (columns, lines, radii by row)"""
+    center_x, center_y = width // 2, height // 2
+    columns = [(x - center_x) / 20 * 4 for x in range(width)]
+    lines = [(y - center_y) / 15 * 3 for y in range(height)]
+    radii = [[math.sqrt(dx * dx + dy * dy) * 3
+              for dx in [(x - center_x) / 20 for x in range(width)]]
+             for dy in [(y - center_y) / 15 for y in range(height)]]
+    return columns, lines, radii
+
+def frame_update(lines, previous):
+    """Terminal output turning the `previous` frame's lines into `lines`"""
+    if previous is None or len(previous) != len(lines):
+        # Home the cursor and clear instead of spawning `clear` per frame
+        return CLEAR_SCREEN + "\n".join(lines) + "\n"
+    # Rewrite only the lines that changed since the last frame
+    return "".join(f"\033[{row + 1};1H{line}\033[K"
+                   for row, (line, old) in enumerate(zip(lines, previous)) if line != old
+                   ) + f"\033[{len(lines) + 1};1H"
+
+# What the eye animation's layers are drawn from
+EyeFrame = collections.namedtuple('EyeFrame', 'frame frames mode t width height')
+
+class Layer:
+    """One z-ordered layer of a Compositor
+    
+    draw(state, rows) fills rows[y][x] with the cells the layer covers,
+    and key(state) returns everything the drawing depends on: while the key
+    is unchanged the previous drawing is reused.
+    """
+    __slots__ = ('name', 'draw', 'key', 'rows', 'last_key')
+    
+    def __init__(self, name, draw, key, height):
+        self.name = name
+        self.draw = draw
+        self.key = key
+        self.rows = [{} for _ in range(height)]
+        self.last_key = None
+
+class Compositor:
+    """Stacks layers into rows of text, redoing only what changed
+    
+    A layer is redrawn only when its key changes, and a row is composited
+    again only when some layer's cells on it changed.
+    """
+    
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.layers = []
+        self.rows = [" " * width] * height
+        # Seconds each stage took in the last update (redrawn layers and 'composite')
+        self.timings = {}
+    
+    def add(self, name, draw, key):
+        """Add a layer on top of the existing ones"""
+        self.layers.append(Layer(name, draw, key, self.height))
+    
+    def update(self, state):
+        """Bring the rows up to date for `state`; returns the dirty row numbers"""
+        dirty = set()
+        timings = self.timings = {}
+        clock = time.perf_counter
+        for layer in self.layers:
+            started = clock()
+            key = layer.key(state)
+            if key == layer.last_key:
+                continue
+            rows = [{} for _ in range(self.height)]
+            layer.draw(state, rows)
+            dirty.update(y for y, (old, new) in enumerate(zip(layer.rows, rows)) if old != new)
+            layer.rows, layer.last_key = rows, key
+            timings[layer.name] = clock() - started
+        
+        started = clock()
+        for y in dirty:
+            cells = [' '] * self.width
+            for layer in self.layers:
+                for x, cell in layer.rows[y].items():
+                    cells[x] = cell
+            self.rows[y] = "".join(cells)
+        timings['composite'] = clock() - started
+        return dirty
+
+# How much detail the eye animation draws: wave field sampled every
+# wave_step cells, this fraction of the particles, trails capped at trail
+# cells (None: no cap), and layer colors from this backend (None: the
+# shell's own)
+Quality = collections.namedtuple('Quality', 'name wave_step particles trail colors')
+
+# Levels FrameBudget steps through, full detail first
+QUALITY_LEVELS = [
+    Quality('full', 1, 1.0, None, None),
+    Quality('high', 2, 1.0, None, None),
+    Quality('medium', 2, 0.5, 2, None),
+    Quality('low', 2, 0.25, 0, '16'),
+    Quality('minimal', 4, 0.0, 0, '16'),
+]
+
+class FrameBudget:
+    """Picks the quality level that keeps frames within a time budget
+    
+    Frame times are smoothed with an exponential moving average. Over
+    budget, detail drops a level; with plenty of headroom it comes back a
+    level. The smoothed time last seen at each level is remembered, and a
+    level that was over budget is only retried after RETRY frames, so the
+    level doesn't flap between two neighbours.
+    """
+    SMOOTHING = 0.25
+    # Restore detail below this fraction of the budget
+    HEADROOM = 0.6
+    # Frames to wait after a change before judging the new level
+    SETTLE = 6
+    RETRY = 120
+    
+    def __init__(self, budget, levels=len(QUALITY_LEVELS)):
+        self.budget = budget
+        self.levels = levels
+        self.level = 0
+        self.average = None
+        self.frame = 0
+        self.since_change = 0
+        # level -> (smoothed frame time, frame it was measured at)
+        self.seen = {}
+    
+    def observe(self, seconds):
+        """Add one frame time; returns the level for the next frame"""
+        self.frame += 1
+        self.since_change += 1
+        if self.average is None:
+            self.average = seconds
+        else:
+            self.average += (seconds - self.average) * self.SMOOTHING
+        if self.since_change < self.SETTLE:
+            return self.level
+        
+        if self.average > self.budget and self.level < self.levels - 1:
+            self._change(self.level + 1)
+        elif self.average < self.budget * self.HEADROOM and self.level > 0:
+            previous = self.seen.get(self.level - 1)
+            if previous is None or previous[0] <= self.budget or self.frame - previous[1] >= self.RETRY:
+                self._change(self.level - 1)
+        return self.level
+    
+    def _change(self, level):
+        self.seen[self.level] = (self.average, self.frame)
+        self.level = level
+        self.average = None
+        self.since_change = 0
+
+class Emitter:
+    """Spawns particles from a point orbiting (cx, cy), aimed away from it"""
+    __slots__ = ('cx', 'cy', 'radius_x', 'radius_y', 'phase', 'spin', 'spread', 'speed', 'life')
+    
+    def __init__(self, cx, cy, radius_x, radius_y, phase, spin=0.5, spread=0.6, speed=(1.0, 3.0),
+                 life=(8.0, 20.0)):
+        self.cx = cx
+        self.cy = cy
+        self.radius_x = radius_x
+        self.radius_y = radius_y
+        self.phase = phase
+        self.spin = spin
+        self.spread = spread
+        self.speed = speed
+        self.life = life
+    
+    def spawn(self, t, rng):
+        """(x, y, vx, vy, lifetime) of a new particle at time t"""
+        angle = self.phase + t * self.spin
+        x = self.cx + self.radius_x * math.cos(angle)
+        y = self.cy + self.radius_y * math.sin(angle)
+        heading = angle + rng.uniform(-self.spread, self.spread)
+        speed = rng.uniform(*self.speed)
+        # Terminal cells are about twice as tall as they are wide
+        return x, y, speed * math.cos(heading), speed * 0.5 * math.sin(heading), rng.uniform(*self.life)
+
+class ParticleSystem:
+    """A fixed pool of particles stored as parallel arrays
+    
+    Position, velocity, age and lifetime are array('d') columns. A step
+    updates each column with map() over operator functions, so the
+    per-particle work runs in C; only particles that died are touched
+    one at a time, when an emitter respawns them. Drawing counts particles
+    per cell, so overlapping particles make a denser glyph instead of
+    overwriting each other.
+    """
+    GLYPHS = ('⋅', '∙', '∘', '○', '●', '◉')
+    DRAG = 0.97
+    
+    def __init__(self, count, width, height, emitters, seed=0):
+        self.count = count
+        # Only the first `active` particles are simulated and drawn; the
+        # rest stay where they are until the count goes back up
+        self.active = count
+        self.width = width
+        self.height = height
+        self.emitters = emitters
+        self.seed = seed
+        self.reset(0.0)
+    
+    def reset(self, t):
+        """Start over at time t with every particle somewhere along its life"""
+        self.rng = random.Random(self.seed)
+        self.t = t
+        self.frame = 0
+        columns = {name: array('d', bytes(8 * self.count)) for name in ('x', 'y', 'vx', 'vy', 'age', 'life')}
+        self.__dict__.update(columns)
+        for i in range(self.count):
+            self._respawn(i, t)
+            # Pre-age so particles don't all die in the same frame
+            age = self.rng.uniform(0.0, self.life[i])
+            self.age[i] = age
+            self.x[i] += self.vx[i] * age
+            self.y[i] += self.vy[i] * age
+    
+    def _respawn(self, i, t):
+        emitter = self.emitters[i % len(self.emitters)]
+        self.x[i], self.y[i], self.vx[i], self.vy[i], self.life[i] = emitter.spawn(t, self.rng)
+        self.age[i] = 0.0
+    
+    def step(self, dt):
+        """Advance every particle by dt and respawn the ones that expired"""
+        count, add, mul = self.active, operator.add, operator.mul
+        dts = itertools.repeat(dt, count)
+        self.x[:count] = array('d', map(add, self.x, map(mul, self.vx, dts)))
+        dts = itertools.repeat(dt, count)
+        self.y[:count] = array('d', map(add, self.y, map(mul, self.vy, dts)))
+        drag = itertools.repeat(self.DRAG, count)
+        self.vx[:count] = array('d', map(mul, self.vx, drag))
+        drag = itertools.repeat(self.DRAG, count)
+        self.vy[:count] = array('d', map(mul, self.vy, drag))
+        self.age[:count] = array('d', map(add, self.age, itertools.repeat(dt, count)))
+        self.t += dt
+        self.frame += 1
+        
+        for i in itertools.compress(range(count), map(operator.ge, self.age, self.life)):
+            self._respawn(i, self.t)
+    
+    def density(self):
+        """Particles per cell: {(x, y): count} for the cells on screen"""
+        width, height = self.width, self.height
+        return collections.Counter((int(x), int(y)) for x, y in itertools.islice(zip(self.x, self.y), self.active)
+                                   if 0 <= x < width and 0 <= y < height)
 
 class EnhancedλOS:
+    # Built-in commands, shared by every instance (see _build_commands)
+    _registry = None
+    
+    # Attributes built on first access by __getattr__: heavy tables and the
+    # persisted state are only paid for when something actually uses them.
+    _LAZY_ATTRS = {
+        'backend': '_build_backend',
+        'sprites': '_build_sprites',
+        'themes': '_build_themes',
+        'theme_errors': '_build_themes',
+        'compositor': '_build_compositor',
+        'commands': '_build_commands',
+        'settings': '_load_initial_state',
+        'variables': '_load_initial_state',
+        'memory': '_load_initial_state',
+        'history': '_load_initial_state',
+    }
+    
+    # Caches of values derived from settings, by attribute, and the setting
+    # keys they're built from; a change to one of those keys resets the
+    # attribute to None and the next use rebuilds it
+    _SETTINGS_CACHES = {
+        '_theme': ('theme',),
+        '_style': ('theme',),
+        '_prompt': ('theme', 'prompt_style'),
+        '_footer_info': ('theme', 'dolphin_count', 'animation_speed'),
+    }
+    
     def __init__(self):
-        # Enhanced ANSI Colors with gradients
-        self.colors = {
-            'RST': '\033[0m',
-            'BOLD': '\033[1m',
-            'DIM': '\033[2m',
-            'ITALIC': '\033[3m',
-            'UNDERLINE': '\033[4m',
-            'BLINK': '\033[5m',
-            'REVERSE': '\033[7m',
-            
-            # Standard colors
-            'BLACK': '\033[30m',
-            'RED': '\033[31m',
-            'GREEN': '\033[32m',
-            'YELLOW': '\033[33m',
-            'BLUE': '\033[34m',
-            'MAGENTA': '\033[35m',
-            'CYAN': '\033[36m',
-            'WHITE': '\033[37m',
-            
-            # Bright colors
-            'BR_BLACK': '\033[90m',
-            'BR_RED': '\033[91m',
-            'BR_GREEN': '\033[92m',
-            'BR_YELLOW': '\033[93m',
-            'BR_BLUE': '\033[94m',
-            'BR_MAGENTA': '\033[95m',
-            'BR_CYAN': '\033[96m',
-            'BR_WHITE': '\033[97m',
-            
-            # Backgrounds
-            'BG_BLACK': '\033[40m',
-            'BG_RED': '\033[41m',
-            'BG_GREEN': '\033[42m',
-            'BG_YELLOW': '\033[43m',
-            'BG_BLUE': '\033[44m',
-            'BG_MAGENTA': '\033[45m',
-            'BG_CYAN': '\033[46m',
-            'BG_WHITE': '\033[47m',
-            
-            # Gradient functions
-            'GRADIENT_RAINBOW': self.rainbow_gradient,
-            'GRADIENT_FIRE': self.fire_gradient,
-            'GRADIENT_OCEAN': self.ocean_gradient,
-            'GRADIENT_FOREST': self.forest_gradient,
-        }
-        
-        # Settings system
-        self.settings = {
-            'theme': 'ocean',
-            'animation_speed': 0.1,
-            'prompt_style': 'λ>',
-            'autosave': True,
-            'sound_effects': False,
-            'color_mode': 'gradient',
-            'auto_complete': True,
-            'show_time': True,
-            'quantum_mode': False,
-            'dolphin_count': 3,
-            'eye_type': 'single',
-            'particle_effects': True,
-            'trail_length': 3,
-        }
+        # Guards the one-time load of λos_state.json
+        self._state_lock = threading.Lock()
+        self._state_thread = None
+        self._state_loaded = False
         
-        # Command history
-        self.history = []
+        # Command history cursor
         self.history_index = 0
         
-        # Lambda calculus memory
-        self.memory = {}
-        self.variables = {}
+        # Interactive shell or batch run (no screen clearing, no history)
+        self.interactive = True
+        self.last_status = 0
+        self.last_seq = None
+        
+        # Where autosave goes; server sessions (session_id set) don't autosave.
+        # Other shells may share the file: shared_state merges with them
+        self.state_file = state_path(STATE_FILE)
+        self.shared_state = None
+        self._state_polled = 0.0
+        self.session_id = None
+        
+        # Replays run headless: no pauses between animation frames or demo steps
+        self.headless = False
+        self.recorder = None
+        
+        # Latency histograms by command name, kept by _dispatch (see `stats`)
+        self.latency = {}
+        self.paused = 0.0
+        
+        # Tab completion, set up by run()
+        self.completer = None
+        
+        # Eye animation caches: HUD lines by key, compiled themes, the
+        # time-independent geometry of the waves and the eye sprite, and the
+        # particle system
+        self._particles = None
+        self._hud_cache = {}
+        self._themes_compiled = {}
+        self._wave_geometry = {}
+        self._sprite_geometry = {}
+        
+        # Most particle steps taken to catch up with a frame that skipped ahead
+        self.particle_catchup = 60
+        
+        # Level of detail: lowered by the frame budget while an animation runs
+        self.quality = QUALITY_LEVELS[0]
+        self.frame_budget = None
+        
+        # Values derived from settings, dropped when a key they depend on
+        # changes (see _SETTINGS_CACHES) or the backend or quality does
+        self._theme = None
+        self._style = None
+        self._prompt = None
+        self._footer_info = None
         
         # Church encodings
         self.zero = lambda f: lambda x: x
         self.succ = lambda n: lambda f: lambda x: f(n(f)(x))
         
-        # Eye arts for different modes
-        self.eye_arts = {
-            'single': [
-                "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⡀⡀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⡀⡀⠀⡀⠀⠂⡀⢀⢰⠀⢂⠀⠀⠀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⠀⠀⠀⢀⣀⣐⣬⣄⣷⡀⢸⡃⡘⡸⡄⢸⠀⠀⡇⠀⢠⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⣠⡴⠚⢉⢍⢂⣼⣴⣿⣿⣿⣷⣷⣷⣣⣏⣆⣼⠀⠀⠄⠀⠀⠀",
-                "⠀⠀⠀⢠⡞⠋⠀⡑⣮⣿⣿⣿⣿⣿⣿⣿⣿⣿⣿⣿⣿⣾⣷⣼⣆⣌⡠⢁⡤",
-                "⠀⠀⣰⠋⠀⣀⣺⣾⣿⣿⣿⣿⣿⡿⢿⣿⣿⣿⣿⣿⣿⣿⣿⣿⣿⣿⡿⠟⠁",
-                "⠀⡼⠁⢀⣿⣿⣿⡿⣿⡛⣿⣿⣿⡷⢸⣿⠀⠀⠀⠀⣹⣿⣿⣿⣟⠣⠀⠀⠀",
-                "⡰⠁⢀⣼⣿⠟⢿⡇⠹⣿⣿⣿⠟⠀⢠⡿⠀⠀⣠⣾⡿⣿⡥⠊⠁⠀⠀⠀⠀",
-                "⠁⢠⣾⠟⠁⠀⠈⠳⢿⣦⣠⣤⣦⣼⠟⠁⣠⣾⣿⣿⣟⠍⠒⠀⠠⠀⠀⠀⠀",
-                "⢠⡟⠁⢀⣀⣀⣀⣀⡀⠈⣉⣉⣡⣤⣶⣿⡿⡿⡿⡻⠥⠑⡀⠀⠀⠀⠀⠀⠀",
-                "⠏⡠⠚⠉⠋⢍⠋⢫⠋⠛⢹⢻⡟⠻⣟⢏⠌⢊⡌⠌⠄⠀⠀⠀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⠀⠀⠈⠀⠀⠘⠂⠘⠂⠿⠈⠀⠀⠀⠘⠀⠀⠀⠀⠀⠀⠀⠀⠀"
-            ],
-            'triple': [
-                "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⢀⣀⣀⣀⣀⣀⣀⣀⣀⣀⡀⠀⠀⠀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⣠⡤⠤⢤⣄⡀⠀⣠⠞⠉⠀⠀⠀⠀⠀⠀⠀⠈⠉⠳⣄⠀⠀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⢸⠁⠀⠀⠀⠀⠙⢷⡏⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠸⣇⠀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⢸⠀⠀⠀⠀⠀⠀⠈⣇⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⣿⠀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⠸⡄⠀⠀⠀⠀⠀⠀⣿⠀⠀⢀⣀⣀⣀⣀⣀⡀⠀⠀⠀⠀⣿⠀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⢻⡀⠀⠀⠀⠀⠀⣿⠀⠐⠛⠛⠛⠛⠛⠛⠛⠂⠀⠀⠀⣿⠀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⠈⣧⠀⠀⠀⠀⠀⣿⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⣿⠀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⠀⠘⣇⠀⠀⠀⠀⢻⡀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⢀⡟⠀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⠀⠀⠘⢦⡀⠀⠀⠀⠙⢦⣀⠀⠀⠀⠀⠀⠀⣀⡤⠖⠉⠀⠀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠉⠓⠦⣤⣀⡀⠈⠉⠉⠉⠉⠉⠉⠁⠀⣀⣀⡤⠤⠖⠒⠋⠉⠀",
-                "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠈⠉⠉⠉⠉⠉⠉⠉⠉⠉⠀⠀⠀⠀⠀⠀⠀⠀⠀"
-            ],
-            'quantum': [
-                "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⣀⣤⠶⠶⠶⢦⣄⡀⠀⠀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⠀⠀⠀⠀⢀⣠⠶⠛⠉⠀⠀⠀⠀⠀⠈⠻⣦⡀⠀⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⠀⠀⢀⡴⠛⠁⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠈⢷⡄⠀⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⠀⣠⠟⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⢻⡄⠀⠀⠀",
-                "⠀⠀⠀⠀⠀⣰⠏⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠈⣷⠀⠀⠀",
-                "⠀⠀⠀⠀⢠⡟⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⢹⡇⠀⠀",
-                "⠀⠀⠀⠀⣾⠁⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠘⣧⠀⠀",
-                "⠀⠀⠀⢸⡇⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⢻⡆⠀",
-                "⠀⠀⠀⣿⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠈⣿⠀",
-                "⠀⠀⠀⣿⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⣿⠀",
-                "⠀⠀⠀⠻⣦⡀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⠀⢀⣴⠟⠀"
-            ]
-        }
-        
         # Quick commands 0-9
-        self.quick_commands = {
-            '0': 'help',
-            '1': 'eye 30',
-            '2': 'eye 20',
-            '3': 'demo',
-            '4': 'settings show',
-            '5': 'settings theme ocean',
-            '6': 'settings theme fire',
-            '7': 'church 7',
-            '8': 'clear',
-            '9': 'quantum',
-        }
-        
-        # Extended functions with complex logic
-        self.functions = {
-            # Visual functions
-            '🐬': lambda args: self.eye_animation(args if args else [60]),
-            '👁️': lambda args: self.eye_animation(args if args else [60]),
-            'eye': lambda args: self.eye_animation(args if args else [60]),
-            'dolphin': lambda args: self.eye_animation(args if args else [60]),
-            'λ': lambda args: self.lambda_evaluator(args),
-            '∫': lambda args: self.integral_visualizer(args),
-            '∂': lambda args: self.derivative_visualizer(args),
-            '∑': lambda args: self.summation_visualizer(args),
-            
-            # Mathematical functions
-            'church': lambda args: self.church_converter(args),
-            'ycombinator': lambda args: self.y_combinator_demo(args),
-            'factorial': lambda args: self.factorial_calculator(args),
-            'fibonacci': lambda args: self.fibonacci_generator(args),
-            'prime': lambda args: self.prime_checker(args),
-            
-            # System functions
-            'save': lambda args: self.save_state(args),
-            'load': lambda args: self.load_state(args),
-            'export': lambda args: self.export_settings(args),
-            'import': lambda args: self.import_settings(args),
-        }
+        self.quick_commands = QUICK_COMMANDS
         
         # Pupil offsets
         self.pupil_offset_x = 0
         self.pupil_offset_y = 0
+    
+    def __getattr__(self, name):
+        """Build lazy attributes on first access"""
+        builder = EnhancedλOS._LAZY_ATTRS.get(name)
+        if builder is None:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        getattr(self, builder)()
+        return self.__dict__[name]
+    
+    def _build_backend(self):
+        """Select the color backend from the color_backend setting
+        
+        While the saved state is still loading (run() draws the banner
+        meanwhile) this uses the default setting instead of waiting; the
+        load switches to the saved backend if it's a different one.
+        """
+        if not self._state_loaded:
+            self.set_color_backend(DEFAULT_SETTINGS['color_backend'])
+            # The load may have finished before the backend was set
+            if not self._state_loaded:
+                return
+        self.set_color_backend(self.settings.get('color_backend', 'auto'))
+    
+    def _use_settings(self, settings):
+        """Make `settings` this shell's SettingsStore and subscribe the caches to it"""
+        if not isinstance(settings, SettingsStore):
+            settings = SettingsStore(settings)
+        for attribute, keys in self._SETTINGS_CACHES.items():
+            settings.subscribe(keys, functools.partial(self._drop_cache, attribute))
+        settings.subscribe(('color_backend',), self._color_backend_changed)
+        self.settings = settings
+    
+    def _drop_cache(self, attribute, changed):
+        setattr(self, attribute, None)
+    
+    def _color_backend_changed(self, changed):
+        if 'backend' in self.__dict__:
+            name = self.settings.get('color_backend', 'auto')
+            if get_color_backend(name) is not self.backend:
+                self.set_color_backend(name)
+    
+    def set_color_backend(self, name):
+        """Route all color output through a backend ('auto' detects one)"""
+        self.backend = get_color_backend(name)
+        # Bind c() straight to the backend so color lookups skip a call
+        self.c = self.backend.c
+        self._theme = self._style = self._prompt = None
+    
+    def set_quality(self, quality):
+        """Change the level of detail the layers draw at"""
+        if quality is not self.quality:
+            self.quality = quality
+            self._style = None
+    
+    def _build_sprites(self):
+        """Built-in eye art plus the sprites/ directory next to this script"""
+        self.sprites = SpriteAtlas(BUILTIN_SPRITES, [SPRITE_DIR], sprite_cache_dir())
+    
+    def _build_themes(self):
+        """Built-in themes plus the themes/ directory next to this script"""
+        self.themes, self.theme_errors = load_themes([THEME_DIR])
+    
+    def active_theme(self, backend=None):
+        """The current theme compiled for the current backend (or `backend`)
+        
+        Each theme is compiled once per backend; an unknown theme name
+        falls back to ocean. The current one is kept until the theme
+        setting or the backend changes.
+        """
+        if backend is None:
+            theme = self._theme
+            if theme is None:
+                theme = self._theme = self.active_theme(self.backend)
+            return theme
+        name = self.settings['theme']
+        theme = self._themes_compiled.get((name, backend.name))
+        if theme is None:
+            definition = self.themes.get(name) or self.themes['ocean']
+            theme = self._themes_compiled[(name, backend.name)] = Theme(name, definition, backend)
+        return theme
+    
+    def _layer_theme(self):
+        """The theme the animation layers draw with, in fewer colors at low quality"""
+        depth = self.quality.colors
+        if depth and self.backend.name in ('truecolor', '256'):
+            return self.active_theme(get_color_backend(depth))
+        return self.active_theme()
+    
+    def _build_commands(self):
+        """Use the class-wide command registry, building it once
+        
+        Plugins are registered from their manifests after the built-in
+        commands; their modules are only imported when first used.
+        """
+        cls = type(self)
+        if cls._registry is None:
+            registry = CommandRegistry()
+            cls._register_commands(registry)
+            plugins, errors = discover_plugins([PLUGIN_DIR])
+            for plugin in plugins:
+                clashes = registry.register_plugin(plugin)
+                if clashes:
+                    errors.append(f"{plugin.name}: skipped {', '.join(clashes)} (already defined)")
+            registry.plugins, registry.plugin_errors = plugins, errors
+            cls._registry = registry
+        self.commands = cls._registry
+    
+    @classmethod
+    def _register_commands(cls, registry):
+        """Declare every built-in command"""
+        add = registry.add
+        frames_mode = (('frames', 'int', 60), ('mode', 'str', None))
         
-        # Initialize with saved state if exists
-        self.load_state(['auto'])
+        # Visual functions
+        add('eye', cls.eye_command, aliases=('🐬', '👁️', 'dolphin', 'e'), schema=frames_mode,
+            category='visual', help="Eye animation")
+        add('demo', cls.run_demo, category='visual', help="Run interactive demo")
+        add('quantum', cls.toggle_quantum, category='visual', help="Toggle quantum mode")
+        add('λ', cls.lambda_evaluator, schema=(('expression', 'raw', None),),
+            category='math', help="Lambda calculus evaluator")
+        add('∫', cls.integral_visualizer, category='math', help="Integral visualizer")
+        add('∂', cls.derivative_visualizer, category='math', help="Derivative visualizer")
+        add('∑', cls.summation_visualizer, category='math', help="Summation visualizer")
+        
+        # Mathematical functions
+        add('church', cls.church_converter, schema=(('n', 'int', None),),
+            category='math', help="Church numeral converter")
+        add('ycombinator', cls.y_combinator_demo, category='math', help="Y combinator demo")
+        add('factorial', cls.factorial_calculator, schema=(('n', 'int', None),),
+            category='math', help="Calculate factorial")
+        add('fibonacci', cls.fibonacci_generator, schema=(('count', 'int', None), ('n', 'int', None)),
+            category='math', help="Generate Fibonacci sequence")
+        add('prime', cls.prime_checker, schema=(('n', 'int', None),),
+            category='math', help="Check if number is prime")
+        
+        # System functions
+        add('settings', cls.settings_manager, aliases=('set', 'config'), help="Show or change settings")
+        add('help', cls.help_command, schema=(('topic', 'raw', None),), help="Show help")
+        add('clear', cls.clear_command, help="Clear screen")
+        add('quit', cls.quit_command, aliases=('exit', 'q'), help="Exit λOS")
+        add('history', cls.history_command, help="Show or search command history")
+        add('bench', cls.bench_command, schema=(('subject', 'str', 'dispatch'),),
+            help="Run a micro-benchmark")
+        add('profile', cls.profile_command, schema=(('command', 'raw', None),),
+            help="Profile a command's time and allocations")
+        add('stats', cls.stats_command, help="Show per-command latency stats")
+        add('plugins', cls.plugins_command, help="List plugins and their commands")
+        
+        # Pipeline filters
+        add('head', cls.head_filter, schema=(('n', 'int', 10),), reads_input=True,
+            help="First n lines of the input")
+        add('tail', cls.tail_filter, schema=(('n', 'int', 10),), reads_input=True,
+            help="Last n lines of the input")
+        add('grep', cls.grep_filter, reads_input=True, help="Input lines containing text")
+        add('count', cls.count_filter, reads_input=True, help="Count input lines")
+        
+        add('record', cls.record_command, help="Record commands to a file")
+        add('replay', cls.replay_command, help="Replay a recording and report latencies")
+        add('save', cls.save_state, help="Save state to file")
+        add('load', cls.load_state, help="Load state from file")
+        add('export', cls.export_settings, help="Export settings")
+        add('import', cls.import_settings, help="Import settings")
+    
+    def _load_initial_state(self):
+        """Load settings, variables, memory and history from the saved state"""
+        with self._state_lock:
+            if self._state_loaded:
+                return
+            
+            settings = SettingsStore(DEFAULT_SETTINGS)
+            variables = {}
+            memory = {}
+            
+            try:
+                os.makedirs(state_dir(), exist_ok=True)
+            except OSError:
+                pass  # then saving fails, and the history stays in memory
+            
+            # Initialize with saved state if exists
+            shared = SharedState(self.state_file) if self.state_file else None
+            state = shared.load() if shared else None
+            
+            if state:
+                settings.update(state.get('settings', {}))
+                variables.update(state.get('variables', {}))
+                memory.update(state.get('memory', {}))
+            
+            # Persistent history; fall back to memory if the file can't be used
+            try:
+                history = HistoryStore(state_path(HISTORY_FILE), settings['history_capacity'])
+            except OSError:
+                history = HistoryStore(None, settings['history_capacity'])
+            if state and not len(history):
+                # Carry over the history list kept by older state files
+                history.extend(state.get('history', []))
+            
+            # Publish everything at once so a concurrent reader never sees half
+            # a state; anything assigned before the load wins
+            loaded = {'variables': variables, 'memory': memory, 'history': history}
+            for name, value in loaded.items():
+                self.__dict__.setdefault(name, value)
+            if 'settings' not in self.__dict__:
+                self._use_settings(settings)
+            self.shared_state = shared
+            self._state_loaded = True
+            # A backend picked before the settings were in (see _build_backend)
+            self._color_backend_changed(None)
+    
+    def new_session(self, session_id, client_backend=None):
+        """A server session: own settings, variables and history, shared tables
+        
+        client_backend is the color backend the client detected for its
+        terminal, used for 'auto'.
+        """
+        session = type(self)()
+        session.__dict__.update(
+            sprites=self.sprites, themes=self.themes, theme_errors=self.theme_errors,
+            commands=self.commands, variables={}, memory={},
+            history=HistoryStore(None, SESSION_HISTORY_CAPACITY),
+            # Compiled per (theme, backend), so any session can use them
+            _themes_compiled=self._themes_compiled,
+        )
+        session._use_settings(dict(self.settings))
+        # The server can't see the client's terminal: 'auto' is what the
+        # client reported, or 256 colors if it didn't say
+        backend = self.settings.get('color_backend', 'auto')
+        if backend == 'auto':
+            backend = client_backend if client_backend in COLOR_BACKENDS[1:] else '256'
+        session.set_color_backend(backend)
+        session._state_loaded = True
+        session.state_file = None
+        session.session_id = session_id
+        return session
+    
+    def _state_sections(self):
+        return {'settings': self.settings, 'variables': self.variables, 'memory': self.memory}
+    
+    def sync_state(self):
+        """Pick up what other sessions saved to the state file or appended to the history
+        
+        Polls at most every STATE_POLL_SECONDS, so back-to-back commands
+        don't each stat() the file.
+        """
+        now = time.monotonic()
+        if not self._state_loaded or now - self._state_polled < STATE_POLL_SECONDS:
+            return
+        self._state_polled = now
+        self.history.sync()
+        if self.shared_state is not None and self.shared_state.changed():
+            self._apply_state(self.shared_state.pull(self._state_sections()))
+    
+    def _apply_state(self, updates):
+        """Make changes from SharedState.pull()/push() to the settings, variables and memory"""
+        deleted = SharedState.DELETED
+        for section, changes in updates.items():
+            if section == 'settings':
+                # Settings are never removed, only changed
+                self.settings.update({key: value for key, value in changes.items() if value is not deleted})
+                continue
+            target = self._state_sections()[section]
+            for key, value in changes.items():
+                if value is deleted:
+                    target.pop(key, None)
+                else:
+                    target[key] = value
+                    if section == 'variables' and self.completer:
+                        self.completer.add_variable(key)
+    
+    def prefetch_state(self):
+        """Start loading the saved state in the background"""
+        if self._state_loaded or self._state_thread is not None:
+            return
+        self._state_thread = threading.Thread(target=self._load_initial_state, daemon=True)
+        self._state_thread.start()
     
     def parse_args(self, args_str, default=None):
         """Parse arguments from string"""
         if not args_str:
             return [default] if default is not None else []
         
-        args = []
-        for arg in args_str.split():
-            try:
-                # Try to convert to number
-                if '.' in arg:
-                    args.append(float(arg))
-                else:
-                    args.append(int(arg))
-            except:
-                args.append(arg)
-        return args
+        # Convert numbers, leave everything else as strings
+        return [_num_arg(arg) for arg in args_str.split()]
     
     def c(self, color_key, text=""):
         """Get ANSI color code with optional text"""
-        if color_key in self.colors and callable(self.colors[color_key]):
-            return self.colors[color_key](text)
-        return self.colors.get(color_key, self.colors['RST']) + text
+        # Replaced per instance by the backend's c() once the backend is chosen
+        return self.backend.c(color_key, text)
+    
+    def rainbow_gradient(self, text):
+        """Create rainbow gradient text"""
+        return self.backend.c('GRADIENT_RAINBOW', text)
+    
+    def fire_gradient(self, text):
+        """Create fire gradient text"""
+        return self.backend.c('GRADIENT_FIRE', text)
+    
+    def ocean_gradient(self, text):
+        """Create ocean gradient text"""
+        return self.backend.c('GRADIENT_OCEAN', text)
+    
+    def forest_gradient(self, text):
+        """Create forest gradient text"""
+        return self.backend.c('GRADIENT_FOREST', text)
+    
+    def pause(self, seconds):
+        """Sleep between frames or steps (skipped when headless)"""
+        if not self.headless:
+            time.sleep(seconds)
+            self.paused += seconds
+    
+    def clear_screen(self):
+        """Clear terminal screen"""
+        if self.interactive:
+            os.system('cls' if os.name == 'nt' else 'clear')
+    
+    def eye_animation(self, args):
+        """Enhanced eye animation with multiple modes (yields one frame at a time)"""
+        frames = args[0] if args and len(args) > 0 else 60
+        mode = args[1] if len(args) > 1 else self.settings['eye_type']
+        
+        budget = self.settings.get('frame_budget_ms', 0)
+        self.frame_budget = FrameBudget(budget / 1000) if budget > 0 else None
+        try:
+            previous = None
+            for frame in range(frames):
+                started = time.perf_counter()
+                if self.frame_budget:
+                    self.set_quality(QUALITY_LEVELS[self.frame_budget.level])
+                lines = self.eye_frame_lines(frame, frames, mode)
+                if not self.interactive:
+                    yield "\n".join(lines) + "\n"
+                else:
+                    yield frame_update(lines, previous)
+                previous = lines
+                # The frame's cost includes writing it out, which happens
+                # before the consumer asks for the next one
+                if self.frame_budget:
+                    self.frame_budget.observe(time.perf_counter() - started)
+                self.pause(self.settings['animation_speed'])
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            yield self.c('BR_RED', f"Animation error: {e}")
+        finally:
+            self.frame_budget = None
+            self.set_quality(QUALITY_LEVELS[0])
+    
+    def eye_command(self, args):
+        """eye [frames] [mode], or eye render <file> ... for an offline render"""
+        if args and args[0] == 'render':
+            return self.eye_render(args[1:])
+        return self.eye_animation(args)
+    
+    def eye_render(self, args):
+        """Render the animation to a file: eye render <file> [frames] [mode] [--size WxH] [--jobs N]
+        
+        Files ending in .cast are asciicast v2 recordings; anything else
+        gets the plain frames one after another. Frames are rendered in
+        chunks across a process pool and written in order (see
+        render_frames).
+        """
+        usage = self.c('BR_YELLOW', "Usage: eye render <file> [frames] [mode] [--size WxH] [--jobs N]")
+        if not args:
+            return usage
+        path, frames, mode = str(args[0]), 60, self.settings['eye_type']
+        width, height, jobs = EYE_WIDTH, EYE_HEIGHT, os.cpu_count() or 1
+        tokens = iter(args[1:])
+        for token in tokens:
+            option = str(token)
+            if option in ('--size', '--jobs'):
+                value = str(next(tokens, ''))
+                size = re.fullmatch(r'([0-9]+)x([0-9]+)', value)
+                if option == '--size' and size and int(size.group(1)) > 0 and int(size.group(2)) > 0:
+                    width, height = int(size.group(1)), int(size.group(2))
+                elif option == '--jobs' and _INT_TOKEN.match(value) and int(value) > 0:
+                    jobs = int(value)
+                else:
+                    return usage
+            elif isinstance(token, int) or _INT_TOKEN.match(option):
+                frames = int(option)
+            else:
+                mode = option
+        if mode not in self.sprites:
+            return self.c('BR_RED', f"Unknown eye mode '{mode}'")
+        
+        cast = path.lower().endswith('.cast')
+        started = time.perf_counter()
+        try:
+            with open(path, 'wb') as f:
+                if cast:
+                    header = {'version': 2, 'width': width + 4, 'height': height + 6,
+                              'timestamp': int(time.time()), 'env': {'TERM': 'xterm-256color'}}
+                    f.write(json.dumps(header).encode() + b'\n')
+                settings = dict(self.settings, color_backend=self.backend.name)
+                for chunk in render_frames(settings, width, height, mode, frames, jobs, cast):
+                    f.writelines(chunk)
+        except OSError as e:
+            return self.c('BR_RED', f"Cannot write {path}: {e.strerror}")
+        
+        elapsed = time.perf_counter() - started
+        return self.c('BR_GREEN', f"Rendered {frames} frames ({width}x{height}, {mode}) to {path}"
+                                  f" in {elapsed:.2f}s with {max(min(jobs, frames), 1)} process(es),"
+                                  f" {frames / max(elapsed, 1e-9):.1f} frames/s")
+    
+    def render_eye_frame(self, frame, frames, mode):
+        """Render one frame of the eye animation"""
+        return "\n".join(self.eye_frame_lines(frame, frames, mode)) + "\n"
+    
+    def _build_compositor(self, width=EYE_WIDTH, height=EYE_HEIGHT):
+        """Layers of the eye animation, bottom to top"""
+        compositor = Compositor(width, height)
+        compositor.add('background', self._draw_wave_layer, self._wave_layer_key)
+        compositor.add('particles', self._draw_particle_layer, self._particle_layer_key)
+        compositor.add('sprite', self._draw_eye_layer, self._eye_layer_key)
+        compositor.add('overlay', self._draw_overlay_layer, self._overlay_layer_key)
+        self.compositor = compositor
+    
+    def _style_key(self):
+        """What every layer's colors depend on"""
+        style = self._style
+        if style is None:
+            style = self._style = (self.settings['theme'], self.backend.name, self.quality)
+        return style
+    
+    def eye_frame_lines(self, frame, frames, mode):
+        """The lines of one eye animation frame: HUD around the composited layers"""
+        if mode not in self.sprites:
+            mode = 'single'
+        compositor = self.compositor
+        state = EyeFrame(frame, frames, mode, frame * self.settings['animation_speed'] * 10,
+                         compositor.width, compositor.height)
+        compositor.update(state)
+        
+        top, separator, bottom, left, right = self._frame_borders()
+        lines = [top, self._hud_title(state), separator]
+        lines.extend(left + row + right for row in compositor.rows)
+        lines.extend((separator, self._hud_footer(), bottom))
+        return lines
+    
+    def _frame_borders(self):
+        """Border strings (top, separator, bottom, left, right), built once per theme"""
+        key = self._style_key() + (self.compositor.width,)
+        cached = self._hud_cache.get('borders')
+        if cached is None or cached[0] != key:
+            theme, width = self.active_theme(), self.compositor.width
+            color, reset = theme.border, theme.reset
+            borders = (color + "╔" + "═" * width + "╗" + reset,
+                       color + "╠" + "═" * width + "╣" + reset,
+                       color + "╚" + "═" * width + "╝" + reset,
+                       color + "║ " + reset,
+                       color + " ║" + reset)
+            cached = self._hud_cache['borders'] = (key, borders)
+        return cached[1]
+    
+    def _hud_line(self, text):
+        """A HUD line: centered text between the side borders"""
+        theme = self.active_theme()
+        colored = theme.hud(text.center(self.compositor.width))
+        return theme.border + "║" + colored + theme.border + "║" + theme.reset
+    
+    def _hud_title(self, state):
+        key = self._style_key() + (state.mode, state.frame, state.frames)
+        cached = self._hud_cache.get('title')
+        if cached is None or cached[0] != key:
+            title = f"👁️ λ-EYE ANIMATION [{state.mode.upper()}] - Frame {state.frame+1}/{state.frames}"
+            cached = self._hud_cache['title'] = (key, self._hud_line(title))
+        return cached[1]
+    
+    def _hud_footer(self):
+        settings_info = self._footer_info
+        if settings_info is None:
+            settings_info = self._footer_info = (
+                f"Dolphins: {self.settings['dolphin_count']} | Speed: {self.settings['animation_speed']:.2f}s"
+                f" | Theme: {self.settings['theme']}")
+        if self.frame_budget:
+            settings_info += f" | Quality: {self.quality.name}"
+        if self.settings['show_time']:
+            dt = datetime.now()
+            ns = time.time_ns() % 1000000000000
+            current_time = dt.strftime("%Y-%m-%d %H:%M:%S.%f") + f"{(ns % 1000000 // 1000):03d}" + f"{(ns % 1000):03d}p"
+            settings_info += f" | Time: {current_time}"
+        
+        key = self._style_key() + (settings_info,)
+        cached = self._hud_cache.get('footer')
+        if cached is None or cached[0] != key:
+            cached = self._hud_cache['footer'] = (key, self._hud_line(settings_info))
+        return cached[1]
+    
+    def _wave_layer_key(self, state):
+        return self._style_key() + (state.t,)
+    
+    def _draw_wave_layer(self, state, rows):
+        """Draw mathematical wave patterns"""
+        width, height = state.width, state.height
+        geometry = self._wave_geometry.get((width, height))
+        if geometry is None:
+            geometry = self._wave_geometry[(width, height)] = wave_geometry(width, height)
+        columns, lines, radii = geometry
+        
+        time_val = state.t
+        cells = self._layer_theme().wave_cells
+        
+        # wave2 only depends on the column and wave3 on the row
+        wave2s = [math.sin(dx4 + time_val) for dx4 in columns]
+        step = self.quality.wave_step
+        if step > 1:
+            # Reduced detail: sample every step-th cell each way and fill
+            # the block around it with the same cell
+            for y in range(0, height, step):
+                wave3 = math.cos(lines[y] - time_val * 1.5)
+                radius_row = radii[y]
+                block = {}
+                for x in range(0, width, step):
+                    wave_value = (math.sin(radius_row[x] - time_val * 2) + wave2s[x] + wave3) / 3
+                    if abs(wave_value) > 0.3:
+                        cell = cells[int((wave_value + 1) * 50)][min(int(abs(wave_value) * 5), 4)]
+                        block.update(dict.fromkeys(range(x, min(x + step, width)), cell))
+                for row in rows[y:y + step]:
+                    row.update(block)
+            return
+        
+        for y, (dy3, radius_row) in enumerate(zip(lines, radii)):
+            wave3 = math.cos(dy3 - time_val * 1.5)
+            row = rows[y]
+            for x, (radius, wave2) in enumerate(zip(radius_row, wave2s)):
+                # Interference pattern
+                wave_value = (math.sin(radius - time_val * 2) + wave2 + wave3) / 3
+                
+                if abs(wave_value) > 0.3:  # Threshold for drawing
+                    # Color by the wave phase normalized to 0-100, glyph by strength
+                    row[x] = cells[int((wave_value + 1) * 50)][min(int(abs(wave_value) * 5), 4)]
+    
+    def _particle_layer_key(self, state):
+        mode = self.settings['particle_effects']
+        if mode == 'off':
+            return self._style_key() + (mode,)
+        return self._style_key() + (mode, self.settings['particle_count'], state.t, state.frame)
+    
+    def _draw_particle_layer(self, state, rows):
+        """Draw the particle system, or the legacy 20-particle effect"""
+        mode = self.settings['particle_effects']
+        if mode == 'system':
+            self._draw_particle_system(state, rows)
+        elif mode == 'legacy':
+            self._draw_legacy_particles(state, rows)
+    
+    def _particle_system(self, state):
+        """The particle system for the current size and particle_count"""
+        count = max(0, self.settings['particle_count'])
+        system = self._particles
+        if system is None or (system.count, system.width, system.height) != (count, state.width, state.height):
+            center_x, center_y = state.width / 2, state.height / 2
+            emitters = [Emitter(center_x, center_y, state.width * 0.3, state.height * 0.35, k * math.pi / 2)
+                        for k in range(4)]
+            system = self._particles = ParticleSystem(count, state.width, state.height, emitters)
+        system.active = int(system.count * self.quality.particles)
+        return system
+    
+    def _draw_particle_system(self, state, rows):
+        """Draw particles by density: more particles in a cell, denser glyph"""
+        system = self._particle_system(state)
+        if not system.active:
+            return
+        
+        # Follow the animation frame by frame; start over when it restarts
+        if state.frame < system.frame:
+            system.reset(0.0)
+        dt = self.settings['animation_speed'] * 10
+        for _ in range(min(state.frame - system.frame, self.particle_catchup)):
+            system.step(dt)
+        system.frame = state.frame
+        
+        levels = self._layer_theme().density_cells
+        top = len(levels) - 1
+        for (x, y), count in system.density().items():
+            rows[y][x] = levels[min(count - 1, top)]
+    
+    def _draw_legacy_particles(self, state, rows):
+        """Draw particle effects"""
+        center_x, center_y = state.width // 2, state.height // 2
+        time_val, frame = state.t, state.frame
+        cells = self._layer_theme().particle_cells
+        
+        particle_count = int(20 * self.quality.particles)
+        for i in range(particle_count):
+            radius = 5 + math.sin(time_val * 2 + i) * 15
+            angle = time_val * 3 + i * 0.3
+            
+            x = int(center_x + radius * math.cos(angle))
+            y = int(center_y + radius * 0.5 * math.sin(angle))
+            
+            if 0 <= x < state.width and 0 <= y < state.height:
+                rows[y][x] = cells[i % len(cells)][(i + frame) % len(PARTICLE_GLYPHS)]
     
-    def rainbow_gradient(self, text):
-        """Create rainbow gradient text"""
-        rainbow = ['\033[38;5;196m', '\033[38;5;202m', '\033[38;5;208m',
-                  '\033[38;5;214m', '\033[38;5;220m', '\033[38;5;226m',
-                  '\033[38;5;190m', '\033[38;5;154m', '\033[38;5;118m',
-                  '\033[38;5;82m', '\033[38;5;46m', '\033[38;5;47m',
-                  '\033[38;5;48m', '\033[38;5;49m', '\033[38;5;51m',
-                  '\033[38;5;45m', '\033[38;5;39m', '\033[38;5;33m',
-                  '\033[38;5;27m', '\033[38;5;21m', '\033[38;5;57m',
-                  '\033[38;5;93m', '\033[38;5;129m', '\033[38;5;165m',
-                  '\033[38;5;201m', '\033[38;5;200m', '\033[38;5;199m',
-                  '\033[38;5;198m', '\033[38;5;197m']
-        
-        result = ""
-        for i, char in enumerate(text):
-            color = rainbow[i % len(rainbow)]
-            result += f"{color}{char}"
-        return result + self.colors['RST']
+    def _eye_layer_key(self, state):
+        return self._style_key() + (state.mode, state.t)
     
-    def fire_gradient(self, text):
-        """Create fire gradient text"""
-        fire = ['\033[38;5;232m', '\033[38;5;52m', '\033[38;5;88m',
-                '\033[38;5;124m', '\033[38;5;160m', '\033[38;5;196m',
-                '\033[38;5;202m', '\033[38;5;208m', '\033[38;5;214m',
-                '\033[38;5;220m', '\033[38;5;226m']
+    def _draw_eye_layer(self, state, rows):
+        """Draw the eye sprite, its colors cycling with time
         
-        result = ""
-        for i, char in enumerate(text):
-            color = fire[i % len(fire)]
-            result += f"{color}{char}"
-        return result + self.colors['RST']
-    
-    def ocean_gradient(self, text):
-        """Create ocean gradient text"""
-        ocean = ['\033[38;5;17m', '\033[38;5;18m', '\033[38;5;19m',
-                 '\033[38;5;20m', '\033[38;5;21m', '\033[38;5;27m',
-                 '\033[38;5;33m', '\033[38;5;39m', '\033[38;5;45m',
-                 '\033[38;5;51m', '\033[38;5;87m']
+        Everything but the time term is prepared once per sprite, size and
+        phase coefficients: the opaque cells and their quantized spatial
+        phase. A frame is then a lookup in the theme's phase table per cell
+        and one dict update per row.
+        """
+        theme = self._layer_theme()
+        kx, ky, kt = theme.eye_k
+        key = (state.mode, state.width, state.height, kx, ky)
+        compiled = self._sprite_geometry.get(key)
+        if compiled is None:
+            compiled = self._sprite_geometry[key] = self._compile_sprite(
+                self.sprites[state.mode], state.width, state.height, kx, ky)
         
-        result = ""
-        for i, char in enumerate(text):
-            color = ocean[i % len(ocean)]
-            result += f"{color}{char}"
-        return result + self.colors['RST']
+        step = quantize_phase(state.t * kt)
+        mask = PHASE_STEPS - 1
+        lut, reset = theme.eye_lut, theme.reset
+        for draw_y, xs, phases, chars in compiled:
+            rows[draw_y].update(zip(xs, [lut[(phase + step) & mask] + char + reset
+                                         for phase, char in zip(phases, chars)]))
     
-    def forest_gradient(self, text):
-        """Create forest gradient text"""
-        forest = ['\033[38;5;22m', '\033[38;5;28m', '\033[38;5;34m',
-                  '\033[38;5;40m', '\033[38;5;46m', '\033[38;5;47m',
-                  '\033[38;5;48m', '\033[38;5;49m', '\033[38;5;50m',
-                  '\033[38;5;51m', '\033[38;5;85m']
-        
-        result = ""
-        for i, char in enumerate(text):
-            color = forest[i % len(forest)]
-            result += f"{color}{char}"
-        return result + self.colors['RST']
+    def _compile_sprite(self, sprite, width, height, kx, ky):
+        """Per row: (screen row, columns, phases, glyphs)"""
+        start_y = height // 2 - sprite.height // 2
+        start_x = width // 2 - len(sprite.lines[0]) // 2
+        compiled = []
+        for (y, xs), phases in zip(sprite.mask, sprite.phases(kx, ky)):
+            draw_y = start_y + y
+            if not 0 <= draw_y < height:
+                continue
+            line = sprite.lines[y]
+            visible = [(start_x + x, phase, line[x])
+                       for x, phase in zip(xs, phases) if 0 <= start_x + x < width]
+            if visible:
+                compiled.append((draw_y, *map(list, zip(*visible))))
+        return compiled
     
-    def clear_screen(self):
-        """Clear terminal screen"""
-        os.system('cls' if os.name == 'nt' else 'clear')
+    def _overlay_layer_key(self, state):
+        settings = self.settings
+        blinking = (state.frame % 30) < 2
+        if blinking:
+            return self._style_key() + (True,)
+        return self._style_key() + (False, state.t, state.frame, settings['dolphin_count'],
+                                    settings['quantum_mode'], settings['trail_length'])
     
-    def eye_animation(self, args):
-        """Enhanced eye animation with multiple modes"""
-        frames = args[0] if args and len(args) > 0 else 60
-        mode = args[1] if len(args) > 1 else self.settings['eye_type']
+    def _draw_overlay_layer(self, state, rows):
+        """Draw the lambda pupil and the dolphins orbiting it"""
+        # Blink logic
+        blink_period = 30
+        blink_duration = 2
+        if (state.frame % blink_period) < blink_duration:
+            return
         
-        try:
-            for frame in range(frames):
-                self.clear_screen()
-                t = frame * self.settings['animation_speed'] * 10
-                
-                # Dynamic header based on theme
-                theme_color = {
-                    'ocean': 'BR_CYAN',
-                    'fire': 'BR_RED',
-                    'forest': 'BR_GREEN',
-                    'rainbow': 'GRADIENT_RAINBOW'
-                }.get(self.settings['theme'], 'BR_CYAN')
-                
-                print(self.c(theme_color) + "╔" + "═" * 80 + "╗" + self.c('RST'))
-                
-                title = f"👁️ λ-EYE ANIMATION [{mode.upper()}] - Frame {frame+1}/{frames}"
-                if self.settings['theme'] == 'rainbow':
-                    colored_title = self.c('GRADIENT_RAINBOW', title.center(80))
-                else:
-                    colored_title = self.c('BR_WHITE', title.center(80))
-                
-                print(self.c(theme_color) + "║" + colored_title + self.c(theme_color) + "║" + self.c('RST'))
-                print(self.c(theme_color) + "╠" + "═" * 80 + "╣" + self.c('RST'))
-                
-                # Create frame buffer
-                buffer = [[' ' for _ in range(80)] for _ in range(24)]
-                
-                # Draw wave patterns (background first)
-                self._draw_wave_patterns(buffer, t, 40, 12)
-                
-                # Draw particle effects if enabled (on background)
-                if self.settings['particle_effects']:
-                    self._draw_particle_effects(buffer, t, 40, 12, frame)
-                
-                # Draw selected eye art (overlay on background)
-                self._draw_enhanced_eye(buffer, 40, 12, t, mode)
-                
-                # Blink logic
-                blink_period = 30
-                blink_duration = 2
-                is_blinking = (frame % blink_period) < blink_duration
-                
-                # FIXED: Lambda symbol position - 4 braille symbols left from the exact center
-                # The eye art's iris center appears to be around column 34-35 in the displayed output
-                # Let's position it at column 34 (40-6 = 34) to be exactly in the iris center
-                lambda_x = 34  # Adjusted to be in the center of the iris
-                lambda_y = 12  # Vertical center
-                
-                dolphin_count = self.settings['dolphin_count']
-                
-                if not is_blinking:
-                    # Draw central symbol (pupil) - FIXED: Use theme color from prompt
-                    symbol = 'λ'
-                    
-                    if self.settings['quantum_mode']:
-                        symbol = '⚛️'
-                    
-                    # Get the same color as used in the prompt
-                    theme_colors = {
-                        'ocean': 'BR_CYAN',
-                        'fire': 'BR_RED',
-                        'forest': 'BR_GREEN',
-                        'rainbow': 'BR_MAGENTA'  # Use bright magenta for rainbow theme in eye
-                    }
-                    
-                    lambda_color = theme_colors.get(self.settings['theme'], 'BR_CYAN')
-                    
-                    # Make sure we're within buffer bounds
-                    if 0 <= lambda_x < 80 and 0 <= lambda_y < 24:
-                        buffer[lambda_y][lambda_x] = self.c(lambda_color) + self.c('BOLD') + symbol + self.c('RST')
-                    
-                    # Draw rotating dolphins around the lambda symbol
-                    for i in range(dolphin_count):
-                        self._draw_rotating_element(buffer, t, lambda_x, lambda_y, i, dolphin_count, frame)
-                
-                # Render frame with border
-                for y in range(24):
-                    line = self.c(theme_color) + "║ " + self.c('RST')
-                    for x in range(80):
-                        line += buffer[y][x]
-                    line += self.c(theme_color) + " ║" + self.c('RST')
-                    print(line)
-                
-                # Footer with settings info
-                print(self.c(theme_color) + "╠" + "═" * 80 + "╣" + self.c('RST'))
-                
-                settings_info = f"Dolphins: {dolphin_count} | Speed: {self.settings['animation_speed']:.2f}s | Theme: {self.settings['theme']}"
-                if self.settings['show_time']:
-                    dt = datetime.now()
-                    ns = time.time_ns() % 1000000000000
-                    current_time = dt.strftime("%Y-%m-%d %H:%M:%S.%f") + f"{(ns % 1000000 // 1000):03d}" + f"{(ns % 1000):03d}p"
-                    settings_info += f" | Time: {current_time}"
-                
-                footer = settings_info.center(80)
-                if self.settings['theme'] == 'rainbow':
-                    colored_footer = self.c('GRADIENT_RAINBOW', footer)
-                else:
-                    colored_footer = self.c('BR_WHITE', footer)
-                
-                print(self.c(theme_color) + "║" + colored_footer + self.c(theme_color) + "║" + self.c('RST'))
-                print(self.c(theme_color) + "╚" + "═" * 80 + "╝" + self.c('RST'))
-                
-                time.sleep(self.settings['animation_speed'])
-        except Exception as e:
-            print(self.c('BR_RED', f"Animation error: {e}"))
-            import traceback
-            traceback.print_exc()
-            time.sleep(1)
-    
-    def _draw_enhanced_eye(self, buffer, center_x, center_y, time_val, mode):
-        """Draw enhanced eye art with animation"""
-        if mode not in self.eye_arts:
-            mode = 'single'
+        # FIXED: Lambda symbol position - 4 braille symbols left from the exact center
+        # The eye art's iris center appears to be around column 34-35 in the displayed output
+        # Let's position it at column 34 (40-6 = 34) to be exactly in the iris center
+        lambda_x = state.width // 2 - 6  # Adjusted to be in the center of the iris
+        lambda_y = state.height // 2  # Vertical center
         
-        eye_art = self.eye_arts[mode]
-        eye_height = len(eye_art)
-        eye_width = len(eye_art[0])
+        # Draw central symbol (pupil) - FIXED: Use theme color from prompt
+        symbol = '⚛️' if self.settings['quantum_mode'] else 'λ'
+        theme = self._layer_theme()
         
-        start_y = center_y - eye_height // 2
-        start_x = center_x - eye_width // 2
+        # Make sure we're within buffer bounds
+        if 0 <= lambda_x < state.width and 0 <= lambda_y < state.height:
+            rows[lambda_y][lambda_x] = theme.accent + self.c('BOLD') + symbol + theme.reset
         
-        for y, line in enumerate(eye_art):
-            draw_y = start_y + y
-            for x, char in enumerate(line):
-                draw_x = start_x + x
-                if 0 <= draw_x < 80 and 0 <= draw_y < 24:
-                    if char != ' ':
-                        # Animated color based on theme
-                        if self.settings['theme'] == 'fire':
-                            wave = (math.sin(x * 0.3 + y * 0.2 + time_val * 2) + 1) / 2
-                            colors = [self.c('BR_RED'), self.c('RED'), self.c('YELLOW'), 
-                                     self.c('BR_YELLOW'), self.c('RED'), self.c('BR_RED')]
-                        elif self.settings['theme'] == 'ocean':
-                            wave = (math.sin(x * 0.2 + y * 0.15 + time_val * 1.5) + 1) / 2
-                            colors = [self.c('BR_BLUE'), self.c('BLUE'), self.c('CYAN'), 
-                                     self.c('BR_CYAN'), self.c('BLUE'), self.c('BR_BLUE')]
-                        elif self.settings['theme'] == 'forest':
-                            wave = (math.sin(x * 0.25 + y * 0.18 + time_val * 1.8) + 1) / 2
-                            colors = [self.c('BR_GREEN'), self.c('GREEN'), self.c('BR_YELLOW'), 
-                                     self.c('YELLOW'), self.c('GREEN'), self.c('BR_GREEN')]
-                        else:  # rainbow or default
-                            wave = (math.sin(x * 0.2 + y * 0.1 + time_val * 3) + 1) / 2
-                            colors = [self.c('BR_MAGENTA'), self.c('MAGENTA'), self.c('BR_CYAN'),
-                                     self.c('CYAN'), self.c('BR_BLUE'), self.c('BLUE')]
-                        
-                        color_idx = int(wave * (len(colors) - 1))
-                        buffer[draw_y][draw_x] = colors[color_idx] + char + self.c('RST')
-    
-    def _draw_rotating_element(self, buffer, time_val, center_x, center_y, index, total, frame):
+        # Draw rotating dolphins around the lambda symbol
+        dolphin_count = self.settings['dolphin_count']
+        for i in range(dolphin_count):
+            self._draw_rotating_element(rows, state, lambda_x, lambda_y, i, dolphin_count)
+    
+    def _draw_rotating_element(self, rows, state, center_x, center_y, index, total):
         """Draw rotating elements (dolphins or other symbols)"""
         elements = ['🐬', '🐋', '🦈', '🐟', '🐠', '🦑', '🐙', '🪼']
         quantum_elements = ['⚛️', '🔮', '🌀', '✨', '🌌', '🪐', '⭐', '☄️']
@@ -427,111 +3488,35 @@ class EnhancedλOS:
         if self.settings['quantum_mode']:
             elements = quantum_elements
         
+        time_val, width, height = state.t, state.width, state.height
         orbit_radius = 15 + math.sin(time_val * 0.5 + index) * 5
         angle = time_val * 2 + index * (2 * math.pi / total)
         
         x = int(center_x + orbit_radius * math.cos(angle))
         y = int(center_y + orbit_radius * 0.6 * math.sin(angle))
         
-        if 0 <= x < 80 and 0 <= y < 24:
-            element = elements[(index + frame) % len(elements)]
-            theme_colors = {
-                'ocean': ['BR_CYAN', 'BR_BLUE', 'CYAN'],
-                'fire': ['BR_RED', 'BR_YELLOW', 'RED'],
-                'forest': ['BR_GREEN', 'GREEN', 'BR_YELLOW'],
-                'rainbow': ['BR_MAGENTA', 'BR_CYAN', 'BR_BLUE']
-            }
-            
-            colors = theme_colors.get(self.settings['theme'], ['BR_CYAN', 'BR_BLUE', 'CYAN'])
-            color = colors[index % len(colors)]
+        if 0 <= x < width and 0 <= y < height:
+            element = elements[(index + state.frame) % len(elements)]
+            theme = self._layer_theme()
+            colors, reset = theme.orbit, theme.reset
             
-            buffer[y][x] = self.c(color) + element + self.c('RST')
+            rows[y][x] = colors[index % len(colors)] + element + reset
             
-            # Draw trail if enabled
-            if self.settings['trail_length'] > 0:
-                for i in range(1, self.settings['trail_length'] + 1):
+            # Draw trail if enabled (and the quality level allows it)
+            trail_length = self.settings['trail_length']
+            if self.quality.trail is not None:
+                trail_length = min(trail_length, self.quality.trail)
+            if trail_length > 0:
+                for i in range(1, trail_length + 1):
                     trail_angle = angle - i * 0.2
                     trail_x = int(center_x + (orbit_radius * (1 - i*0.1)) * math.cos(trail_angle))
                     trail_y = int(center_y + (orbit_radius * 0.6 * (1 - i*0.1)) * math.sin(trail_angle))
                     
-                    if 0 <= trail_x < 80 and 0 <= trail_y < 24:
+                    if 0 <= trail_x < width and 0 <= trail_y < height:
                         trail_chars = ['~', '·', '.', ',']
                         trail_char = trail_chars[(index + i) % len(trail_chars)]
                         trail_color = colors[(index + i) % len(colors)]
-                        buffer[trail_y][trail_x] = self.c(trail_color) + trail_char + self.c('RST')
-    
-    def _draw_particle_effects(self, buffer, time_val, center_x, center_y, frame):
-        """Draw particle effects"""
-        particle_count = 20
-        for i in range(particle_count):
-            radius = 5 + math.sin(time_val * 2 + i) * 15
-            angle = time_val * 3 + i * 0.3
-            
-            x = int(center_x + radius * math.cos(angle))
-            y = int(center_y + radius * 0.5 * math.sin(angle))
-            
-            if 0 <= x < 80 and 0 <= y < 24:
-                particles = ['∙', '∘', '⋅', '○', '●', '⋆', '✦', '✧', '❂', '❉']
-                particle = particles[(i + frame) % len(particles)]
-                
-                # Color particles based on theme
-                if self.settings['theme'] == 'fire':
-                    colors = ['BR_RED', 'RED', 'YELLOW', 'BR_YELLOW']
-                elif self.settings['theme'] == 'ocean':
-                    colors = ['BR_BLUE', 'BLUE', 'CYAN', 'BR_CYAN']
-                elif self.settings['theme'] == 'forest':
-                    colors = ['BR_GREEN', 'GREEN', 'BR_YELLOW', 'YELLOW']
-                else:
-                    colors = ['BR_MAGENTA', 'MAGENTA', 'BR_CYAN', 'CYAN']
-                
-                color = colors[i % len(colors)]
-                buffer[y][x] = self.c(color) + particle + self.c('RST')
-    
-    def _draw_wave_patterns(self, buffer, time_val, center_x, center_y):
-        """Draw mathematical wave patterns"""
-        for x in range(80):
-            for y in range(24):
-                # Calculate distance from center
-                dx = (x - center_x) / 20
-                dy = (y - center_y) / 15
-                
-                # Create interference pattern
-                wave1 = math.sin(math.sqrt(dx*dx + dy*dy) * 3 - time_val * 2)
-                wave2 = math.sin(dx * 4 + time_val)
-                wave3 = math.cos(dy * 3 - time_val * 1.5)
-                
-                wave_value = (wave1 + wave2 + wave3) / 3
-                
-                if abs(wave_value) > 0.3:  # Threshold for drawing
-                    chars = ['·', '∙', '∘', '⊙', '◉']
-                    char_idx = min(int(abs(wave_value) * len(chars)), len(chars) - 1)
-                    
-                    # Color based on wave phase
-                    phase = (wave_value + 1) / 2  # Normalize to 0-1
-                    
-                    if self.settings['theme'] == 'fire':
-                        if phase < 0.33:
-                            color = 'RED'
-                        elif phase < 0.66:
-                            color = 'YELLOW'
-                        else:
-                            color = 'BR_YELLOW'
-                    elif self.settings['theme'] == 'ocean':
-                        if phase < 0.33:
-                            color = 'BLUE'
-                        elif phase < 0.66:
-                            color = 'CYAN'
-                        else:
-                            color = 'BR_CYAN'
-                    else:
-                        if phase < 0.33:
-                            color = 'MAGENTA'
-                        elif phase < 0.66:
-                            color = 'CYAN'
-                        else:
-                            color = 'BR_CYAN'
-                    
-                    buffer[y][x] = self.c(color) + chars[char_idx] + self.c('RST')
+                        rows[trail_y][trail_x] = trail_color + trail_char + reset
     
     def lambda_evaluator(self, args):
         """Enhanced lambda calculus evaluator"""
@@ -546,8 +3531,11 @@ class EnhancedλOS:
             var_name = var_name.strip()
             var_expr = var_expr.strip()
             
-            # Store in variables
+            # Store in variables, and share them with other sessions
             self.variables[var_name] = var_expr
+            if self.completer:
+                self.completer.add_variable(var_name)
+            self.autosave()
             return self.c('BR_GREEN', f"Variable '{var_name}' defined as: {var_expr}")
         
         # Check if expression uses defined variables
@@ -568,7 +3556,7 @@ class EnhancedλOS:
                     return self.c('BR_CYAN', f"λ-expression: {result}")
             
             # Church numeral conversion
-            if expr.isdigit():
+            if expr.isdigit() and len(expr) <= 3 and int(expr) <= MAX_CHURCH_NUMERAL:
                 num = int(expr)
                 church_num = self.int_to_church(num)
                 int_val = self.church_to_int(church_num)
@@ -580,20 +3568,37 @@ class EnhancedλOS:
             
             # Try evaluating as Python expression (with safety)
             # Restricted evaluation for safety
-            allowed_names = {'math': math, 'sin': math.sin, 'cos': math.cos, 
-                             'tan': math.tan, 'pi': math.pi, 'e': math.e}
+            allowed_names = dict(MATH_NAMES)
             
-            try:
-                result = eval(expr, {"__builtins__": {}}, allowed_names)
-                return self.c('BR_GREEN', f"{expr} = {result}")
-            except ZeroDivisionError:
-                return self.c('BR_RED', "Division by zero!")
-            except:
-                pass
+            # Estimate the cost first: refuse what can't finish, and run what
+            # might not under CPU and memory limits
+            cost = ExpressionCost(expr)
+            verdict = cost.verdict
+            if verdict == 'reject':
+                self._command_failed()
+                return self.c('BR_RED', f"Refusing to evaluate: the expression {cost.describe()}")
+            
+            warning = ""
+            if verdict == 'limited' and can_limit_evaluation():
+                warning = self.c('BR_YELLOW', f"⚠ The expression {cost.describe()}; evaluating with a"
+                                              f" {EVAL_CPU_SECONDS}s CPU / {EVAL_MEMORY_BYTES >> 20} MB limit\n")
+                outcome = evaluate_limited(expr, allowed_names)
+            else:
+                outcome = evaluate_expression(expr, allowed_names)
+            
+            if outcome[0] == 'ok':
+                return warning + self.c('BR_GREEN', f"{expr} = {outcome[1]}")
+            # Also how unknown commands end up: they aren't valid expressions either
+            self._command_failed()
+            if outcome[0] == 'limit':
+                return warning + self.c('BR_RED', f"Evaluation stopped: it exceeded its {outcome[1]}")
+            if outcome[1] == 'ZeroDivisionError':
+                return warning + self.c('BR_RED', "Division by zero!")
             
-            return self.c('BR_YELLOW', f"Expression: {expr}")
+            return warning + self.c('BR_YELLOW', f"Expression: {expr}")
             
         except Exception as e:
+            self._command_failed()
             return self.c('BR_RED', f"Evaluation error: {e}")
     
     def church_converter(self, args):
@@ -682,6 +3687,11 @@ class EnhancedλOS:
     
     def fibonacci_generator(self, args):
         """Generate Fibonacci sequence"""
+        if args and args[0] == 'seq':
+            # Unbounded stream, one number per line: fibonacci seq 100000 | head 5
+            count = args[1] if len(args) > 1 and isinstance(args[1], int) else 10
+            return self._fibonacci_stream(count)
+        
         if not args:
             count = 10
         else:
@@ -707,6 +3717,13 @@ class EnhancedλOS:
         return self.c('BR_CYAN', f"Fibonacci sequence (first {count} numbers):\n") + \
                self.c('BR_GREEN', fib_str) + extra
     
+    def _fibonacci_stream(self, count):
+        """Yield the first `count` Fibonacci numbers as lines"""
+        a, b = 0, 1
+        for _ in range(count):
+            yield f"{a}\n"
+            a, b = b, a + b
+    
     def prime_checker(self, args):
         """Check if a number is prime"""
         if not args:
@@ -739,9 +3756,29 @@ class EnhancedλOS:
                 divisors_str += f", ... (and {len(divisors) - 10} more)"
             return self.c('BR_RED', f"✗ {n} is not prime. Divisors: {divisors_str}")
     
+    def _is_shared_file(self, filename):
+        """Whether filename is the state file shells share, however it's spelled"""
+        shared = self.shared_state
+        return os.path.realpath(filename) == os.path.realpath(shared.path if shared else state_path(STATE_FILE))
+    
     def save_state(self, args):
-        """Save current state to file"""
-        filename = args[0] if args else 'λos_state.json'
+        """Save current state to file (merged with other sessions' if it's the shared one)"""
+        filename = args[0] if args else state_path(STATE_FILE)
+        
+        sections = self._state_sections()  # loads the state first
+        shared = self.shared_state
+        if self._is_shared_file(filename):
+            if shared is None:
+                # Replay and server sessions keep to themselves; writing the
+                # file whole would wipe what the shells sharing it saved
+                self._command_failed()
+                return self.c('BR_RED', f"This session doesn't share {filename}; save to another file")
+            try:
+                extra = {'history': self.history[-100:], 'timestamp': datetime.now().isoformat()}
+                self._apply_state(shared.push(sections, extra))
+                return self.c('BR_GREEN', f"State saved to {filename}")
+            except Exception as e:
+                return self.c('BR_RED', f"Save error: {e}")
         
         state = {
             'settings': self.settings,
@@ -758,21 +3795,36 @@ class EnhancedλOS:
         except Exception as e:
             return self.c('BR_RED', f"Save error: {e}")
     
+    def _read_state(self, filename):
+        """Read a saved state file"""
+        with open(filename, 'r') as f:
+            return json.load(f)
+    
     def load_state(self, args):
         """Load state from file"""
         if args and args[0] == 'auto':
-            filename = 'λos_state.json'
+            filename = state_path(STATE_FILE)
         else:
-            filename = args[0] if args else 'λos_state.json'
+            filename = args[0] if args else state_path(STATE_FILE)
         
         try:
-            with open(filename, 'r') as f:
-                state = json.load(f)
+            state = self._read_state(filename)
+            
+            shared = self.shared_state
+            if shared is not None and self._is_shared_file(filename):
+                # Merge it rather than letting its values override newer ones here
+                shared.seen = None
+                self._apply_state(shared.pull(self._state_sections()))
+                return self.c('BR_GREEN', f"State loaded from {filename} (saved: {state.get('timestamp', 'unknown')})")
             
             self.settings.update(state.get('settings', {}))
             self.variables.update(state.get('variables', {}))
             self.memory.update(state.get('memory', {}))
-            self.history = state.get('history', [])
+            if self.completer:
+                for var_name in state.get('variables', {}):
+                    self.completer.add_variable(var_name)
+            if not len(self.history):
+                self.history.extend(state.get('history', []))
             
             timestamp = state.get('timestamp', 'unknown')
             return self.c('BR_GREEN', f"State loaded from {filename} (saved: {timestamp})")
@@ -825,22 +3877,7 @@ class EnhancedλOS:
             return self.settings_manager([])
         
         elif cmd == 'reset':
-            default_settings = {
-                'theme': 'ocean',
-                'animation_speed': 0.1,
-                'prompt_style': 'λ>',
-                'autosave': True,
-                'sound_effects': False,
-                'color_mode': 'gradient',
-                'auto_complete': True,
-                'show_time': True,
-                'quantum_mode': False,
-                'dolphin_count': 3,
-                'eye_type': 'single',
-                'particle_effects': True,
-                'trail_length': 3,
-            }
-            self.settings = default_settings
+            self.settings.replace(DEFAULT_SETTINGS)
             return self.c('BR_GREEN', "Settings reset to defaults")
         
         elif cmd == 'set' and len(args) >= 3:
@@ -853,7 +3890,11 @@ class EnhancedλOS:
             # Convert value to appropriate type
             old_value = self.settings[key]
             
-            if isinstance(old_value, bool):
+            if key in SETTING_CHOICES:
+                if value_str not in SETTING_CHOICES[key]:
+                    return self.c('BR_RED', f"{key} must be one of: {', '.join(SETTING_CHOICES[key])}")
+                value = value_str
+            elif isinstance(old_value, bool):
                 value = value_str.lower() in ['true', 'yes', 'on', '1']
             elif isinstance(old_value, int):
                 try:
@@ -870,14 +3911,13 @@ class EnhancedλOS:
             
             self.settings[key] = value
             
-            if self.settings['autosave']:
-                self.save_state(['λos_state.json'])
+            self.autosave()
             
             return self.c('BR_GREEN', f"Setting '{key}' changed from '{old_value}' to '{value}'")
         
         elif cmd == 'theme' and len(args) >= 2:
             theme = args[1].lower()
-            valid_themes = ['ocean', 'fire', 'forest', 'rainbow']
+            valid_themes = list(self.themes)
             
             if theme in valid_themes:
                 self.settings['theme'] = theme
@@ -885,6 +3925,13 @@ class EnhancedλOS:
             else:
                 return self.c('BR_RED', f"Invalid theme. Choose from: {', '.join(valid_themes)}")
         
+        elif cmd == 'theme':
+            result = self.c('BR_CYAN', "Themes: ") + ", ".join(
+                self.c('BR_GREEN', name) if name == self.settings['theme'] else name for name in self.themes)
+            for error in self.theme_errors:
+                result += "\n" + self.c('BR_RED', f"themes/{error}")
+            return result
+        
         else:
             return self.c('BR_YELLOW', "Usage: settings [show|reset|set <key> <value>|theme <name>]")
     
@@ -893,75 +3940,509 @@ class EnhancedλOS:
         if not input_str.strip():
             return ""
         
-        # Add to history
-        self.history.append(input_str)
-        self.history_index = len(self.history)
+        # Catch up with other shells sharing the state and history files
+        self.sync_state()
         
+        # Add to history (batch runs leave the interactive history alone)
+        self.last_status = 0
+        seq = self.last_seq = None
+        if self.interactive:
+            seq = self.last_seq = self.history.append(input_str)
+            self.history_index = len(self.history)
+            if self.completer:
+                self.completer.add_history(input_str)
+        
+        if self.recorder and not input_str.startswith('record'):
+            self.recorder.record(input_str)
+        
+        return self._execute(input_str)
+    
+    def _execute(self, input_str):
+        """Run a command line: quick command, pipeline or single command"""
         # Check for quick commands (0-9)
         if len(input_str) == 1 and input_str in self.quick_commands:
             input_str = self.quick_commands[input_str]
         
+        # cmd | filter | filter ...
+        if '|' in input_str:
+            stages = self._parse_pipeline(input_str)
+            if stages:
+                stream = None
+                for stage in stages:
+                    stream = iter_lines(iter_chunks(self._dispatch(stage, stream)))
+                return (line + "\n" for line in stream)
+        
+        return self._dispatch(input_str)
+    
+    def _parse_pipeline(self, input_str):
+        """Split a pipeline into stages, or None if it isn't one
+        
+        Every stage after the first must be a command that reads input, so
+        expressions such as `λ a | b` still go to the evaluator.
+        """
+        stages = _PIPE.split(input_str.strip())
+        if len(stages) < 2:
+            return None
+        for stage in stages[1:]:
+            command = self.commands.get(stage.split(maxsplit=1)[0]) if stage else None
+            if command is None or not command.reads_input:
+                return None
+        return stages
+    
+    def _dispatch(self, input_str, lines=None):
+        """Run a single command, feeding it `lines` if it reads input"""
+        started = time.perf_counter()
+        
         # Split command and arguments
         parts = input_str.strip().split(maxsplit=1)
-        cmd = parts[0]
-        args_str = parts[1] if len(parts) > 1 else ""
-        args = self.parse_args(args_str)
+        command = self.commands.get(parts[0])
+        
+        # Default: try as lambda expression
+        if command is None:
+            return self._timed('λ', self.lambda_evaluator([input_str]), started)
+        
+        try:
+            args = command.parse(parts[1] if len(parts) > 1 else "")
+            if command.reads_input:
+                result = command.handler(self, args, lines if lines is not None else iter(()))
+            else:
+                result = command.handler(self, args)
+            if result is None:
+                result = ""
+        except Exception as e:
+            self._command_failed()
+            result = self.c('BR_RED', f"Command error: {e}")
+        return self._timed(command.name, result, started)
+    
+    def _timed(self, name, result, started):
+        """Record a command's latency; streamed output is timed as it's produced"""
+        if result is None or isinstance(result, str):
+            self.observe(name, time.perf_counter() - started)
+            return result
+        return self._timed_stream(name, iter(result), time.perf_counter() - started)
+    
+    def _timed_stream(self, name, chunks, elapsed):
+        """Yield chunks, counting only the time spent producing them
+        
+        Time the consumer spends writing a chunk and time spent in pause()
+        are left out, so an animation is charged for its frames, not its
+        frame rate.
+        """
+        paused = self.paused
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - started
+                yield chunk
+        finally:
+            self.observe(name, elapsed - (self.paused - paused))
+    
+    def observe(self, name, seconds):
+        """Add one latency sample to the histogram for `name`"""
+        histogram = self.latency.get(name)
+        if histogram is None:
+            histogram = self.latency[name] = LatencyHistogram()
+        histogram.add(seconds)
+    
+    def command_type(self, input_str):
+        """Canonical command name for an input line (λ for expressions)"""
+        if len(input_str) == 1 and input_str in self.quick_commands:
+            input_str = self.quick_commands[input_str]
+        parts = input_str.split(maxsplit=1)
+        command = self.commands.get(parts[0]) if parts else None
+        return command.name if command else 'λ'
+    
+    def record_command(self, args):
+        """Record typed commands with timings: record <file> | record stop"""
+        if not args:
+            if self.recorder:
+                return self.c('BR_CYAN', f"Recording to {self.recorder.path} ({self.recorder.count} commands)")
+            return self.c('BR_YELLOW', "Usage: record <file> | record stop")
+        
+        if args[0] == 'stop':
+            if not self.recorder:
+                return self.c('BR_YELLOW', "Not recording")
+            recorder, self.recorder = self.recorder, None
+            recorder.close()
+            return self.c('BR_GREEN', f"Recorded {recorder.count} commands to {recorder.path}")
+        
+        if self.recorder:
+            self.recorder.close()
+        self.recorder = SessionRecorder(args[0])
+        return self.c('BR_GREEN', f"Recording commands to {args[0]} (record stop to finish)")
+    
+    def replay_command(self, args):
+        """Replay a recorded session headlessly: replay <file|demo> [--speed max|N] [--memory]"""
+        usage = self.c('BR_YELLOW', "Usage: replay <file|demo> [--speed max|<factor>] [--memory]")
+        if not args:
+            return usage
+        
+        speed = None
+        if '--speed' in args[1:]:
+            value = args[args.index('--speed') + 1] if args.index('--speed') + 1 < len(args) else 'max'
+            if value != 'max':
+                try:
+                    speed = float(value)
+                except ValueError:
+                    speed = 0.0
+                if not (speed > 0 and math.isfinite(speed)):
+                    self._command_failed()
+                    return usage
+        
+        if args[0] == 'demo':
+            # The built-in workload: the guided tour, back to back
+            workload = [(0.0, cmd) for cmd, desc in DEMO_SEQUENCE]
+        else:
+            workload = SessionRecorder.load(args[0])
+        
+        return self.replay(workload, speed, memory='--memory' in args[1:]).report(self, args[0])
+    
+    def replay(self, workload, speed=None, memory=False):
+        """Run (offset, command) pairs in a scratch session and time them
+        
+        speed=None runs back to back; otherwise the recorded gaps are kept,
+        divided by speed. memory=True also measures peak memory, with
+        tracemalloc running through the replay, which inflates the
+        latencies. The workload runs once either way: its commands can
+        have side effects (files, recordings) that mustn't happen twice.
+        Returns a ReplayResult.
+        """
+        import tracemalloc
+        
+        result = ReplayResult()
+        tracemalloc_was_on = tracemalloc.is_tracing()
+        if memory:
+            if not tracemalloc_was_on:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        try:
+            started = time.perf_counter()
+            self._replay_pass(workload, speed, result)
+            result.elapsed = time.perf_counter() - started
+            if memory:
+                result.peak_memory = tracemalloc.get_traced_memory()[1] - baseline
+        finally:
+            if memory and not tracemalloc_was_on:
+                tracemalloc.stop()
+        return result
+    
+    def _replay_pass(self, workload, speed, result):
+        session = self.new_session('replay')
+        session.set_color_backend(self.backend.name)
+        session.headless = True
+        session.interactive = False
+        previous = None
+        try:
+            for offset, command in workload:
+                if speed and previous is not None and offset > previous:
+                    time.sleep((offset - previous) / speed)
+                previous = offset
+                
+                command_started = time.perf_counter()
+                # Drain the output; producing it is part of the command's cost
+                for _ in iter_chunks(session.process_command(command)):
+                    pass
+                result.add(session.command_type(command), time.perf_counter() - command_started)
+        except ShellExit:
+            pass
+    
+    def _command_failed(self):
+        """Record a non-zero exit status for the current command"""
+        self.last_status = 1
+        if self.last_seq is not None:
+            self.history.set_status(self.last_seq, 1)
+    
+    def emit(self, result, out=None, newline=True):
+        """Write a command result, streaming chunks as they are produced
+        
+        Like print(), a newline is added if the output doesn't end with one
+        (unless newline=False).
+        """
+        out = out or sys.stdout
+        last = "\n"
+        try:
+            for chunk in iter_chunks(result):
+                if chunk:
+                    out.write(chunk)
+                    out.flush()
+                    last = chunk
+        except Exception as e:
+            # Streaming handlers fail while being consumed, not when called
+            self._command_failed()
+            if newline and not last.endswith("\n"):
+                out.write("\n")
+            last = self.c('BR_RED', f"Command error: {e}")
+            out.write(last)
+        if newline and not last.endswith("\n"):
+            out.write("\n")
+        out.flush()
+    
+    def head_filter(self, args, lines):
+        """First n lines of the input"""
+        count = args[0] if args and isinstance(args[0], int) else 10
+        return (line + "\n" for line in itertools.islice(lines, max(count, 0)))
+    
+    def tail_filter(self, args, lines):
+        """Last n lines of the input"""
+        count = args[0] if args and isinstance(args[0], int) else 10
+        return (line + "\n" for line in collections.deque(lines, maxlen=max(count, 0)))
+    
+    def grep_filter(self, args, lines):
+        """Input lines containing the text"""
+        needle = " ".join(map(str, args))
+        return (line + "\n" for line in lines if needle in line)
+    
+    def count_filter(self, args, lines):
+        """Number of input lines"""
+        return str(sum(1 for _ in lines))
+    
+    def help_command(self, args):
+        """Show help for a topic"""
+        return self.show_help(args[0] if args else "")
+    
+    def clear_command(self, args):
+        """Clear the screen and redraw the banner"""
+        if self.interactive:
+            return CLEAR_SCREEN + self.banner_text()
+        return ""
+    
+    def quit_command(self, args):
+        """Save (if autosave is on) and exit"""
+        self.autosave()
+        farewell = self.c('BR_MAGENTA', "\n🌀 Farewell from Enhanced λOS! 🌌\n")
+        if self.interactive and self.session_id is None:
+            print(farewell)
+        raise ShellExit(farewell)
+    
+    def autosave(self):
+        """Save to the state file if autosave is on (server sessions have none)"""
+        if self.settings['autosave'] and self.state_file:
+            started = time.perf_counter()
+            self.save_state([self.state_file])
+            self.observe('autosave', time.perf_counter() - started)
+    
+    def toggle_quantum(self, args):
+        """Toggle quantum mode"""
+        self.settings['quantum_mode'] = not self.settings['quantum_mode']
+        mode = "enabled" if self.settings['quantum_mode'] else "disabled"
+        return self.c('BR_MAGENTA', f"Quantum mode {mode} ✨")
+    
+    def bench_command(self, args):
+        """Run a micro-benchmark: bench dispatch|backends"""
+        subject = args[0] if args else 'dispatch'
+        if subject == 'dispatch':
+            return self.dispatch_benchmark()
+        if subject == 'backends':
+            return self.backend_benchmark()
+        return self.c('BR_YELLOW', "Usage: bench dispatch|backends")
+    
+    def backend_benchmark(self, frames=10):
+        """Output bytes and render time of eye frames and gradient text per backend"""
+        text = "λOS gradient benchmark " * 40
+        current = self.backend
+        rows = []
+        try:
+            for name in COLOR_BACKENDS[1:]:
+                self.set_color_backend(name)
+                start = time.perf_counter()
+                size = sum(len(self.render_eye_frame(frame, frames, 'single').encode('utf-8'))
+                           for frame in range(frames))
+                frame_time = (time.perf_counter() - start) / frames
+                
+                for key in GRADIENTS_256:
+                    self.c(key, text)  # warm the truecolor ramp cache
+                start = time.perf_counter()
+                gradient_size = 0
+                for key in GRADIENTS_256:
+                    gradient_size += len(self.c(key, text).encode('utf-8'))
+                gradient_time = (time.perf_counter() - start) / len(GRADIENTS_256)
+                rows.append((name, size // frames, frame_time, gradient_size // len(GRADIENTS_256), gradient_time))
+        finally:
+            self.set_color_backend(current.name)
+        
+        report = self.c('BR_CYAN', f"Color backends ({frames} eye frames, {len(text)}-char gradients):\n")
+        for name, size, frame_time, gradient_size, gradient_time in rows:
+            report += self.c('BR_WHITE', f"  {name:10} frame {size:7} B {frame_time * 1000:8.2f} ms"
+                             f"   gradient {gradient_size:6} B {gradient_time * 1e6:8.1f} µs\n")
+        return report
+    
+    def dispatch_benchmark(self, rounds=2000):
+        """Per-command overhead of process_command over calling the handler"""
+        samples = ['church 3', 'prime 97', 'factorial 5', 'fibonacci 8', 'λ 2+2', 'help quick', '2+2']
+        # Keep the benchmark's thousands of samples out of `stats`
+        interactive, self.interactive = self.interactive, False
+        latency, self.latency = self.latency, {}
+        report = self.c('BR_CYAN', f"Dispatch overhead ({rounds} rounds):\n")
+        try:
+            for line in samples:
+                name, _, args_str = line.partition(' ')
+                command = self.commands.get(name)
+                if command is None:
+                    call = lambda: self.lambda_evaluator([line])
+                else:
+                    args = command.parse(args_str)
+                    call = lambda: command.handler(self, args)
+                
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    self.process_command(line)
+                dispatched = (time.perf_counter() - start) / rounds
+                
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    call()
+                direct = (time.perf_counter() - start) / rounds
+                
+                report += self.c('BR_WHITE', f"  {line:14} {dispatched * 1e6:9.2f} µs total"
+                                 f" {(dispatched - direct) * 1e6:8.2f} µs dispatch\n")
+        finally:
+            self.interactive = interactive
+            self.latency = latency
+        return report
+    
+    def stats_command(self, args):
+        """Latency per command since the session started: stats [reset]"""
+        if args and args[0] == 'reset':
+            self.latency.clear()
+            return self.c('BR_GREEN', "Latency stats cleared")
+        if not self.latency:
+            return self.c('BR_YELLOW', "No commands timed yet")
         
-        # Check if command is a function
-        if cmd in self.functions:
+        report = self.c('BR_CYAN', "Command latency (percentiles are log2 bucket bounds):\n")
+        report += self.c('BR_WHITE', f"  {'command':12} {'count':>7} {'mean ms':>9} {'p50 ms':>9}"
+                                     f" {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'total s':>9}\n")
+        for name, histogram in sorted(self.latency.items(), key=lambda item: -item[1].total):
+            mean = histogram.total / histogram.count
+            report += self.c('BR_WHITE', f"  {name:12} {histogram.count:7} {mean * 1000:9.3f}"
+                                         f" {histogram.percentile(0.50) * 1000:9.3f}"
+                                         f" {histogram.percentile(0.95) * 1000:9.3f}"
+                                         f" {histogram.percentile(0.99) * 1000:9.3f}"
+                                         f" {histogram.max * 1000:9.3f} {histogram.total:9.3f}\n")
+        return report
+    
+    def plugins_command(self, args):
+        """Plugins found in plugins/, their commands, and whether they're loaded"""
+        registry = self.commands
+        if not registry.plugins and not registry.plugin_errors:
+            return self.c('BR_YELLOW', f"No plugins in {PLUGIN_DIR}")
+        report = self.c('BR_CYAN', "Plugins:\n")
+        for plugin in registry.plugins:
+            names = [entry['name'] for entry in plugin.manifest['commands']]
+            state = self.c('BR_GREEN', "loaded") if plugin.module else self.c('DIM', "not loaded")
+            report += self.c('BR_WHITE', f"  {plugin.name:12} {', '.join(names)}  ") + state + "\n"
+        for error in registry.plugin_errors:
+            report += self.c('BR_RED', f"  {error}\n")
+        return report
+    
+    def profile_command(self, args, limit=15):
+        """Run a command under cProfile and tracemalloc: profile <command...>"""
+        line = args[0] if args else ""
+        if not line:
+            return self.c('BR_YELLOW', "Usage: profile <command...>")
+        import cProfile
+        import tracemalloc
+        
+        tracemalloc_was_on = tracemalloc.is_tracing()
+        if not tracemalloc_was_on:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profiler.enable()
             try:
-                result = self.functions[cmd](args)
-                if result is not None:
-                    return result
-                return ""
-            except Exception as e:
-                return self.c('BR_RED', f"Command error: {e}")
+                # Keep the output alive so its allocations show up in the snapshot
+                output = list(iter_chunks(self._execute(line)))
+            finally:
+                profiler.disable()
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            if not tracemalloc_was_on:
+                tracemalloc.stop()
         
-        # Check for 'e' command for eye animation
-        elif cmd == 'e':
-            return self.eye_animation(self.parse_args(args_str, default=60))
+        report = self.c('BR_CYAN', f"Profile of '{line}': {elapsed * 1000:.2f} ms,"
+                                   f" {sum(map(len, output))} chars of output, peak memory {peak / 1e6:.2f} MB\n")
         
-        # Check for settings command
-        elif cmd in ['settings', 'set', 'config']:
-            return self.settings_manager(args)
+        # profiler.getstats() is C-level; build rows from the pstats-style dict instead
+        profiler.create_stats()
+        rows = sorted(profiler.stats.items(), key=lambda item: -item[1][3])[:limit]
+        report += self.c('BR_WHITE', f"  {'calls':>8} {'own ms':>9} {'cum ms':>9}  function\n")
+        for (filename, lineno, function), (_, calls, own, cumulative, _) in rows:
+            where = f"{os.path.basename(filename)}:{lineno}({function})" if lineno else function
+            report += self.c('BR_WHITE', f"  {calls:8} {own * 1000:9.3f} {cumulative * 1000:9.3f}  {where}\n")
         
-        # Check for help command
-        elif cmd == 'help':
-            return self.show_help(args_str)
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                           tracemalloc.Filter(False, cProfile.__file__)))
+        report += self.c('BR_CYAN', "Top allocation sites (still allocated at the end of the run):\n")
+        for stat in snapshot.statistics('lineno')[:limit // 2]:
+            frame = stat.traceback[0]
+            report += self.c('BR_WHITE', f"  {stat.size / 1024:9.1f} KiB {stat.count:7} blocks"
+                                         f"  {os.path.basename(frame.filename)}:{frame.lineno}\n")
+        return report
+    
+    def history_command(self, args):
+        """Show or search the persistent command history"""
+        if args and args[0] in ('search', 'rsearch'):
+            if len(args) < 2:
+                return self.c('BR_YELLOW', "Usage: history search <text> [limit] | history rsearch <text> [n]")
+            
+            count = int(args[-1]) if len(args) > 2 and args[-1].isdigit() else None
+            text = ' '.join(args[1:-1] if count is not None else args[1:])
+            
+            # Leave out the search command itself, if it was recorded
+            before = self.last_seq if self.last_seq is not None else self.history.next_seq
+            start = time.perf_counter()
+            if args[0] == 'rsearch':
+                # Ctrl-R style: the n-th most recent match
+                match = self.history.rsearch(text, (count or 1) - 1, before)
+                entries = [match] if match else []
+            else:
+                entries = self.history.search(text, count or 20, before)
+            elapsed = (time.perf_counter() - start) * 1000
+            
+            if not entries:
+                return self.c('BR_YELLOW', f"No history entries match '{text}'")
+            title = f"History matches for '{text}' ({elapsed:.2f} ms):\n"
+        else:
+            count = int(args[0]) if args and args[0].isdigit() else 20
+            entries = self.history.recent(count)
+            title = f"Command History ({len(self.history)} entries):\n"
         
-        # Check for clear command
-        elif cmd == 'clear':
-            self.clear_screen()
-            self.show_banner()
-            return ""
+        history_text = self.c('BR_CYAN', title)
+        for seq, timestamp, status, text in entries:
+            stamp = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+            mark = self.c('BR_RED', f" [{status}]") if status else ""
+            history_text += self.c('BR_WHITE', f"  {seq + 1:5}. {self.c('DIM', stamp)}{self.c('BR_WHITE')} {text}") + mark + "\n"
+        return history_text
+    
+    def _setup_readline(self):
+        """Enable line editing, tab completion and Ctrl-R over recent history"""
+        try:
+            import readline
+        except ImportError:
+            return
         
-        # Check for quit command
-        elif cmd in ['quit', 'exit', 'q']:
-            if self.settings['autosave']:
-                self.save_state(['λos_state.json'])
-            print(self.c('BR_MAGENTA', "\n🌀 Farewell from Enhanced λOS! 🌌\n"))
-            exit()
-        
-        # Check for history command
-        elif cmd == 'history':
-            history_text = self.c('BR_CYAN', "Command History:\n")
-            for i, cmd in enumerate(self.history[-20:], 1):  # Last 20 commands
-                history_text += self.c('BR_WHITE', f"  {i:3}. {cmd}\n")
-            return history_text
-        
-        # Check for demo command
-        elif cmd == 'demo':
-            return self.run_demo(args)
-        
-        # Check for quantum command
-        elif cmd == 'quantum':
-            self.settings['quantum_mode'] = not self.settings['quantum_mode']
-            mode = "enabled" if self.settings['quantum_mode'] else "disabled"
-            return self.c('BR_MAGENTA', f"Quantum mode {mode} ✨")
+        readline.clear_history()
+        for seq, timestamp, status, text in self.history.recent(1000):
+            readline.add_history(text)
         
-        # Default: try as lambda expression
+        # Completion works on whole lines; see Completer
+        self.completer = Completer(self)
+        readline.set_completer(self.completer.complete)
+        readline.set_completer_delims('')
+        if 'libedit' in (readline.__doc__ or ''):
+            readline.parse_and_bind('bind ^I rl_complete')
         else:
-            return self.lambda_evaluator([input_str])
+            readline.parse_and_bind('tab: complete')
     
     def show_help(self, topic=""):
         """Show enhanced help information"""
@@ -991,7 +4472,9 @@ class EnhancedλOS:
 {self.c('BR_GREEN', 'eye [frames] [mode]')}{self.c('BR_WHITE')} - Eye animation (text alias)
 {self.c('BR_GREEN', 'dolphin [frames] [mode]')}{self.c('BR_WHITE')} - Dolphin animation (text alias)
 {self.c('BR_GREEN', 'e [frames] [mode]')}{self.c('BR_WHITE')} - Eye animation (short alias)
-{self.c('DIM', '   Modes: single, triple, quantum')}
+{self.c('DIM', '   Modes: single, triple, quantum, or a sprite in sprites/ (.txt, .pgm, .ppm)')}
+{self.c('BR_GREEN', 'eye render <file> [frames] [mode] [--size WxH] [--jobs N]')}{self.c('BR_WHITE')} - Render to a file
+{self.c('DIM', '   .cast files are asciicast v2; frames are rendered on N processes (default: all cores)')}
 
 {self.c('BR_GREEN', 'demo')}{self.c('BR_WHITE')} - Run interactive demo
 {self.c('BR_GREEN', 'quantum')}{self.c('BR_WHITE')} - Toggle quantum mode
@@ -1007,6 +4490,7 @@ class EnhancedλOS:
 {self.c('BR_GREEN', 'factorial <n>')}{self.c('BR_WHITE')} - Calculate factorial
 {self.c('BR_GREEN', 'fibonacci [n]')}{self.c('BR_WHITE')} - Generate sequence (default: 10)
 {self.c('BR_GREEN', 'prime <n>')}{self.c('BR_WHITE')} - Check if number is prime
+{self.c('BR_GREEN', 'fibonacci seq <n>')}{self.c('BR_WHITE')} - Stream the sequence, one number per line
 """
         elif topic == "system":
             help_text = f"""
@@ -1015,15 +4499,32 @@ class EnhancedλOS:
 {self.c('BR_GREEN', 'settings show')}{self.c('BR_WHITE')} - Show current settings
 {self.c('BR_GREEN', 'settings set <key> <value>')}{self.c('BR_WHITE')} - Change setting
 {self.c('BR_GREEN', 'settings theme <name>')}{self.c('BR_WHITE')} - Change theme
+{self.c('BR_GREEN', 'settings theme')}{self.c('BR_WHITE')} - List themes
 {self.c('BR_GREEN', 'settings reset')}{self.c('BR_WHITE')} - Reset to defaults
-{self.c('DIM', '   Themes: ocean, fire, forest, rainbow')}
+{self.c('DIM', '   Themes: ocean, fire, forest, rainbow, or themes/<name>.json')}
+{self.c('DIM', '   color_backend: auto, truecolor, 256, 16, plain')}
+{self.c('DIM', '   frame_budget_ms: eye animation detail drops to stay within it (0: off)')}
 
 {self.c('BR_GREEN', 'save [filename]')}{self.c('BR_WHITE')} - Save state to file
 {self.c('BR_GREEN', 'load [filename]')}{self.c('BR_WHITE')} - Load state from file
 {self.c('BR_GREEN', 'export [filename]')}{self.c('BR_WHITE')} - Export settings
 {self.c('BR_GREEN', 'import [filename]')}{self.c('BR_WHITE')} - Import settings
-{self.c('BR_GREEN', 'history')}{self.c('BR_WHITE')} - Show command history
+{self.c('BR_GREEN', 'history [n]')}{self.c('BR_WHITE')} - Show last n commands (default: 20)
+{self.c('BR_GREEN', 'history search <text>')}{self.c('BR_WHITE')} - Search the whole history
+{self.c('BR_GREEN', 'history rsearch <text> [n]')}{self.c('BR_WHITE')} - n-th most recent match (like Ctrl-R)
 {self.c('BR_GREEN', 'clear')}{self.c('BR_WHITE')} - Clear screen
+{self.c('BR_GREEN', 'bench dispatch')}{self.c('BR_WHITE')} - Measure per-command dispatch overhead
+{self.c('BR_GREEN', 'bench backends')}{self.c('BR_WHITE')} - Compare color backends
+{self.c('BR_GREEN', 'record <file>')}{self.c('BR_WHITE')} - Record commands with timings (record stop)
+{self.c('BR_GREEN', 'replay <file|demo> [--speed max|N] [--memory]')}{self.c('BR_WHITE')} - Replay headlessly, report latency
+{self.c('BR_GREEN', 'profile <command...>')}{self.c('BR_WHITE')} - Profile a command's time and allocations
+{self.c('BR_GREEN', 'stats [reset]')}{self.c('BR_WHITE')} - Per-command latency histograms
+{self.c('BR_GREEN', 'plugins')}{self.c('BR_WHITE')} - Plugins in plugins/ (loaded on first use)
+
+{self.c('BR_GREEN', 'cmd | head [n]')}{self.c('BR_WHITE')} - First n lines of a command's output
+{self.c('BR_GREEN', 'cmd | tail [n]')}{self.c('BR_WHITE')} - Last n lines
+{self.c('BR_GREEN', 'cmd | grep <text>')}{self.c('BR_WHITE')} - Lines containing text
+{self.c('BR_GREEN', 'cmd | count')}{self.c('BR_WHITE')} - Number of lines
 {self.c('BR_GREEN', 'quit/exit/q')}{self.c('BR_WHITE')} - Exit λOS
 """
         else:
@@ -1051,80 +4552,73 @@ class EnhancedλOS:
 {self.c('BR_WHITE', '  prime 17       # Check if 17 is prime')}
 """
         
+        # Plugin commands are listed under the topic of their category
+        for command in self.commands.commands.values():
+            if command.plugin and command.category == topic:
+                help_text += f"{self.c('BR_GREEN', command.usage)}{self.c('BR_WHITE')} - {command.help}\n"
+        
         return help_text
     
     def run_demo(self, args):
-        """Run interactive demonstration"""
-        demos = [
-            ("eye 10", "Quick eye animation"),
-            ("λ x=10", "Define variable x = 10"),
-            ("λ x/2", "Calculate x/2"),
-            ("church 3", "Show Church numeral 3"),
-            ("prime 17", "Check if 17 is prime"),
-            ("fibonacci 8", "First 8 Fibonacci numbers"),
-            ("factorial 5", "Calculate 5!"),
-            ("settings theme fire", "Change to fire theme"),
-            ("quantum", "Toggle quantum mode"),
-            ("settings show", "Show current settings"),
-        ]
-        
-        demo_text = self.c('BR_CYAN', "🚀 Starting Enhanced λOS Demo:\n")
-        
-        for cmd, desc in demos:
-            demo_text += f"\n{self.c('BR_YELLOW', desc)}"
-            demo_text += f"\n{self.c('BR_CYAN', 'λ> ')}{self.c('BR_GREEN', cmd)}\n"
+        """Run interactive demonstration (streams each step as it runs)"""
+        yield self.c('BR_CYAN', "🚀 Starting Enhanced λOS Demo:\n")
+        
+        for cmd, desc in DEMO_SEQUENCE:
+            yield f"\n{self.c('BR_YELLOW', desc)}"
+            yield f"\n{self.c('BR_CYAN', 'λ> ')}{self.c('BR_GREEN', cmd)}\n"
             
-            result = self.process_command(cmd)
-            if result:
-                demo_text += f"{result}\n"
+            for chunk in iter_chunks(self.process_command(cmd)):
+                yield chunk
+            yield "\n"
             
-            time.sleep(0.3)
+            self.pause(0.3)
         
-        demo_text += f"\n{self.c('BR_MAGENTA', '✨ Demo complete! Try your own commands.')}"
-        return demo_text
+        yield f"\n{self.c('BR_MAGENTA', '✨ Demo complete! Try your own commands.')}"
     
     def show_banner(self):
         """Show enhanced system banner"""
-        banner = f"""
+        print(self.banner_text())
+    
+    def banner_text(self):
+        """The system banner"""
+        return f"""
 {self.c('GRADIENT_RAINBOW', "╔══════════════════════════════════════════════════════════════╗")}
 {self.c('GRADIENT_RAINBOW', "║")}{self.c('BR_WHITE', "           🌌 ENHANCED λOS - Lambda Calculus Shell 🌌          ")}{self.c('GRADIENT_RAINBOW', "║")}
 {self.c('GRADIENT_RAINBOW', "║")}{self.c('BR_CYAN', "   Church-Turing Complete • Quantum Mode • 0-9 Quick Commands   ")}{self.c('GRADIENT_RAINBOW', "║")}
 {self.c('GRADIENT_RAINBOW', "╚══════════════════════════════════════════════════════════════╝")}
 {self.c('RST')}
 """
-        print(banner)
     
     def get_prompt(self):
         """Get formatted prompt based on settings"""
-        themes = {
-            'ocean': 'BR_CYAN',
-            'fire': 'BR_RED',
-            'forest': 'BR_GREEN',
-            'rainbow': 'BR_MAGENTA'  # For prompt, use bright magenta for rainbow theme
-        }
-        
-        color = themes.get(self.settings['theme'], 'BR_CYAN')
+        if self._prompt is None:
+            self._prompt = self._build_prompt()
+        color, symbol = self._prompt
         
         if self.settings['show_time']:
             dt = datetime.now()
             ns = time.time_ns() % 1000000000000
             current_time = dt.strftime("%Y-%m-%d %H:%M:%S.%f") + f"{(ns % 1000000 // 1000):03d}" + f"{(ns % 1000):03d}p"
-            time_part = self.c(color) + f"[{current_time}] " + self.c('RST')
+            time_part = color + f"[{current_time}] " + self.c('RST')
         else:
             time_part = ""
-        
+        return time_part + symbol
+    
+    def _build_prompt(self):
+        """(accent color, the prompt after the time), kept until the theme or style changes"""
+        color = self.active_theme().accent
         prompt_style = self.settings['prompt_style']
         
         if prompt_style == 'λ>':
-            prompt_symbol = self.c(color, "λ>")
+            prompt_symbol = color + "λ>"
         elif prompt_style == '∫>':
-            prompt_symbol = self.c(color, "∫>")
+            prompt_symbol = color + "∫>"
         elif prompt_style == '🌀':
-            prompt_symbol = self.c(color, "🌀")
+            prompt_symbol = color + "🌀"
         else:
-            prompt_symbol = self.c(color, prompt_style)
+            prompt_symbol = color + prompt_style
         
-        return f"{time_part}{self.c('BOLD')}{prompt_symbol}{self.c('RST')} "
+        return color, f"{self.c('BOLD')}{prompt_symbol}{self.c('RST')} "
     
     def integral_visualizer(self, args):
         """Placeholder for integral visualizer"""
@@ -1138,8 +4632,61 @@ class EnhancedλOS:
         """Placeholder for summation visualizer"""
         return self.c('BR_YELLOW', "Summation visualizer not implemented yet")
     
+    def run_batch(self, commands, output_format='text', report=False):
+        """Run commands back-to-back without banner, prompt or screen clearing
+        
+        Output is written as it is produced. With output_format='jsonl' each
+        chunk becomes an 'output' record and each command ends with a
+        'result' record carrying its status and elapsed time. Returns the
+        worst status of the commands, for the process exit status.
+        """
+        self.interactive = False
+        out = sys.stdout
+        jsonl = output_format == 'jsonl'
+        records = _JsonLinesOutput(out) if jsonl else None
+        count = 0
+        status = 0
+        started = time.perf_counter()
+        
+        try:
+            for command in commands:
+                command_started = time.perf_counter()
+                quitting = False
+                try:
+                    result = self.process_command(command)
+                    if jsonl:
+                        records.cmd = command
+                        self.emit(result, records, newline=False)
+                    else:
+                        self.emit(result, out)
+                except ShellExit:
+                    # quit/exit ends the batch like the end of its input
+                    quitting = True
+                elapsed = time.perf_counter() - command_started
+                count += 1
+                status = max(status, self.last_status)
+                
+                if jsonl:
+                    records.record({'type': 'result', 'cmd': command, 'status': self.last_status,
+                                    'elapsed_ms': round(elapsed * 1000, 3)})
+                if quitting:
+                    break
+        finally:
+            total = time.perf_counter() - started
+            rate = count / total if total > 0 else 0.0
+            if report and jsonl:
+                records.record({'type': 'summary', 'commands': count,
+                                'seconds': round(total, 6), 'commands_per_sec': round(rate, 1)})
+            elif report:
+                sys.stderr.write(f"{count} commands in {total:.3f}s ({rate:.1f} commands/sec)\n")
+        
+        self.autosave()
+        return status
+    
     def run(self):
         """Main interactive shell"""
+        # Parse the saved state while the banner is being drawn
+        self.prefetch_state()
         self.clear_screen()
         self.show_banner()
         
@@ -1155,35 +4702,429 @@ class EnhancedλOS:
         print(self.c('BR_MAGENTA', f"Current theme: {self.settings['theme'].upper()} | Quantum mode: {'ON' if self.settings['quantum_mode'] else 'OFF'}"))
         print()
         
+        self._setup_readline()
+        
         while True:
             try:
                 prompt = self.get_prompt()
                 user_input = input(prompt).strip()
                 
-                result = self.process_command(user_input)
-                if result:
-                    print(result)
+                self.emit(self.process_command(user_input))
                 
             except KeyboardInterrupt:
                 print(self.c('BR_RED', "\nλOS interrupted. Type 'quit' to exit."))
                 print()
             except EOFError:
                 print(self.c('BR_MAGENTA', "\n\n🌀 Farewell from Enhanced λOS! 🌌\n"))
-                if self.settings['autosave']:
-                    self.save_state(['λos_state.json'])
+                self.autosave()
                 exit()
             except Exception as e:
                 print(self.c('BR_RED', f"Error: {e}"))
 
-def main():
+# The shell a render worker draws with (see render_frames)
+_render_shell = None
+
+def _render_worker_init(settings, width, height, geometry):
+    """Set up a worker's shell; geometry is (shared memory name, columns, lines) or None"""
+    global _render_shell
+    shell = EnhancedλOS()
+    shell.__dict__.update(variables={}, memory={}, history=HistoryStore(None, 1))
+    shell._use_settings(dict(settings, show_time=False))
+    shell._state_loaded = True
+    shell.state_file = None
+    shell.interactive = False
+    shell.headless = True
+    # Chunks start anywhere, so the particles step through every skipped frame
+    shell.particle_catchup = sys.maxsize
+    shell._build_compositor(width, height)
+    if geometry is not None:
+        from multiprocessing import shared_memory
+        name, columns, lines = geometry
+        memory = shared_memory.SharedMemory(name=name)
+        radii = memory.buf.cast('d')
+        shell._render_memory = memory
+        shell._wave_geometry[(width, height)] = (
+            columns, lines, [radii[y * width:(y + 1) * width] for y in range(height)])
+    _render_shell = shell
+
+def _render_chunk(task):
+    """Encoded frames first..last-1 of an offline render"""
+    first, last, frames, mode, cast = task
+    shell = _render_shell
+    speed = shell.settings['animation_speed']
+    encoded = []
+    previous = None
+    for frame in range(first, last):
+        lines = shell.eye_frame_lines(frame, frames, mode)
+        if cast:
+            data = frame_update(lines, previous).replace("\n", "\r\n")
+            encoded.append(json.dumps([round(frame * speed, 6), 'o', data]).encode() + b'\n')
+        else:
+            encoded.append(("\n".join(lines) + "\n").encode())
+        previous = lines
+    return encoded
+
+def render_frames(settings, width, height, mode, frames, jobs, cast=False):
+    """Encoded frames of an offline render, in order, one chunk at a time
+    
+    With more than one job the frame sequence is split into chunks of
+    consecutive frames that a process pool renders; imap hands the chunks
+    back in order. Each chunk's first frame is complete and the rest only
+    carry the lines that changed (for asciicast). The wave field's radii,
+    the largest table the layers share, live in shared memory so workers
+    don't each build and hold a copy.
+    """
+    if min(jobs, frames) <= 1:
+        _render_worker_init(settings, width, height, None)
+        yield _render_chunk((0, frames, frames, mode, cast))
+        return
+    
+    import multiprocessing
+    from multiprocessing import shared_memory
+    columns, lines, radii = wave_geometry(width, height)
+    jobs = min(jobs, frames)
+    flat = array('d', itertools.chain.from_iterable(radii))
+    memory = shared_memory.SharedMemory(create=True, size=max(len(flat) * flat.itemsize, 1))
+    try:
+        memory.buf[:len(flat) * flat.itemsize] = flat.tobytes()
+        # A few chunks per worker keep them all busy until the end
+        size = max(1, -(-frames // (jobs * 4)))
+        tasks = [(first, min(first + size, frames), frames, mode, cast) for first in range(0, frames, size)]
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with context.Pool(jobs, _render_worker_init,
+                          (dict(settings), width, height, (memory.name, columns, lines))) as pool:
+            yield from pool.imap(_render_chunk, tasks)
+    finally:
+        memory.close()
+        memory.unlink()
+
+def parse_address(spec):
+    """('tcp', (host, port)) for host:port, else ('unix', path)"""
+    host, sep, port = spec.rpartition(':')
+    if sep and port.isdigit() and '/' not in spec:
+        return 'tcp', (host or '127.0.0.1', int(port))
+    return 'unix', spec
+
+class _RemoteOutput:
+    """File-like adapter sending written chunks to a server client
+    
+    Safe to use from worker threads: writes are handed to the event loop,
+    which keeps them in order ahead of the command's completion.
+    """
+    
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+        self._loop_thread = threading.get_ident()
+    
+    def send(self, kind, text):
+        data = (json.dumps({kind: text}, ensure_ascii=False) + "\n").encode('utf-8')
+        if threading.get_ident() == self._loop_thread:
+            self.writer.write(data)
+        else:
+            self.loop.call_soon_threadsafe(self.writer.write, data)
+    
+    def write(self, text):
+        if text:
+            self.send('out', text)
+    
+    def flush(self):
+        pass
+
+class LambdaServer:
+    """Many shell sessions in one process, over a Unix or TCP socket
+    
+    Each connection gets a session from EnhancedλOS.new_session(): its own
+    settings, variables and in-memory history, sharing the server shell's
+    command registry, color tables and eye arts, so a new session costs a
+    few small dicts. Commands run on a thread pool so slow ones (animations,
+    the demo) don't hold up other sessions, and their output is sent chunk
+    by chunk as it is produced.
+    
+    Protocol: the client starts with a {"hello": {"color": backend}} line
+    naming the color backend its terminal supports, then sends one command
+    per line. The server replies with JSON lines: {"out": text} chunks,
+    {"prompt": text} when it is ready for the next command, and
+    {"bye": text} before closing. Clients that don't say hello get 256
+    colors.
+    """
+    
+    def __init__(self, address, workers=64):
+        self.address = address
+        self.workers = workers
+        self.base = EnhancedλOS()
+        self.sessions = {}
+        self._next_id = 1
+        self._pool = None
+    
+    def serve_forever(self):
+        import asyncio
+        import concurrent.futures
+        global _evaluation_pool
+        
+        # Commands run on threads, so expressions that need limits can't be
+        # evaluated in a forked child; start the pool before any thread
+        if can_limit_evaluation():
+            _evaluation_pool = EvaluationPool(os.cpu_count() or 1)
+            _evaluation_pool.start(1)
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        kind, target = parse_address(self.address)
+        try:
+            asyncio.run(self._serve(kind, target))
+        finally:
+            self._pool.shutdown(wait=False)
+            if _evaluation_pool is not None:
+                _evaluation_pool.close()
+                _evaluation_pool = None
+            if kind == 'unix' and os.path.exists(target):
+                os.unlink(target)
+    
+    async def _serve(self, kind, target):
+        import asyncio
+        
+        if kind == 'unix':
+            if os.path.exists(target):
+                os.unlink(target)  # stale socket from an earlier run
+            server = await asyncio.start_unix_server(self._handle, path=target, backlog=1024)
+        else:
+            server = await asyncio.start_server(self._handle, *target, backlog=1024)
+        print(self.base.c('BR_GREEN', f"λOS server listening on {self.address}") + self.base.c('RST'))
+        async with server:
+            await server.serve_forever()
+    
+    async def _handle(self, reader, writer):
+        """Run one client session"""
+        import asyncio
+        
+        loop = asyncio.get_running_loop()
+        hello, pending = await self._hello(reader)
+        session = self.base.new_session(self._next_id, hello.get('color'))
+        self._next_id += 1
+        self.sessions[session.session_id] = session
+        out = _RemoteOutput(loop, writer)
+        
+        try:
+            out.send('out', session.banner_text())
+            while True:
+                out.send('prompt', session.get_prompt())
+                await writer.drain()
+                if pending is not None:
+                    line, pending = pending, None
+                else:
+                    line = await reader.readline()
+                if not line:
+                    break
+                
+                command = line.decode('utf-8', 'replace').rstrip('\r\n')
+                try:
+                    await loop.run_in_executor(self._pool, self._run_command, session, command, out)
+                except ShellExit as farewell:
+                    out.send('bye', farewell.farewell)
+                    await writer.drain()
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            del self.sessions[session.session_id]
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+    
+    @staticmethod
+    async def _hello(reader):
+        """The client's hello, and the first line if it sent a command instead"""
+        import asyncio
+        
+        try:
+            line = await asyncio.wait_for(reader.readline(), HELLO_SECONDS)
+        except asyncio.TimeoutError:
+            return {}, None
+        try:
+            message = json.loads(line)
+        except ValueError:
+            return {}, line
+        if isinstance(message, dict) and isinstance(message.get('hello'), dict):
+            return message['hello'], None
+        return {}, line
+    
+    @staticmethod
+    def _run_command(session, command, out):
+        session.emit(session.process_command(command), out)
+
+def run_client(address):
+    """Thin interactive client for a λOS server"""
+    import socket
+    
+    kind, target = parse_address(address)
+    family = socket.AF_UNIX if kind == 'unix' else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(target)
+    # The server renders the colors, so tell it what this terminal shows
+    hello = {'hello': {'color': detect_color_backend(sys.stdout)}}
+    sock.sendall((json.dumps(hello) + "\n").encode('utf-8'))
+    try:
+        import readline  # line editing for input()
+    except ImportError:
+        pass
+    
+    try:
+        for line in sock.makefile('r', encoding='utf-8'):
+            message = json.loads(line)
+            if 'out' in message:
+                sys.stdout.write(message['out'])
+                sys.stdout.flush()
+            elif 'prompt' in message:
+                try:
+                    command = input(message['prompt'])
+                except EOFError:
+                    command = 'quit'
+                sock.sendall((command + "\n").encode('utf-8'))
+            elif 'bye' in message:
+                print(message['bye'])
+                break
+    finally:
+        sock.close()
+
+_IMPORT_FINISHED = time.perf_counter()
+
+def startup_benchmark():
+    """Report import, construct and first-prompt times"""
+    import io
+    import contextlib
+    
+    t0 = time.perf_counter()
+    os_system = EnhancedλOS()
+    t1 = time.perf_counter()
+    
+    # Same order as run(): kick off the state load, draw the banner, build the prompt
+    with contextlib.redirect_stdout(io.StringIO()):
+        os_system.prefetch_state()
+        os_system.show_banner()
+    t2 = time.perf_counter()
+    os_system.get_prompt()
+    t3 = time.perf_counter()
+    
+    timings = [
+        ('import', _IMPORT_FINISHED - _IMPORT_STARTED),
+        ('construct', t1 - t0),
+        ('banner', t2 - t1),
+        ('first prompt', t3 - t2),
+        ('time to prompt', (_IMPORT_FINISHED - _IMPORT_STARTED) + (t3 - t0)),
+    ]
+    print(os_system.c('BR_CYAN', "λOS startup benchmark:"))
+    for label, seconds in timings:
+        print(os_system.c('BR_WHITE', f"  {label:16} {seconds * 1000:9.3f} ms"))
+    print(os_system.c('RST'), end="")
+
+def iter_command_string(text):
+    """Commands from a `-c` string separated by ';' or newlines"""
+    for line in text.splitlines():
+        for command in line.split(';'):
+            if command.strip():
+                yield command.strip()
+
+def iter_script(lines):
+    """Commands from script lines, skipping blanks and # comments"""
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+def parse_cli(argv):
+    """Parse command line options"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog='ldmos.py', description="Enhanced λOS - Lambda Calculus Shell")
+    parser.add_argument('script', nargs='?',
+                        help="run commands from a script file (e.g. demo.λ); '-' reads stdin")
+    parser.add_argument('-c', dest='command', metavar='COMMANDS',
+                        help="run ';'-separated commands and exit")
+    parser.add_argument('--format', choices=['text', 'jsonl'], default='text',
+                        help="batch output format (default: text)")
+    parser.add_argument('--throughput', action='store_true',
+                        help="report commands/sec when a batch run ends")
+    parser.add_argument('--serve', metavar='ADDRESS',
+                        help="host sessions on a Unix socket path or host:port")
+    parser.add_argument('--connect', metavar='ADDRESS',
+                        help="connect to a λOS server")
+    parser.add_argument('--workers', type=int, default=64,
+                        help="server threads for running commands (default: 64)")
+    parser.add_argument('--startup-bench', action='store_true',
+                        help="report import, construct and first-prompt times and exit")
+    parser.add_argument('--bench', action='store_true',
+                        help="run the benchmarks/ suite against its baseline and exit (1 on regression)")
+    parser.add_argument('--bench-filter', metavar='TEXT',
+                        help="only run benchmarks whose name contains TEXT (e.g. render)")
+    parser.add_argument('--baseline', metavar='FILE',
+                        help="baseline JSON to compare with (default: benchmarks/baseline.json)")
+    parser.add_argument('--threshold', type=float, metavar='PERCENT',
+                        help="slowdown over the baseline that fails the run (default: 25)")
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="with --bench: store the results as the new baseline")
+    return parser.parse_args(argv)
+
+def run_benchmarks(options):
+    """The benchmarks/ suite next to this script; returns the exit status"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    try:
+        import benchmarks
+    except ImportError:
+        print("benchmarks/ not found next to ldmos.py")
+        return 2
+    finally:
+        sys.path.pop(0)
+    kwargs = {'pattern': options.bench_filter, 'update': options.update_baseline}
+    if options.baseline:
+        kwargs['baseline_path'] = options.baseline
+    if options.threshold is not None:
+        kwargs['threshold'] = options.threshold
+    return benchmarks.run(sys.modules[__name__], **kwargs)
+
+def main(argv=None):
     """Main entry point"""
+    argv = sys.argv[1:] if argv is None else argv
+    os_system = None
+    status = 0
     try:
+        # argparse is only imported when there is something to parse
+        options = parse_cli(argv) if argv else None
+        if options and options.startup_bench:
+            startup_benchmark()
+            return
+        if options and options.bench:
+            sys.exit(run_benchmarks(options))
+        if options and options.serve:
+            LambdaServer(options.serve, options.workers).serve_forever()
+            return
+        if options and options.connect:
+            run_client(options.connect)
+            return
+        
         os_system = EnhancedλOS()
-        os_system.run()
+        if options and options.command is not None:
+            status = os_system.run_batch(iter_command_string(options.command), options.format, options.throughput)
+        elif options and options.script and options.script != '-':
+            with open(options.script, encoding='utf-8') as script:
+                status = os_system.run_batch(iter_script(script), options.format, options.throughput)
+        elif (options and options.script == '-') or not sys.stdin.isatty():
+            # Commands piped in: handle each line as it arrives
+            status = os_system.run_batch(iter_script(sys.stdin), options.format if options else 'text',
+                                         options.throughput if options else False)
+        else:
+            os_system.run()
     except KeyboardInterrupt:
-        print(f"\n{EnhancedλOS().c('BR_RED')}λOS session ended.{EnhancedλOS().c('RST')}")
+        backend = os_system.backend if os_system else get_color_backend('auto')
+        print(f"\n{backend.c('BR_RED', 'λOS session ended.')}{backend.c('RST')}")
     except Exception as e:
-        print(f"{EnhancedλOS().c('BR_RED')}Fatal error: {e}{EnhancedλOS().c('RST')}")
+        # stderr, so a jsonl stream on stdout stays valid
+        backend = os_system.backend if os_system else get_color_backend('auto', sys.stderr)
+        print(f"{backend.c('BR_RED', f'Fatal error: {e}')}{backend.c('RST')}", file=sys.stderr)
+        sys.exit(1)
+    if status:
+        sys.exit(status)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
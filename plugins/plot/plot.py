@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# λOS plot plugin: braille function plots (see manifest.json)
+# `ldmos` is the running λOS module, set by Plugin.load
+import ast
+import math
+import shlex
+import shutil
+from array import array
+
+DEFAULT_WIDTH = 72
+DEFAULT_HEIGHT = 20
+
+# Samples per dot column unless --samples says otherwise
+OVERSAMPLING = 8
+MAX_SAMPLES = 10 ** 7
+
+# Samples evaluated per map() call
+BATCH = 1 << 16
+
+SERIES_COLORS = ('BR_YELLOW', 'BR_MAGENTA', 'BR_GREEN', 'BR_RED', 'BR_BLUE', 'BR_WHITE')
+
+USAGE = "Usage: plot <expr> [xmin xmax] [expr2 ...] [--samples N] [--size WxH] [--y ymin ymax]"
+
+class PlotError(Exception):
+    pass
+
+def plot_command(shell, args):
+    """plot <expr> [xmin xmax] [expr2 ...]: expressions of x as a braille plot"""
+    try:
+        options = parse_args(args[0] if args else "", shell.interactive)
+        if options is None:
+            return shell.c('BR_YELLOW', USAGE)
+        lines = render(shell, **options)
+    except PlotError as e:
+        return shell.c('BR_RED', f"Can't plot: {e}")
+    return "\n".join(lines) + "\n"
+
+def parse_args(text, interactive):
+    """Keyword arguments for render(), or None if there's nothing to plot"""
+    try:
+        tokens = shlex.split(text)
+    except ValueError as e:
+        raise PlotError(e) from None
+    if not tokens:
+        return None
+    
+    if interactive:
+        columns, rows = shutil.get_terminal_size((DEFAULT_WIDTH + 12, DEFAULT_HEIGHT + 4))
+        width, height = max(columns - 12, 10), max(rows - 6, 4)
+    else:
+        width, height = DEFAULT_WIDTH, DEFAULT_HEIGHT
+    options = {'expressions': [], 'x_range': (-10.0, 10.0), 'y_range': None,
+               'samples': None, 'width': width, 'height': height}
+    position, ranged = 0, False
+    while position < len(tokens):
+        token = tokens[position]
+        if token == '--samples':
+            options['samples'] = _count(tokens, position + 1)
+            position += 2
+        elif token == '--size':
+            size = tokens[position + 1].split('x') if position + 1 < len(tokens) else []
+            if len(size) != 2 or not all(part.isdigit() and int(part) > 0 for part in size):
+                raise PlotError("--size takes WxH, e.g. 60x16")
+            options['width'], options['height'] = int(size[0]), int(size[1])
+            position += 2
+        elif token == '--y':
+            options['y_range'] = _bounds(tokens, position + 1, "--y takes ymin ymax")
+            position += 3
+        elif options['expressions'] and not ranged and position + 1 < len(tokens) \
+                and _constant(tokens[position]) is not None and _constant(tokens[position + 1]) is not None:
+            # The first two numbers after an expression are the x range
+            options['x_range'] = _bounds(tokens, position, "xmin must be below xmax")
+            ranged = True
+            position += 2
+        else:
+            options['expressions'].append(token)
+            position += 1
+    if not options['expressions']:
+        return None
+    return options
+
+def _count(tokens, position):
+    if position >= len(tokens) or not tokens[position].isdigit():
+        raise PlotError("--samples takes a number")
+    samples = int(tokens[position])
+    if not 2 <= samples <= MAX_SAMPLES:
+        raise PlotError(f"--samples must be between 2 and {MAX_SAMPLES}")
+    return samples
+
+def _bounds(tokens, position, message):
+    low = _constant(tokens[position]) if position < len(tokens) else None
+    high = _constant(tokens[position + 1]) if position + 1 < len(tokens) else None
+    if low is None or high is None or not low < high:
+        raise PlotError(message)
+    return low, high
+
+def _constant(token):
+    """The value of a constant expression such as -2 or 2*pi, else None"""
+    try:
+        return float(token)
+    except ValueError:
+        pass
+    if ldmos.ExpressionCost(token).verdict != 'inline':
+        return None
+    outcome = ldmos.evaluate_expression(token, dict(ldmos.MATH_NAMES))
+    if outcome[0] != 'ok':
+        return None
+    try:
+        value = float(outcome[1])
+    except ValueError:
+        return None
+    return value if math.isfinite(value) else None
+
+def compile_series(expr, samples):
+    """expr as a function of x, in the sandboxed math namespace
+    
+    It runs in the shell once per sample, so the cost of all of them has
+    to fit the budget for inline evaluation.
+    """
+    try:
+        ast.parse(expr, mode='eval')
+    except SyntaxError:
+        raise PlotError(f"{expr} is not an expression") from None
+    cost = ldmos.ExpressionCost(expr, numbers=('x',))
+    if cost.verdict != 'inline':
+        raise PlotError(f"{expr} {cost.describe()}")
+    work = cost.work * samples
+    if work > ldmos.EVAL_INLINE_WORK:
+        raise PlotError(f"{expr} takes ~{work:.3g} operations over {samples} samples;"
+                        f" that's over the {ldmos.EVAL_INLINE_WORK:.3g} budget")
+    namespace = dict(ldmos.MATH_NAMES, __builtins__={})
+    # The expression parsed on its own, so the parentheses hold all of it
+    return eval(f"lambda x: ({expr})", namespace)
+
+def sample(func, x_min, x_max, count):
+    """func at count evenly spaced points, as doubles (nan where it fails)"""
+    step = (x_max - x_min) / (count - 1)
+    ys = array('d')
+    for start in range(0, count, BATCH):
+        xs = [x_min + i * step for i in range(start, min(start + BATCH, count))]
+        try:
+            ys.extend(array('d', map(func, xs)))
+        except Exception:
+            # Domain errors, complex results and the like: one point at a time
+            ys.extend(map(_safe(func), xs))
+    return ys
+
+def _safe(func):
+    def call(x):
+        try:
+            value = func(x)
+            return float(value)
+        except Exception:
+            return math.nan
+    return call
+
+def column_spans(ys, columns):
+    """Per dot column: (low, high, first, last) of its finite samples, or None"""
+    count = len(ys)
+    spans = []
+    isfinite = math.isfinite
+    for column in range(columns):
+        start, end = count * column // columns, count * (column + 1) // columns
+        values = list(filter(isfinite, ys[start:end]))
+        spans.append((min(values), max(values), values[0], values[-1]) if values else None)
+    return spans
+
+def render(shell, expressions, x_range, y_range, samples, width, height):
+    """The plot's lines: y labels and braille rows, the x range, a legend"""
+    x_min, x_max = x_range
+    dots_x, dots_y = width * 2, height * 4
+    samples = samples or dots_x * OVERSAMPLING
+    
+    # Check every expression's budget before sampling any of them
+    funcs = [compile_series(expr, samples) for expr in expressions]
+    series = []
+    for expr, func in zip(expressions, funcs):
+        ys = sample(func, x_min, x_max, samples)
+        series.append((expr, column_spans(ys, dots_x)))
+    
+    if y_range is None:
+        lows = [span[0] for _, spans in series for span in spans if span]
+        highs = [span[1] for _, spans in series for span in spans if span]
+        if not lows:
+            raise PlotError("no finite values in that range")
+        y_min, y_max = min(lows), max(highs)
+        if y_min == y_max:
+            y_min, y_max = y_min - 1, y_max + 1
+    else:
+        y_min, y_max = y_range
+    scale = (dots_y - 1) / (y_max - y_min)
+    
+    def dot_row(y):
+        return dots_y - 1 - round((y - y_min) * scale)
+    
+    bits = [[0] * width for _ in range(height)]
+    owner = [[-1] * width for _ in range(height)]
+    braille = ldmos._BRAILLE_BITS
+    
+    def set_dot(x, row, index):
+        cell_row, cell = row >> 2, x >> 1
+        bits[cell_row][cell] |= braille[x & 1][row & 3]
+        if index >= 0 or owner[cell_row][cell] < 0:
+            owner[cell_row][cell] = index
+    
+    # Axes first, so the series are drawn over them
+    if y_min <= 0 <= y_max:
+        row = dot_row(0)
+        for x in range(dots_x):
+            set_dot(x, row, -1)
+    if x_min <= 0 <= x_max:
+        x = round(-x_min / (x_max - x_min) * (dots_x - 1))
+        for row in range(dots_y):
+            set_dot(x, row, -1)
+    
+    # Steps up to half the height are joined to the previous column, so
+    # steep parts stay connected; bigger ones are poles and left open
+    jump = (y_max - y_min) / 2
+    for index, (_, spans) in enumerate(series):
+        previous = None
+        for x, span in enumerate(spans):
+            if span is None:
+                previous = None
+                continue
+            low, high, first, last = span
+            if previous is not None and abs(first - previous) <= jump:
+                low, high = min(low, previous), max(high, previous)
+            previous = last
+            if high < y_min or low > y_max:
+                continue
+            top = max(dot_row(min(high, y_max)), 0)
+            bottom = min(dot_row(max(low, y_min)), dots_y - 1)
+            for row in range(top, bottom + 1):
+                set_dot(x, row, index)
+    
+    c = shell.c
+    colors = [shell.active_theme().accent] + [c(name) for name in SERIES_COLORS]
+    axis, reset = c('DIM'), c('RST')
+    labels = {0: f"{y_max:.4g}", height - 1: f"{y_min:.4g}"}
+    if y_min < 0 < y_max:
+        labels.setdefault(dot_row(0) >> 2, "0")
+    else:
+        row = height // 2
+        labels[row] = f"{y_min + (dots_y - 2.5 - 4 * row) / scale:.4g}"
+    margin = max(map(len, labels.values()))
+    
+    lines = []
+    for cell_row in range(height):
+        parts = [labels.get(cell_row, "").rjust(margin), " ┤" if cell_row in labels else " │"]
+        current = None
+        for cell, index in zip(bits[cell_row], owner[cell_row]):
+            if not cell:
+                parts.append(" ")
+                continue
+            color = axis if index < 0 else colors[index % len(colors)]
+            if color != current:
+                parts.append(reset + color)
+                current = color
+            parts.append(chr(0x2800 + cell))
+        parts.append(reset)
+        lines.append("".join(parts))
+    
+    left, right = f"{x_min:.4g}", f"{x_max:.4g}"
+    lines.append(" " * margin + " └" + "─" * width)
+    lines.append(" " * (margin + 2) + left + right.rjust(width - len(left)))
+    lines.append(" " * (margin + 2) + "   ".join(
+        colors[index % len(colors)] + "⣿ " + reset + expr for index, (expr, _) in enumerate(series))
+        + c('DIM', f"   ({samples} samples)") + reset)
+    return lines
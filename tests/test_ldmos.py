@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Regression tests for ldmos.py: run with `python -m pytest tests`
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ldmos
+
+def test_percent_format_width_is_not_inline():
+    assert ldmos.ExpressionCost("'%0400000000d' % 1").verdict != 'inline'
+    assert ldmos.ExpressionCost("'%0200000d' % 1").verdict == 'limited'
+    assert ldmos.ExpressionCost("'%*d' % (5, 1)").verdict == 'limited'
+    assert ldmos.ExpressionCost("'%5.2f%%' % pi").verdict == 'inline'
+
+def test_format_spec_width_is_not_inline():
+    assert ldmos.ExpressionCost("f'{1:>400000000}'").verdict != 'inline'
+    assert ldmos.ExpressionCost("f'{1:>200000}'").verdict == 'limited'
+    assert ldmos.ExpressionCost("f'{1:{pi}}'").verdict == 'limited'
+    assert ldmos.ExpressionCost("f'{pi:.3f} and {e}'").verdict == 'inline'
+
+def _session(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_STATE_HOME', str(tmp_path))
+    session = ldmos.EnhancedλOS().new_session(1)
+    session.interactive = False
+    return session
+
+def test_history_search_finds_newest_entry_in_batch_mode(tmp_path, monkeypatch):
+    session = _session(tmp_path, monkeypatch)
+    session.history.append("echo older")
+    session.history.append("echo newest")
+    output = session.process_command("history search echo")
+    assert "echo newest" in output and "echo older" in output
+
+def test_history_search_leaves_out_itself(tmp_path, monkeypatch):
+    session = _session(tmp_path, monkeypatch)
+    session.interactive = True
+    session.process_command("echo hi")
+    output = session.process_command("history rsearch hi")
+    assert "echo hi" in output and "rsearch" not in output